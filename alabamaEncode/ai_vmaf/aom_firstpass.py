@@ -1,9 +1,14 @@
 import os
 import random
-import struct
+import shlex
+from typing import Dict
 
+import numpy as np
+
+from alabamaEncode.core.ffmpeg import Ffmpeg
 from alabamaEncode.core.util.bin_utils import get_binary
-from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.cli_executor import run_cli, CliPipeline
+from alabamaEncode.core.util.path import PathAlabama
 from alabamaEncode.scene.chunk import ChunkObject
 
 # big shoutout to @master_of_zen for this
@@ -36,28 +41,162 @@ fields = [
     "count",
     "raw_error_stdev",
 ]
+record_size = len(fields) * 8  # FIRSTPASS_STATS is all doubles
+
+
+def read_firstpass_stats(pass_file_path: str, per_frame_only=True) -> np.ndarray:
+    """
+    :param per_frame_only: drop the record with the totals over the whole pass aomenc writes last
+    :return: (records, len(fields)) float64 array of the FIRSTPASS_STATS records in the pass file
+    """
+    records = os.path.getsize(pass_file_path) // record_size
+    stats = np.fromfile(pass_file_path, dtype=np.float64, count=records * len(fields))
+    stats = stats.reshape(records, len(fields))
+    if per_frame_only:
+        # every frame's record counts one frame, the totals count all of them
+        stats = stats[stats[:, fields.index("count")] == 1]
+    return stats
 
 
 def aom_extract_firstpass_data(chunk: ChunkObject, vf=""):
     pass_file_path = f"/tmp/{random.randint(0, 100000)}.pass"
 
     run_cli(
-        f"{chunk.create_chunk_ffmpeg_pipe_command(video_filters=vf)} | {get_binary('aomenc')} - "
-        f"--ivf --fpf={pass_file_path} --threads=8 --passes=2 --pass=1 --auto-alt-ref=1 --lag-in-frames=25 "
-        f"-o {os.devnull}"
+        CliPipeline(
+            shlex.split(chunk.create_chunk_ffmpeg_pipe_command(video_filters=vf)),
+            [
+                get_binary("aomenc"),
+                "-",
+                "--ivf",
+                f"--fpf={pass_file_path}",
+                "--threads=8",
+                "--passes=2",
+                "--pass=1",
+                "--auto-alt-ref=1",
+                "--lag-in-frames=25",
+                "-o",
+                os.devnull,
+            ],
+        )
     ).verify()
 
-    dict_list = []
-
-    with open(pass_file_path, "rb") as file:
-        frame_buf = file.read(208)
-        while len(frame_buf) > 0 and len(frame_buf) % 208 == 0:
-            stats = struct.unpack("d" * 26, frame_buf)
-            p = dict(zip(fields, stats))
-            dict_list.append(p)
-            frame_buf = file.read(208)
+    dict_list = [
+        dict(zip(fields, stats))
+        for stats in read_firstpass_stats(pass_file_path, per_frame_only=False).tolist()
+    ]
 
     os.remove(pass_file_path)
 
     # print(json.dumps(dict_list, indent=4))
     return dict_list
+
+
+class FirstPassIndex:
+    """
+    Per-frame aomenc first pass stats of a whole source, from one pass over a downscaled decode, saved as a .npy of
+    float32 records. Chunk complexity, cost prediction and similar per chunk estimates can be read from it
+    instead of probing every chunk.
+    example:
+    index = FirstPassIndex.build(input_file, f"{temp_folder}firstpass_index.npy")
+    chunk.complexity = index.get_complexity(chunk)
+    """
+
+    dtype = np.dtype([(name, np.float32) for name in fields])
+    height = 360
+
+    def __init__(self, stats: np.ndarray):
+        self.stats = stats
+
+    def __len__(self):
+        return len(self.stats)
+
+    @staticmethod
+    def build(input_file: str, index_path: str, threads: int = None):
+        """
+        Load the index from `index_path`, or run the first pass over `input_file` and save it there
+        :param threads: aomenc threads, all cores by default
+        """
+        if os.path.exists(index_path):
+            return FirstPassIndex(np.load(index_path, mmap_mode="r"))
+
+        if threads is None:
+            threads = os.cpu_count()
+
+        height = min(FirstPassIndex.height, Ffmpeg.get_height(PathAlabama(input_file)))
+        pass_file_path = f"{index_path}.pass"
+        run_cli(
+            CliPipeline(
+                [
+                    get_binary("ffmpeg"),
+                    "-v",
+                    "error",
+                    "-nostdin",
+                    "-hwaccel",
+                    "auto",
+                    "-i",
+                    input_file,
+                    "-map",
+                    "0:v:0",
+                    "-an",
+                    "-sn",
+                    "-vf",
+                    f"scale=-2:{height}",
+                    "-pix_fmt",
+                    "yuv420p",
+                    "-strict",
+                    "-1",
+                    "-f",
+                    "yuv4mpegpipe",
+                    "-",
+                ],
+                [
+                    get_binary("aomenc"),
+                    "-",
+                    "--ivf",
+                    f"--fpf={pass_file_path}",
+                    f"--threads={threads}",
+                    "--passes=2",
+                    "--pass=1",
+                    "--auto-alt-ref=1",
+                    "--lag-in-frames=25",
+                    "-o",
+                    os.devnull,
+                ],
+            )
+        ).verify(fail_message=f"First pass over {input_file} failed")
+
+        records = read_firstpass_stats(pass_file_path)
+        os.remove(pass_file_path)
+        stats = np.empty(len(records), dtype=FirstPassIndex.dtype)
+        for i, name in enumerate(fields):
+            stats[name] = records[:, i]
+
+        with open(f"{index_path}.tmp", "wb") as f:
+            np.save(f, stats)
+        os.replace(f"{index_path}.tmp", index_path)
+        return FirstPassIndex(stats)
+
+    def get_frames(self, chunk: ChunkObject) -> np.ndarray:
+        """
+        :return: the records of the chunk's frames, empty if the index doesn't cover the chunk
+        """
+        return self.stats[chunk.first_frame_index : chunk.last_frame_index]
+
+    def get_chunk_stats(self, chunk: ChunkObject) -> Dict[str, float]:
+        """
+        :return: mean of every field over the chunk's frames, e.g. for crf guesses
+        """
+        frames = self.get_frames(chunk)
+        if len(frames) == 0:
+            return {}
+        return {name: float(frames[name].mean()) for name in fields}
+
+    def get_complexity(self, chunk: ChunkObject) -> float:
+        """
+        :return: mean inter coded error of the chunk's frames, -1 if it's not in the index
+        """
+        frames = self.get_frames(chunk)
+        if len(frames) == 0:
+            return -1
+        # floor it so static chunks still count as some work in the cost model
+        return max(float(frames["coded_error"].mean()), 1.0)
@@ -200,6 +200,48 @@ def read_args(ctx):
         dest="scene_merge",
     )
 
+    encode.add_argument(
+        "--scene_detection_workers",
+        help="Split scene detection into segments detected in parallel over this many processes, "
+        "-1 for one per core, default 1 for a single pass",
+        type=int,
+        default=ctx.scene_detection_workers,
+        dest="scene_detection_workers",
+    )
+
+    encode.add_argument(
+        "--fast_scene_detection",
+        help="Detect scenes on 360p luma only frames decoded by ffmpeg, several times faster on high resolution "
+        "sources but blind to hue/saturation only changes",
+        action="store_true",
+        dest="fast_scene_detection",
+    )
+
+    encode.add_argument(
+        "--streaming_scene_detection",
+        help="Start encoding the first scenes while the rest of the file is still being scene detected, "
+        "the content analysis only sees the first few scenes",
+        action="store_true",
+        dest="streaming_scene_detection",
+    )
+
+    encode.add_argument(
+        "--firstpass_index",
+        help="Run one aomenc first pass over the downscaled source and take the chunk complexities "
+        "(used by --chunk_order lpt) from its stats",
+        action="store_true",
+        dest="firstpass_index",
+    )
+
+    encode.add_argument(
+        "--keyframe_aligned_chunks",
+        help="Index the keyframes of the source and split long scenes on them, "
+        "so seeking to those chunks doesn't decode frames that get thrown away, "
+        "chunks that start on a scene cut aren't moved",
+        action="store_true",
+        dest="keyframe_aligned_chunks",
+    )
+
     encode.add_argument(
         "--no_crf_based_vmaf_targeting",
         "--crf_mode",
@@ -210,7 +252,9 @@ def read_args(ctx):
 
     encode.add_argument(
         "--chunk_order",
-        help="Encode chunks in a specific order",
+        help="Encode chunks in a specific order, "
+        "`lpt` dispatches the chunks with the longest predicted encode time first, "
+        "it needs --firstpass_index, without it it's the same as length_desc",
         type=str,
         default=ctx.chunk_order,
         choices=[
@@ -220,6 +264,7 @@ def read_args(ctx):
             "length_asc",
             "sequential_reverse",
             "even",
+            "lpt",
         ],
         dest="chunk_order",
     )
@@ -316,6 +361,68 @@ def read_args(ctx):
         dest="dry_run",
     )
 
+    encode.add_argument(
+        "--kv_backend",
+        help="Where to keep the job state in the temp folder, "
+        "`sqlite` uses a WAL-mode SQLite database that processes on the same host can write concurrently",
+        type=str,
+        default=ctx.kv_backend,
+        choices=["wal", "sqlite"],
+        dest="kv_backend",
+    )
+
+    encode.add_argument(
+        "--probe_cache",
+        help="Reuse probe results across jobs, kept in ~/.alabamaEncoder/probe_cache.sqlite3",
+        action="store_true",
+        dest="probe_cache",
+    )
+
+    encode.add_argument(
+        "--frame_cache",
+        help="Decode each chunk once into this folder (ideally tmpfs, e.g. /dev/shm/alabama) "
+        "and feed probe encodes and their metric references from there",
+        type=str,
+        default=ctx.frame_cache_folder,
+        dest="frame_cache_folder",
+    )
+
+    encode.add_argument(
+        "--frame_cache_size",
+        help="Size budget of the frame cache in GiB, least recently used chunks are evicted past it",
+        type=float,
+        default=ctx.frame_cache_size,
+        dest="frame_cache_size",
+    )
+
+    encode.add_argument(
+        "--vmaf_backend",
+        help="How to calculate vmaf, `libvmaf` scores in-process through libvmaf (found via ALABAMA_LIBVMAF "
+        "or the system library path) and falls back to the vmaf cli if it can't be loaded",
+        type=str,
+        default=ctx.vmaf_backend,
+        choices=["cli", "libvmaf"],
+        dest="vmaf_backend",
+    )
+
+    encode.add_argument(
+        "--ssim_backend",
+        help="How to calculate ssim & ssimulacra2, `native` scores the decoded frames in-process with numpy "
+        "and falls back to ffmpeg/ssimulacra2_rs if that fails",
+        type=str,
+        default=ctx.ssim_backend,
+        choices=["cli", "native"],
+        dest="ssim_backend",
+    )
+
+    encode.add_argument(
+        "--adaptive_probe_vmaf",
+        help="Score only a subsample (~64 frames) of each chunk in probes, "
+        "with the libvmaf backend also stop once the running mean is confidently above/below the target",
+        action="store_true",
+        dest="adaptive_probe_vmaf",
+    )
+
     encode.add_argument(
         "--title", help="Title of the video", type=str, default=ctx.title, dest="title"
     )
@@ -619,6 +726,13 @@ def read_args(ctx):
     ctx.prototype_encoder.grain_synth = args.grain
     ctx.log_level = args.log_level
     ctx.dry_run = args.dry_run
+    ctx.kv_backend = args.kv_backend
+    ctx.probe_cache = args.probe_cache
+    ctx.frame_cache_folder = args.frame_cache_folder
+    ctx.frame_cache_size = args.frame_cache_size
+    ctx.vmaf_backend = args.vmaf_backend
+    ctx.ssim_backend = args.ssim_backend
+    ctx.adaptive_probe_vmaf = args.adaptive_probe_vmaf
     ctx.ssim_db_target = args.ssim_db_target
     ctx.simple_denoise = args.simple_denoise
     ctx.vmaf = args.vmaf_target
@@ -676,6 +790,11 @@ def read_args(ctx):
     ctx.dynamic_vmaf_target_vbr = args.dynamic_vmaf_target_vbr
     ctx.statically_sized_scenes = args.statically_sized_scenes
     ctx.scene_merge = args.scene_merge
+    ctx.scene_detection_workers = args.scene_detection_workers
+    ctx.fast_scene_detection = args.fast_scene_detection
+    ctx.streaming_scene_detection = args.streaming_scene_detection
+    ctx.firstpass_index = args.firstpass_index
+    ctx.keyframe_aligned_chunks = args.keyframe_aligned_chunks
     ctx.args_tune = args.tune
     ctx.denoise_vmaf_ref = args.denoise_vmaf_ref
     ctx.multi_res_pipeline = args.multi_res_pipeline
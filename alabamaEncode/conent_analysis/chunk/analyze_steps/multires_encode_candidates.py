@@ -9,7 +9,10 @@ from alabamaEncode.conent_analysis.opinionated_vmaf import (
 )
 from alabamaEncode.encoder.encoder import Encoder
 from alabamaEncode.encoder.stats import EncodeStats
-from alabamaEncode.metrics.calculate import get_metric_from_stats
+from alabamaEncode.metrics.calculate import (
+    calculate_metric_batch,
+    get_metric_from_stats,
+)
 from alabamaEncode.metrics.metric import Metric
 from alabamaEncode.scene.chunk import ChunkObject
 
@@ -24,6 +27,8 @@ class EncodeMultiResCandidates(ChunkAnalyzePipelineItem):
 
         ctx.vmaf_reference_display = "FHD"
         vmaf_options = ctx.get_vmaf_options()
+        vmaf_options.cache_reference = True
+        probe_cache = ctx.get_probe_cache()
 
         probe_folder_path = (
             os.path.join(os.path.dirname(chunk.chunk_path), f"{chunk.chunk_index}")
@@ -33,6 +38,7 @@ class EncodeMultiResCandidates(ChunkAnalyzePipelineItem):
 
         ogspeed = enc.speed
         enc.speed = 13
+        enc.cache_decoded_frames = True
 
         def log(_str):  # macro
             ctx.log(
@@ -40,6 +46,27 @@ class EncodeMultiResCandidates(ChunkAnalyzePipelineItem):
                 category="multi_res",
             )
 
+        def save_candidate(res, crf, output_path, stats: EncodeStats):
+            vmaf = get_metric_from_stats(
+                stats, statistical_representation=ctx.vmaf_target_representation
+            )
+
+            log(f"Res: {res} VMAF: {vmaf} CRF: {crf} Bitrate: {stats.bitrate}")
+
+            ctx.get_kv().set(
+                "multi_res_candidates",
+                f"{chunk.chunk_index}_{res.split(':')[0]}_{crf}",
+                {
+                    "vmaf": vmaf,
+                    "crf": crf,
+                    "bitrate": stats.bitrate,
+                    "file": output_path,
+                    "res": res,
+                },
+            )
+
+        # (res, crf, output path, stats, probe cache key) of the encodes still missing a score
+        pending = []
         for res in resolutions:
             vf = ctx.prototype_encoder.video_filters.split(",")
             scale_str = f"scale={res}:flags=lanczos"
@@ -74,27 +101,40 @@ class EncodeMultiResCandidates(ChunkAnalyzePipelineItem):
                 ):
                     continue
 
-                stats: EncodeStats = enc.run(
-                    metric_params=vmaf_options, metric_to_calculate=Metric.VMAF
-                )
-
-                vmaf = get_metric_from_stats(
-                    stats, statistical_representation=ctx.vmaf_target_representation
-                )
-
-                log(f"Res: {res} VMAF: {vmaf} CRF: {crf} Bitrate: {stats.bitrate}")
-
-                ctx.get_kv().set(
-                    "multi_res_candidates",
-                    f"{chunk.chunk_index}_{res_name_short}_{crf}",
-                    {
-                        "vmaf": vmaf,
-                        "crf": crf,
-                        "bitrate": stats.bitrate,
-                        "file": enc.output_path,
-                        "res": res,
-                    },
-                )
+                stats = None
+                cache_key = None
+                if probe_cache is not None:
+                    cache_key = probe_cache.get_key(enc, Metric.VMAF, vmaf_options)
+                    stats = probe_cache.get(cache_key)
+                if stats is None:
+                    # scored together with the other candidates once they are all encoded
+                    stats: EncodeStats = enc.run()
+                    pending.append((res, crf, enc.output_path, stats, cache_key))
+                    continue
+                if not os.path.exists(enc.output_path):
+                    # the trellis picks from the candidate files, only the metric can come from the cache
+                    enc.run()
+                save_candidate(res, crf, enc.output_path, stats)
+
+        if len(pending) > 0:
+            # every candidate is compared to the same FHD reference, decode it once for all of them
+            vmaf_options.threads = enc.threads
+            vmaf_options.video_filters = enc.video_filters
+            results = calculate_metric_batch(
+                chunk=chunk,
+                distorted_paths=[output_path for _, _, output_path, _, _ in pending],
+                options=vmaf_options,
+                metric=Metric.VMAF,
+            )
+            with ctx.get_kv().batch():
+                for (res, crf, output_path, stats, cache_key), result in zip(
+                    pending, results
+                ):
+                    stats.metric_results = result
+                    if probe_cache is not None:
+                        probe_cache.set(cache_key, stats)
+                    save_candidate(res, crf, output_path, stats)
 
         enc.speed = ogspeed
+        enc.cache_decoded_frames = False
         return enc
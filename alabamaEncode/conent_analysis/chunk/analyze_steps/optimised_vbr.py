@@ -71,6 +71,7 @@ def get_ideal_bitrate(
                 chunk,
                 get_db=True,
                 video_filters=config.prototype_encoder.video_filters,
+                native=config.ssim_backend == "native",
             )
         except Exception as e:
             print(f"Error calculating ssim for complexity rate estimation: {e}")
@@ -9,6 +9,7 @@ from alabamaEncode.conent_analysis.opinionated_vmaf import (
     get_crf_limits,
     get_vmaf_probe_speed,
     get_vmaf_probe_offset,
+    get_probe_vmaf_options,
 )
 from alabamaEncode.core.context import AlabamaContext
 from alabamaEncode.encoder.encoder import Encoder
@@ -35,12 +36,20 @@ class TargetVmaf(ChunkAnalyzePipelineItem):
         metric, target_metric = ctx.get_metric_target()
 
         probe_file_base = ctx.get_probe_file_base(chunk.chunk_path)
+        probe_cache = ctx.get_probe_cache()
 
-        def get_score(_crf):
+        def get_score(_crf, early_stop=True):
+            """
+            :param early_stop: allow the metric to stop once it's confidently above or below the target
+            :return: the score, and whether it stopped early, then it's only good for the above/below decision
+            """
             kv_key = f"{chunk.chunk_index}_{_crf}"
             result_from_kv = kv.get(bucket="target_vmaf_probes", key=kv_key)
-            if result_from_kv is not None:
-                return float(result_from_kv)
+            if isinstance(result_from_kv, dict):
+                if early_stop or not result_from_kv["stopped_early"]:
+                    return result_from_kv["score"], result_from_kv["stopped_early"]
+            elif result_from_kv is not None:
+                return float(result_from_kv), False
 
             enc_copy.crf = _crf
             enc_copy.output_path = os.path.join(
@@ -49,12 +58,28 @@ class TargetVmaf(ChunkAnalyzePipelineItem):
             )
             enc_copy.speed = max(get_vmaf_probe_speed(enc_copy, ctx), enc.speed)
             enc_copy.override_flags = ""
-            # TODO: calculate metrics outside enc.run to add the flexibility to calc other ones
-            stats: EncodeStats = enc_copy.run(
-                metric_to_calculate=metric,
-                metric_params=ctx.get_vmaf_options(),
-                override_if_exists=False,
+            enc_copy.cache_decoded_frames = True
+            # the probe offset gets added to the result, so that's what the early stop compares against
+            metric_params = get_probe_vmaf_options(
+                ctx, chunk, target_metric - get_vmaf_probe_offset(enc_copy)
             )
+            metric_params.cache_reference = True
+            if not early_stop:
+                metric_params.early_stop_target = None
+
+            stats = None
+            if probe_cache is not None:
+                cache_key = probe_cache.get_key(enc_copy, metric, metric_params)
+                stats = probe_cache.get(cache_key)
+            if stats is None:
+                # TODO: calculate metrics outside enc.run to add the flexibility to calc other ones
+                stats: EncodeStats = enc_copy.run(
+                    metric_to_calculate=metric,
+                    metric_params=metric_params,
+                    override_if_exists=False,
+                )
+                if probe_cache is not None:
+                    probe_cache.set(cache_key, stats)
 
             # TODO: offset the faster preset by metric amount
             result = get_metric_from_stats(
@@ -64,8 +89,13 @@ class TargetVmaf(ChunkAnalyzePipelineItem):
             if metric == Metric.VMAF:
                 result += get_vmaf_probe_offset(enc_copy)
 
-            kv.set(bucket="target_vmaf_probes", key=kv_key, value=result)
-            return result
+            stopped_early = stats.metric_results.stopped_early
+            kv.set(
+                bucket="target_vmaf_probes",
+                key=kv_key,
+                value={"score": result, "stopped_early": stopped_early},
+            )
+            return result, stopped_early
 
         probes = ctx.probe_count
         if probes > 3:
@@ -101,7 +131,7 @@ class TargetVmaf(ChunkAnalyzePipelineItem):
             if mid_crf in [t[0] for t in trys]:
                 break
 
-            statistical_representation = get_score(mid_crf)
+            statistical_representation, stopped_early = get_score(mid_crf)
 
             ctx.log(
                 f"{chunk.log_prefix()} crf: {mid_crf} {metric.name}: {statistical_representation} "
@@ -114,7 +144,7 @@ class TargetVmaf(ChunkAnalyzePipelineItem):
             else:
                 high_crf = mid_crf - 1
 
-            trys.append((mid_crf, statistical_representation))
+            trys.append((mid_crf, statistical_representation, stopped_early))
             depth += 1
 
         # To limit the overhead, we do only 2-3 binary search probes.
@@ -125,9 +155,15 @@ class TargetVmaf(ChunkAnalyzePipelineItem):
             # sort by metric difference from target
             points = sorted(trys, key=lambda _x: abs(_x[1] - target_metric))
 
-            # get the two closest points
-            crf_low, metric_low = points[0]
-            crf_high, metric_high = points[1]
+            # get the two closest points, an early stopped score is a mean over however many frames it took to
+            # tell it apart from the target, so it's scored again over all the (subsampled) frames to interpolate
+            closest = []
+            for _crf, score, stopped_early in points[:2]:
+                if stopped_early:
+                    score, _ = get_score(_crf, early_stop=False)
+                closest.append((_crf, score))
+            crf_low, metric_low = closest[0]
+            crf_high, metric_high = closest[1]
 
             # means multiple probes got the same score, aka all back screens etc
             if metric_high - metric_low == 0:
@@ -1,3 +1,4 @@
+import copy
 import os
 import shutil
 from typing import Tuple
@@ -5,13 +6,16 @@ from typing import Tuple
 from alabamaEncode.conent_analysis.chunk.final_encode_step import (
     FinalEncodeStep,
 )
-from alabamaEncode.conent_analysis.opinionated_vmaf import get_crf_limits
+from alabamaEncode.conent_analysis.opinionated_vmaf import (
+    get_crf_limits,
+    get_probe_vmaf_options,
+)
 from alabamaEncode.core.context import AlabamaContext
 from alabamaEncode.encoder.codec import Codec
 from alabamaEncode.encoder.encoder import Encoder
 from alabamaEncode.encoder.rate_dist import EncoderRateDistribution
 from alabamaEncode.encoder.stats import EncodeStats
-from alabamaEncode.metrics.calculate import get_metric_from_stats
+from alabamaEncode.metrics.calculate import calculate_metric, get_metric_from_stats
 from alabamaEncode.metrics.metric import Metric
 from alabamaEncode.scene.chunk import ChunkObject
 
@@ -91,9 +95,16 @@ class DynamicTargetVmaf(FinalEncodeStep):
         original_speed = enc.speed
         original_output_path = enc.output_path
         probe_file_base = ctx.get_probe_file_base(chunk.chunk_path)
+        probe_cache = ctx.get_probe_cache()
         trys = []
         stats = None
 
+        def get_probe_path(crf) -> str:
+            return os.path.join(
+                probe_file_base,
+                f"{chunk.chunk_index}_{crf}{enc.get_chunk_file_extension()}",
+            )
+
         def finish(_stats, crf):
             score_err = get_weighed_vmaf_score(
                 stats,
@@ -107,9 +118,24 @@ class DynamicTargetVmaf(FinalEncodeStep):
                 f" score_error: {score_err}; bitrate: {_stats.bitrate} kb/s"
             )
             ctx.get_kv().set("best_crfs", chunk.chunk_index, crf)
+            enc.crf = crf
+            enc.output_path = get_probe_path(crf)
+            if not os.path.exists(enc.output_path):
+                # the probe came from the probe cache, so there is no file to keep yet
+                enc.run()
             os.rename(enc.output_path, original_output_path)
             if os.path.exists(probe_file_base):
                 shutil.rmtree(probe_file_base)
+            if ctx.adaptive_probe_vmaf and ctx.calc_final_vmaf:
+                # probes only scored part of the chunk, the accepted encode gets a full-rate score
+                final_chunk = copy.deepcopy(chunk)
+                final_chunk.chunk_path = original_output_path
+                final_options = ctx.get_vmaf_options()
+                final_options.threads = enc.threads
+                final_options.video_filters = enc.video_filters
+                _stats.metric_results = calculate_metric(
+                    chunk=final_chunk, options=final_options, metric=Metric.VMAF
+                )
             return _stats
 
         metric_name = "vmaf"
@@ -126,15 +152,21 @@ class DynamicTargetVmaf(FinalEncodeStep):
             :return: [vmaf error, stats, vmaf]
             """
             enc.crf = crf
-            enc.output_path = os.path.join(
-                probe_file_base,
-                f"{chunk.chunk_index}_{enc.crf}{enc.get_chunk_file_extension()}",
-            )
+            enc.output_path = get_probe_path(crf)
+            metric_params = get_probe_vmaf_options(ctx, chunk, metric_target)
+            metric_params.cache_reference = True
             nonlocal stats
-            stats = enc.run(
-                metric_to_calculate=Metric.VMAF,
-                metric_params=ctx.get_vmaf_options(),
-            )
+            stats = None
+            if probe_cache is not None:
+                cache_key = probe_cache.get_key(enc, Metric.VMAF, metric_params)
+                stats = probe_cache.get(cache_key)
+            if stats is None:
+                stats = enc.run(
+                    metric_to_calculate=Metric.VMAF,
+                    metric_params=metric_params,
+                )
+                if probe_cache is not None:
+                    probe_cache.set(cache_key, stats)
             _metric = get_metric_from_stats(
                 stats, statistical_representation=ctx.vmaf_target_representation
             )
@@ -177,6 +209,7 @@ class DynamicTargetVmaf(FinalEncodeStep):
         )
         enc.passes = 1
         enc.rate_distribution = EncoderRateDistribution.CQ
+        enc.cache_decoded_frames = True
 
         best_crf_from_kv = ctx.get_kv().get("best_crfs", chunk.chunk_index)
         if best_crf_from_kv is not None:
@@ -5,6 +5,7 @@ from alabamaEncode.core.context import AlabamaContext
 from alabamaEncode.encoder.encoder import Encoder
 from alabamaEncode.encoder.stats import EncodeStats
 from alabamaEncode.metrics.metric import Metric
+from alabamaEncode.metrics.result import ArrayMetricResult
 from alabamaEncode.scene.chunk import ChunkObject
 
 
@@ -19,16 +20,14 @@ class PlainFinalEncode(FinalEncodeStep):
             on_frame_encoded=encoded_a_frame,
         )
         if metric == Metric.VMAF and ctx.calc_final_vmaf:
-            if stats.metric_results.frames is not None:
-                vmaf_frame_scores = {}
-                for frame in stats.metric_results.frames:
-                    vmaf_frame_scores[frame["frameNum"]] = frame["metrics"]["vmaf"]
-                ctx.get_kv().set(
-                    "vmaf_frame_scores",
-                    chunk.chunk_index,
-                    vmaf_frame_scores,
-                    individual_mode=True,
-                )
+            if isinstance(stats.metric_results, ArrayMetricResult):
+                if stats.metric_results.has_scores():
+                    ctx.get_kv().set(
+                        "vmaf_frame_scores",
+                        chunk.chunk_index,
+                        stats.metric_results.get_frame_scores(),
+                        individual_mode=True,
+                    )
 
         return stats
 
@@ -43,6 +43,22 @@ def get_vmaf_probe_offset(enc: Encoder) -> int:
             return 0
 
 
+def get_probe_vmaf_options(ctx, chunk, target: float):
+    """
+    Vmaf options for a probe. With ctx.adaptive_probe_vmaf only ~64 frames of the chunk are scored,
+    and with the libvmaf backend scoring stops once the running mean is confidently above or below `target`
+    """
+    options = ctx.get_vmaf_options()
+    if not ctx.adaptive_probe_vmaf:
+        return options
+    if options.subsample is None or options.subsample < 1:
+        options.subsample = max(1, chunk.get_frame_count() // 64)
+    # the interval is around the mean, it says nothing about percentiles
+    if ctx.vmaf_target_representation == "mean":
+        options.early_stop_target = target
+    return options
+
+
 def convexhull_get_resolutions(codec: Codec) -> list[str]:
     match codec:
         case Codec.av1:
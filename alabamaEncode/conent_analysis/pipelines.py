@@ -111,6 +111,9 @@ async def run_sequence_pipeline(ctx, sequence):
     )
     from alabamaEncode.conent_analysis.sequence.denoise_filtering import setup_denoise
     from alabamaEncode.conent_analysis.sequence.encoding_tiles import setup_tiles
+    from alabamaEncode.conent_analysis.sequence.firstpass_index import (
+        setup_firstpass_index,
+    )
     from alabamaEncode.conent_analysis.sequence.scrape_hdr_meta import (
         scrape_hdr_metadata,
     )
@@ -127,6 +130,7 @@ async def run_sequence_pipeline(ctx, sequence):
         tune_args_for_fdlty_or_apl,
         do_autocrop,
         setup_tiles,
+        setup_firstpass_index,
         setup_denoise,
         setup_autograin,
         setup_ssimdb_target,
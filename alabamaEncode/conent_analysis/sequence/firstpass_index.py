@@ -0,0 +1,37 @@
+from alabamaEncode.ai_vmaf.aom_firstpass import FirstPassIndex
+from alabamaEncode.core.context import AlabamaContext
+from alabamaEncode.core.util.bin_utils import BinaryNotFound
+from alabamaEncode.scene.sequence import ChunkSequence
+
+
+def setup_firstpass_index(ctx: AlabamaContext, sequence: ChunkSequence):
+    """
+    Runs one aomenc first pass over the whole (downscaled) source, and sets the complexity of every chunk from it,
+    which the chunk cost model & lpt ordering use
+    """
+    if not ctx.firstpass_index:
+        return ctx
+
+    try:
+        index = FirstPassIndex.build(
+            ctx.input_file, f"{ctx.temp_folder}firstpass_index.npy"
+        )
+    except (BinaryNotFound, RuntimeError) as e:
+        print(f"Failed to build the first pass index, skipping it: {e}")
+        return ctx
+
+    if len(sequence.chunks) > 0 and len(index) != sequence.chunks[-1].last_frame_index:
+        # e.g. a source with a different frame count than ffprobe reports, chunks past the end get no complexity
+        print(
+            f"WARNING: the first pass index has {len(index)} frames, "
+            f"but the sequence ends at frame {sequence.chunks[-1].last_frame_index}"
+        )
+
+    for chunk in sequence.chunks:
+        chunk.complexity = index.get_complexity(chunk)
+
+    ctx.log(
+        f"Loaded the first pass index of {len(index)} frames",
+        category="analyzing_content_logs",
+    )
+    return ctx
@@ -7,6 +7,7 @@ from alabamaEncode.conent_analysis.chunk.final_encode_steps.dynamic_target_vmaf
     DynamicTargetVmaf,
 )
 from alabamaEncode.core.context import AlabamaContext
+from alabamaEncode.core.frame_cache import FrameCache
 from alabamaEncode.core.util.timer import Timer
 from alabamaEncode.encoder.impl.Svtenc import EncoderSvt
 from alabamaEncode.encoder.stats import EncodeStats
@@ -39,6 +40,11 @@ class ChunkEncoder(BaseCommandObject):
         timeing = Timer()
 
         timeing.start("chunk")
+        if self.ctx.frame_cache_folder != "":
+            FrameCache.configure(
+                self.ctx.frame_cache_folder,
+                max_size=int(self.ctx.frame_cache_size * 1024**3),
+            )
         try:
             timeing.start("analyze_step")
 
@@ -72,6 +78,8 @@ class ChunkEncoder(BaseCommandObject):
             if os.path.exists(self.chunk.chunk_path):
                 os.remove(self.chunk.chunk_path)
             return
+        finally:
+            FrameCache.release(self.chunk)
 
         valid = self.chunk.verify_integrity(
             length_of_sequence=self.ctx.total_chunks, quiet=True
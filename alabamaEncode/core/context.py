@@ -9,7 +9,9 @@ from alabamaEncode.conent_analysis.chunk.chunk_analyse_step import (
     ChunkAnalyzePipelineItem,
 )
 from alabamaEncode.core.ffmpeg import Ffmpeg
-from alabamaEncode.core.util.kv import AlabamaKv
+from alabamaEncode.core.media_info import MediaInfo
+from alabamaEncode.core.probe_cache import ProbeCache
+from alabamaEncode.core.util.kv import AlabamaKv, get_kv
 from alabamaEncode.core.util.path import PathAlabama
 from alabamaEncode.encoder.encoder import Encoder
 from alabamaEncode.encoder.impl.Svtenc import EncoderSvt
@@ -37,6 +39,13 @@ class AlabamaContext:
             "log_level": self.log_level,
             "print_analysis_logs": self.print_analysis_logs,
             "dry_run": self.dry_run,
+            "kv_backend": self.kv_backend,
+            "probe_cache": self.probe_cache,
+            "frame_cache_folder": self.frame_cache_folder,
+            "frame_cache_size": self.frame_cache_size,
+            "vmaf_backend": self.vmaf_backend,
+            "ssim_backend": self.ssim_backend,
+            "adaptive_probe_vmaf": self.adaptive_probe_vmaf,
             "temp_folder": self.temp_folder,
             "output_folder": self.output_folder,
             "output_file": self.output_file,
@@ -87,6 +96,11 @@ class AlabamaContext:
             "poster_url": self.poster_url,
             "statically_sized_scenes": self.statically_sized_scenes,
             "scene_merge": self.scene_merge,
+            "scene_detection_workers": self.scene_detection_workers,
+            "fast_scene_detection": self.fast_scene_detection,
+            "streaming_scene_detection": self.streaming_scene_detection,
+            "firstpass_index": self.firstpass_index,
+            "keyframe_aligned_chunks": self.keyframe_aligned_chunks,
             "args_tune": self.args_tune,
             "denoise_vmaf_ref": self.denoise_vmaf_ref,
         }
@@ -114,6 +128,14 @@ class AlabamaContext:
     print_analysis_logs = False
     dry_run: bool = False
     kv: [AlabamaKv | None] = None
+    kv_backend = "wal"
+    probe_cache = False
+    _probe_cache: [ProbeCache | None] = None
+    frame_cache_folder = ""
+    frame_cache_size: float = 8  # GiB
+    vmaf_backend = "cli"
+    ssim_backend = "cli"
+    adaptive_probe_vmaf = False
     multi_res_pipeline = False
 
     temp_folder: str = ""
@@ -170,6 +192,11 @@ class AlabamaContext:
     max_scene_length: int = 10
     statically_sized_scenes = False
     scene_merge = False
+    scene_detection_workers: int = 1
+    fast_scene_detection = False
+    streaming_scene_detection = False
+    firstpass_index = False
+    keyframe_aligned_chunks = False
     start_offset: int = -1
     end_offset: int = -1
     override_scenecache_path_check: bool = False
@@ -223,7 +250,9 @@ class AlabamaContext:
             ),
             no_motion=self.vmaf_no_motion,
             denoise_refrence=self.denoise_vmaf_ref,
-            subsample=self.vmaf_subsample
+            subsample=self.vmaf_subsample,
+            use_libvmaf=self.vmaf_backend == "libvmaf",
+            use_native=self.ssim_backend == "native",
         )
 
     def get_metric_target(self) -> Tuple[Metric, float]:
@@ -269,9 +298,23 @@ class AlabamaContext:
 
     def get_kv(self) -> AlabamaKv:
         if self.kv is None:
-            self.kv = AlabamaKv(self.temp_folder)
+            self.kv = get_kv(self.temp_folder, self.kv_backend)
+            MediaInfo.use_kv(
+                self.kv,
+                persisted=[self.input_file, os.path.join(self.temp_folder, "chunks")],
+            )
         return self.kv
 
+    def get_probe_cache(self) -> [ProbeCache | None]:
+        """
+        :return: the cross-job probe cache, None if disabled
+        """
+        if not self.probe_cache:
+            return None
+        if self._probe_cache is None:
+            self._probe_cache = ProbeCache()
+        return self._probe_cache
+
     def get_probe_file_base(self, encoded_scene_path) -> str:
         """
         A helper function to get a probe file path derived from the encoded scene path
@@ -18,6 +18,7 @@ from alabamaEncode.core.util.bin_utils import (
 from alabamaEncode.core.util.cli_executor import run_cli
 from alabamaEncode.core.util.get_yuv_stream import get_yuv_frame_stream
 from alabamaEncode.core.util.path import PathAlabama
+from alabamaEncode.core.util.yuv import SharedFrameSlots
 from alabamaEncode.scene.chunk import ChunkObject
 
 
@@ -111,8 +112,8 @@ def face_score(frame) -> float:
     return 0
 
 
-def process_frame_worker(yuv_frame_buffer, h, w, count, calc_face=False):
-    frame = np.frombuffer(yuv_frame_buffer, dtype=np.uint8).reshape((h * 3 // 2, w))
+def process_frame_worker(slots_name, slot, frame_size, h, w, count, calc_face=False):
+    frame = SharedFrameSlots.read(slots_name, slot, frame_size).reshape((h * 3 // 2, w))
     frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420)
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     aa = {
@@ -136,6 +137,8 @@ class AutoThumbnailer:
 
         self.frame_data = []
         self.pool = multiprocessing.Pool(6)
+        # frames go to the pool through shared memory, enough slots to keep every worker busy
+        self.slots = SharedFrameSlots(12)
         self.calc_face = False
 
     def generate_previews(self, input_file: str, output_folder: str):
@@ -159,15 +162,19 @@ class AutoThumbnailer:
                 total=total_length, desc="Gathering thumbnail data", unit="frame"
             )
 
-            get_yuv_frame_stream(
-                chunk,
-                frame_callback=self.process_frame,
-                vf="\"scale=-2:min'(720,ih)':force_original_aspect_ratio=decrease\"",
-            )
+            try:
+                get_yuv_frame_stream(
+                    chunk,
+                    frame_callback=self.process_frame,
+                    vf="\"scale=-2:min'(720,ih)':force_original_aspect_ratio=decrease\"",
+                    slots=self.slots,
+                )
 
-            # await all the tasks in the pool to be finished
-            self.pool.close()
-            self.pool.join()
+                # await all the tasks in the pool to be finished
+                self.pool.close()
+                self.pool.join()
+            finally:
+                self.slots.close()
 
             with open(frame_data_path, "w") as f:
                 json.dump(self.frame_data, f)
@@ -217,19 +224,24 @@ class AutoThumbnailer:
             run_cli(command).verify()
 
     def process_frame(self, yuv_frame):
+        slot = yuv_frame.slot
         self.pool.apply_async(
             process_frame_worker,
             args=(
-                yuv_frame.buffer,
+                self.slots.name,
+                slot,
+                self.slots.frame_size,
                 yuv_frame.headers["H"],
                 yuv_frame.headers["W"],
                 yuv_frame.count,
                 self.calc_face,
             ),
-            callback=self.collect_result,
+            callback=lambda result: self.collect_result(result, slot),
+            error_callback=lambda _: self.slots.release(slot),
         )
 
-    def collect_result(self, result):
+    def collect_result(self, result, slot):
+        self.slots.release(slot)
         self.frame_data.append(result)
         self.pbar.update()
 
@@ -1,14 +1,37 @@
 import json
 import os
 import re
-from typing import Any
+import shlex
+from typing import Any, List
 
+from alabamaEncode.core.media_info import MediaInfo
 from alabamaEncode.core.util.bin_utils import get_binary, verify_ffmpeg_library
-from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.cli_executor import run_cli, CliPipeline
 from alabamaEncode.core.util.path import PathAlabama
 
 
 class Ffmpeg:
+    @staticmethod
+    def _ffprobe_stream_entry(
+        path: PathAlabama, entry: str, *extra_args: str, stream="v:0"
+    ) -> List[str]:
+        """
+        :return: argv of an ffprobe that prints a single stream entry, e.g. width, of the selected stream
+        """
+        return [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            stream,
+            *extra_args,
+            "-show_entries",
+            f"stream={entry}",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            path.get(),
+        ]
+
     @staticmethod
     def check_for_invalid(path: PathAlabama) -> bool:
         """
@@ -19,7 +42,18 @@ class Ffmpeg:
         path.check_video()
 
         return not run_cli(
-            f"ffmpeg -v error -i {path.get_safe()} -c copy -f null /dev/null"
+            [
+                "ffmpeg",
+                "-v",
+                "error",
+                "-i",
+                path.get(),
+                "-c",
+                "copy",
+                "-f",
+                "null",
+                "/dev/null",
+            ]
         ).success()
 
     @staticmethod
@@ -32,14 +66,32 @@ class Ffmpeg:
         path.check_video()
         return (
             run_cli(
-                f"ffprobe -v error -select_streams v:0 -count_packets -show_entries stream=nb_read_packets "
-                f"-of default=noprint_wrappers=1:nokey=1 {path.get_safe()}"
+                Ffmpeg._ffprobe_stream_entry(path, "nb_read_packets", "-count_packets")
             )
             .verify()
             .strip_mp4_warning()
             .get_as_int()
         )
 
+    @staticmethod
+    def get_frame_count_verified(path: PathAlabama) -> int:
+        """
+        Demux the whole file and count the packets of the first video stream in the same pass,
+        replaces a check_for_invalid + get_frame_count pair that would read the file twice
+        :param path: path to the video
+        :return: frame count, -1 if the file failed to demux
+        """
+        path.check_video()
+        result = run_cli(
+            Ffmpeg._ffprobe_stream_entry(path, "nb_read_packets", "-count_packets")
+        ).strip_mp4_warning()
+        if not result.success():
+            return -1
+        lines = result.get_output().splitlines()
+        if len(lines) == 0 or not lines[-1].strip().isdigit():
+            return -1
+        return int(lines[-1].strip())
+
     @staticmethod
     def get_frame_count_fast(path: PathAlabama):
         length_in_secs = Ffmpeg.get_video_length(path)
@@ -49,15 +101,7 @@ class Ffmpeg:
     @staticmethod
     def get_tracks(path: PathAlabama):
         path.check_video()
-        out = (
-            run_cli(
-                f'{get_binary("ffprobe")} -v error -show_entries stream -of json {path.get_safe()}'
-            )
-            .verify()
-            .strip_mp4_warning()
-            .get_output()
-        )
-        return json.loads(out)["streams"]
+        return MediaInfo.get(path).streams
 
     @staticmethod
     def get_video_length(path: PathAlabama, sexagesimal=False) -> float | str:
@@ -68,26 +112,39 @@ class Ffmpeg:
         :return: float
         """
         path.check_video()
-        cli_command = (
-            f"ffprobe -v error -show_entries format=duration {'-sexagesimal' if sexagesimal else ''}"
-            f" -of default=noprint_wrappers=1:nokey=1 {path.get_safe()}"
-        )
-        try:
-            out = (
+        if sexagesimal:
+            cli_command = [
+                "ffprobe",
+                "-v",
+                "error",
+                "-show_entries",
+                "format=duration",
+                "-sexagesimal",
+                "-of",
+                "default=noprint_wrappers=1:nokey=1",
+                path.get(),
+            ]
+            return (
                 run_cli(cli_command)
                 .verify(
                     bad_output_hints=["N/A", "Invalid data found"],
-                    fail_message=f"ffprobe failed, {cli_command}",
+                    fail_message=f"ffprobe failed, {shlex.join(cli_command)}",
                 )
                 .strip_mp4_warning()
                 .get_output()
             )
+
+        try:
+            duration = MediaInfo.get(path).duration
         except RuntimeError:
+            duration = None
+
+        if duration is None:
             frame_count = Ffmpeg.get_frame_count(path)
             fps = Ffmpeg.get_video_frame_rate(path)
             return frame_count / fps
 
-        return out if sexagesimal else float(out)
+        return duration
 
     @staticmethod
     def get_total_bitrate(path: PathAlabama) -> float:
@@ -97,41 +154,17 @@ class Ffmpeg:
     @staticmethod
     def get_height(path: PathAlabama) -> int:
         path.check_video()
-        return (
-            run_cli(
-                f"ffprobe -v error -select_streams v:0 -show_entries stream=height "
-                f"-of default=noprint_wrappers=1:nokey=1 {path.get_safe()}"
-            )
-            .verify()
-            .strip_mp4_warning()
-            .get_as_int()
-        )
+        return MediaInfo.get(path).height
 
     @staticmethod
     def get_width(path: PathAlabama) -> int:
         path.check_video()
-        return (
-            run_cli(
-                f"ffprobe -v error -select_streams v:0 -show_entries stream=width "
-                f"-of default=noprint_wrappers=1:nokey=1 {path.get_safe()}"
-            )
-            .verify()
-            .strip_mp4_warning()
-            .get_as_int()
-        )
+        return MediaInfo.get(path).width
 
     @staticmethod
     def get_pix_fmt(path: PathAlabama) -> str:
         path.check_video()
-        return (
-            run_cli(
-                f"ffprobe -v error -select_streams v:0 -show_entries stream=pix_fmt "
-                f"-of default=noprint_wrappers=1:nokey=1 {path.get_safe()}"
-            )
-            .verify()
-            .strip_mp4_warning()
-            .get_output()
-        )
+        return MediaInfo.get(path).pix_fmt
 
     @staticmethod
     def get_bit_depth(path: PathAlabama) -> int:
@@ -147,16 +180,7 @@ class Ffmpeg:
     def is_hdr(path: PathAlabama) -> bool:
         """Check if a video is HDR"""
         path.check_video()
-        out = (
-            run_cli(
-                (
-                    f"ffprobe -v quiet -show_entries stream=color_transfer "
-                    f"-of csv=p=0 -select_streams v:0 {path.get_safe()}"
-                )
-            )
-            .get_output()
-            .strip()
-        )
+        out = MediaInfo.get(path).color_transfer
 
         if "bt709" in out or "unknown" in out:
             return False
@@ -165,34 +189,12 @@ class Ffmpeg:
     @staticmethod
     def get_video_frame_rate(file: PathAlabama) -> float:
         file.check_video()
-        result = (
-            run_cli(
-                (
-                    f"ffprobe -v error -select_streams v -of default=noprint_wrappers=1:nokey=1"
-                    f" -show_entries stream=r_frame_rate {file.get_safe()}"
-                )
-            )
-            .verify(bad_output_hints=[""])
-            .strip_mp4_warning()
-            .get_output()
-            .split("/")
-        )
-        return float(result[0]) / float(result[1])
+        return MediaInfo.get(file).frame_rate
 
     @staticmethod
     def get_fps_fraction(file: PathAlabama) -> str:
         file.check_video()
-        return (
-            run_cli(
-                (
-                    f"ffprobe -v error -select_streams v -of default=noprint_wrappers=1:nokey=1"
-                    f" -show_entries stream=r_frame_rate {file.get_safe()}"
-                )
-            )
-            .verify(bad_output_hints=[""])
-            .strip_mp4_warning()
-            .get_output()
-        )
+        return MediaInfo.get(file).fps_fraction
 
     @staticmethod
     def get_source_bitrates(
@@ -203,9 +205,30 @@ class Ffmpeg:
         Returns tuple of bitrates (firstVideoStream, firstAudioStream)
         Works via demux-to-null (container stats are considered false)
         """
-        common = "-show_entries packet=size -of default=nokey=1:noprint_wrappers=1"
-        command_v = f"ffprobe -v error -select_streams V:0 {common} {path.get_safe()}"
-        command_a = f"ffprobe -v error -select_streams a:0 {common} {path.get_safe()}"
+        common = [
+            "-show_entries",
+            "packet=size",
+            "-of",
+            "default=nokey=1:noprint_wrappers=1",
+        ]
+        command_v = [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "V:0",
+            *common,
+            path.get(),
+        ]
+        command_a = [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "a:0",
+            *common,
+            path.get(),
+        ]
         vid_bps = 0
         aud_bps = 0
 
@@ -239,7 +262,19 @@ class Ffmpeg:
         path.check_video()
         return json.loads(
             run_cli(
-                f'ffprobe -v error -select_streams v:0 -show_frames -of json -read_intervals "1%+#1" {path.get_safe()}'
+                [
+                    "ffprobe",
+                    "-v",
+                    "error",
+                    "-select_streams",
+                    "v:0",
+                    "-show_frames",
+                    "-of",
+                    "json",
+                    "-read_intervals",
+                    "1%+#1",
+                    path.get(),
+                ]
             )
             .verify()
             .get_output()
@@ -248,15 +283,7 @@ class Ffmpeg:
     @staticmethod
     def get_codec(path: PathAlabama) -> str:
         path.check_video()
-        return (
-            run_cli(
-                f"ffprobe -v error -select_streams v:0 -show_entries stream=codec_name "
-                f"-of default=noprint_wrappers=1:nokey=1 {path.get_safe()}"
-            )
-            .verify()
-            .strip_mp4_warning()
-            .get_output()
-        )
+        return MediaInfo.get(path).codec
 
     @staticmethod
     def get_vmaf_motion(chunk) -> float:
@@ -280,8 +307,25 @@ class Ffmpeg:
 
         out = (
             run_cli(
-                f"{chunk.create_chunk_ffmpeg_pipe_command(video_filters=vf)} | {get_binary('ffprobe')} -v error "
-                f"-select_streams v:0 -f lavfi -i 'movie=/dev/stdin,entropy,scdet,signalstats' -show_frames -of json"
+                CliPipeline(
+                    shlex.split(
+                        chunk.create_chunk_ffmpeg_pipe_command(video_filters=vf)
+                    ),
+                    [
+                        get_binary("ffprobe"),
+                        "-v",
+                        "error",
+                        "-select_streams",
+                        "v:0",
+                        "-f",
+                        "lavfi",
+                        "-i",
+                        "movie=/dev/stdin,entropy,scdet,signalstats",
+                        "-show_frames",
+                        "-of",
+                        "json",
+                    ],
+                )
             )
             .verify()
             .get_output()
@@ -335,8 +379,22 @@ class Ffmpeg:
     def get_siti_tools_data(chunk, vf) -> dict[Any, Any]:
         out = (
             run_cli(
-                f"{chunk.create_chunk_ffmpeg_pipe_command(video_filters=vf)} |"
-                f" {get_binary('siti-tools')} -f json -b 10 -r full -q /dev/stdin"
+                CliPipeline(
+                    shlex.split(
+                        chunk.create_chunk_ffmpeg_pipe_command(video_filters=vf)
+                    ),
+                    [
+                        get_binary("siti-tools"),
+                        "-f",
+                        "json",
+                        "-b",
+                        "10",
+                        "-r",
+                        "full",
+                        "-q",
+                        "/dev/stdin",
+                    ],
+                )
             )
             .verify()
             .get_output()
@@ -411,5 +469,3 @@ def track_test():
 
 if __name__ == "__main__":
     track_test()
-
-
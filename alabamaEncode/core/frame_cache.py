@@ -0,0 +1,185 @@
+import fcntl
+import hashlib
+import os
+import shlex
+import time
+from contextlib import contextmanager
+from typing import List
+
+from alabamaEncode.core.util.cli_executor import run_cli, CliPipeline
+from alabamaEncode.scene.chunk import ChunkObject
+
+
+class FrameCache:
+    """
+    Decode-once cache of filtered y4m chunks, for when the same frames get piped several times,
+    e.g. into every probe encode and as the reference of every probe's metric.
+    The first user decodes the chunk into a file in `folder` (meant to be tmpfs like /dev/shm, or a fast NVMe),
+    later ones just `cat` it out of the page cache.
+    Entries are evicted least recently used first to stay under `max_size`,
+    chunks that alone would take more than the budget aren't cached and get decoded as usual.
+    Off until `FrameCache.configure` is called.
+    """
+
+    folder: str = None
+    max_size: int = 8 * 1024**3
+
+    @staticmethod
+    def configure(folder: str, max_size: int = max_size):
+        os.makedirs(folder, exist_ok=True)
+        FrameCache.folder = folder
+        FrameCache.max_size = max_size
+
+    @staticmethod
+    def is_enabled() -> bool:
+        return FrameCache.folder is not None
+
+    @staticmethod
+    def _get_chunk_key(chunk: ChunkObject) -> str:
+        stat = os.stat(chunk.path)
+        identity = (
+            f"{os.path.abspath(chunk.path)}:{stat.st_mtime_ns}:{stat.st_size}:"
+            f"{chunk.first_frame_index}:{chunk.last_frame_index}:{chunk.end_override}"
+        )
+        return hashlib.sha256(identity.encode()).hexdigest()[:32]
+
+    @staticmethod
+    def _get_key(chunk: ChunkObject, video_filters: str, bit_depth: int) -> str:
+        variant = hashlib.sha256(f"{video_filters}:{bit_depth}".encode()).hexdigest()
+        return f"{FrameCache._get_chunk_key(chunk)}.{variant[:16]}"
+
+    @staticmethod
+    def _get_entries() -> List[os.DirEntry]:
+        return [
+            entry
+            for entry in os.scandir(FrameCache.folder)
+            if entry.name.endswith(".y4m")
+        ]
+
+    @staticmethod
+    def _evict(needed: int, keep: str = None):
+        """
+        Delete the least recently used entries until `needed` more bytes fit in the budget.
+        Entries touched in the last minute are spared, someone is likely about to `cat` them
+        """
+        entries = sorted(FrameCache._get_entries(), key=lambda e: e.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total + needed <= FrameCache.max_size:
+                break
+            if entry.path == keep or time.time() - entry.stat().st_mtime < 60:
+                continue
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+            except FileNotFoundError:
+                pass  # another process evicted it first
+
+    @staticmethod
+    @contextmanager
+    def _lock(path: str):
+        """
+        Exclusive lock on `path`.lock, across threads and processes.
+        The lock file is deleted by whoever removes the entry while holding it,
+        so a lock taken on a file that got unlinked meanwhile is retried on the new one
+        """
+        while True:
+            lock = open(path + ".lock", "a")
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.fstat(lock.fileno()).st_ino == os.stat(lock.name).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            lock.close()
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            lock.close()
+
+    @staticmethod
+    def _estimate_size(chunk: ChunkObject, bit_depth: int) -> int:
+        """
+        Size of the decoded chunk at source resolution, filters usually only shrink it
+        """
+        frame_size = chunk.get_width() * chunk.get_height() * 3 // 2
+        if bit_depth != 8:
+            frame_size *= 2
+        return frame_size * chunk.get_frame_count()
+
+    @staticmethod
+    def get(
+        chunk: ChunkObject, video_filters: str = "", bit_depth: int = 10
+    ) -> [str | None]:
+        """
+        :return: path of the decoded & filtered chunk y4m, None if the cache is off or the chunk doesn't fit
+        """
+        if not FrameCache.is_enabled():
+            return None
+        if FrameCache._estimate_size(chunk, bit_depth) > FrameCache.max_size:
+            return None
+
+        key = FrameCache._get_key(chunk, video_filters, bit_depth)
+        path = os.path.join(FrameCache.folder, f"{key}.y4m")
+
+        # one decode per entry, even with other threads or processes asking for the same frames
+        with FrameCache._lock(path):
+            if os.path.exists(path):
+                os.utime(path)
+                return path
+
+            FrameCache._evict(FrameCache._estimate_size(chunk, bit_depth))
+            temp_path = path + ".tmp"
+            result = run_cli(
+                CliPipeline(
+                    shlex.split(
+                        chunk.create_chunk_ffmpeg_pipe_command(
+                            video_filters=video_filters, bit_depth=bit_depth
+                        )
+                    ),
+                    output_file=temp_path,
+                )
+            )
+            if not result.success():
+                # most likely the cache folder filled up, decode straight into the consumer instead
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return None
+            os.replace(temp_path, path)
+            FrameCache._evict(0, keep=path)
+            return path
+
+    @staticmethod
+    def release(chunk: ChunkObject):
+        """
+        Drop every cached variant of a chunk and their lock files, once it's done nothing is going to read them again
+        """
+        if not FrameCache.is_enabled():
+            return
+        prefix = FrameCache._get_chunk_key(chunk) + "."
+        for entry in os.scandir(FrameCache.folder):
+            if not (entry.name.startswith(prefix) and entry.name.endswith(".lock")):
+                continue
+            path = entry.path[: -len(".lock")]
+            with FrameCache._lock(path):
+                for file in [path, entry.path]:
+                    try:
+                        os.remove(file)
+                    except FileNotFoundError:
+                        pass
+
+    @staticmethod
+    def get_pipe_command(
+        chunk: ChunkObject, video_filters: str = "", bit_depth: int = 10
+    ) -> str:
+        """
+        Drop-in for `ChunkObject.create_chunk_ffmpeg_pipe_command`, served from the cache when possible
+        """
+        path = FrameCache.get(chunk, video_filters, bit_depth)
+        if path is None:
+            return chunk.create_chunk_ffmpeg_pipe_command(
+                video_filters=video_filters, bit_depth=bit_depth
+            )
+        return f'cat "{path}"'
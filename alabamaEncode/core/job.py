@@ -3,6 +3,7 @@ import hashlib
 import os
 import random
 import sys
+from typing import List, AsyncIterator
 
 from tqdm import tqdm
 
@@ -29,14 +30,23 @@ from alabamaEncode.core.final_touches import (
 from alabamaEncode.metrics.impl.vmaf import download_vmaf_models
 from alabamaEncode.metrics.metric import Metric
 from alabamaEncode.parallel_execution.celery_app import app
+from alabamaEncode.parallel_execution.chunk_cost import ChunkCostModel, lpt_order
 from alabamaEncode.parallel_execution.execute_commands import execute_commands
 from alabamaEncode.scene.annel import annealing
+from alabamaEncode.scene.chunk import ChunkObject
 from alabamaEncode.scene.concat import VideoConcatenator
-from alabamaEncode.scene.scene_detection import scene_detect
+from alabamaEncode.scene.scene_detection import (
+    scene_detect,
+    stream_scene_detect,
+    StreamingDetectionError,
+)
 from alabamaEncode.scene.sequence import ChunkSequence
 
 
 class AlabamaEncodingJob:
+    # chunks the sequence level analysis runs on when encoding starts during scene detection
+    streaming_analysis_prefix = 16
+
     def __init__(self, ctx):
         self.ctx = ctx
         self.websiteUpdate = WebsiteUpdate(ctx)
@@ -126,14 +136,23 @@ class AlabamaEncodingJob:
         constant_updates = asyncio.create_task(self.websiteUpdate.constant_updates())
         self.websiteUpdate.update_current_step_name("Running scene detection")
 
+        streamed = False
+        if self.can_stream_sequence():
+            try:
+                await self.stream_sequence()
+                streamed = True
+            except StreamingDetectionError as e:
+                print(f"Streaming scene detection failed ({e}), detecting scenes first")
+
         sequence = self.prepare_sequence()
 
         if not self.encode_finished():
-            self.websiteUpdate.update_proc_done(10)
-            self.websiteUpdate.update_current_step_name("Analyzing content")
-            download_vmaf_models()
-            await run_sequence_pipeline(self.ctx, sequence)
-            self.ctx.get_kv().set_global("quiet_analyzing_content_logs", True)
+            if not streamed:
+                self.websiteUpdate.update_proc_done(10)
+                self.websiteUpdate.update_current_step_name("Analyzing content")
+                download_vmaf_models()
+                await run_sequence_pipeline(self.ctx, sequence)
+                self.ctx.get_kv().set_global("quiet_analyzing_content_logs", True)
 
             self.websiteUpdate.update_proc_done(20)
             self.websiteUpdate.update_current_step_name("Encoding scenes")
@@ -154,25 +173,8 @@ class AlabamaEncodingJob:
 
                 command_objects = []
 
-                def is_chunk_done(_chunk):
-                    if ctx.multi_res_pipeline:
-                        enc = ctx.get_encoder()
-                        vmafs = get_vmaf_list(enc.get_codec())
-
-                        for vmaf in vmafs:
-                            output_path = (
-                                f"{ctx.temp_folder}/"
-                                f"{_chunk.chunk_index}_{vmaf}.{enc.get_chunk_file_extension()}"
-                            )
-                            if not os.path.exists(output_path):
-                                return False
-
-                        return True
-                    else:
-                        return _chunk.is_done(kv=ctx.get_kv())
-
                 for chunk in sequence.chunks:
-                    if not is_chunk_done(chunk):
+                    if not self.is_chunk_done(chunk):
                         command_objects.append(ChunkEncoder(ctx, chunk))
                     else:
                         frames_encoded_so_far += chunk.get_frame_count()
@@ -182,25 +184,7 @@ class AlabamaEncodingJob:
                 if len(command_objects) < threads:
                     ctx.prototype_encoder.threads = int(threads / len(command_objects))
 
-                # order chunks based on order
-                if ctx.chunk_order == "random":
-                    random.shuffle(command_objects)
-                elif ctx.chunk_order == "length_asc":
-                    command_objects.sort(key=lambda x: x.chunk.length)
-                elif ctx.chunk_order == "length_desc":
-                    command_objects.sort(key=lambda x: x.chunk.length, reverse=True)
-                elif ctx.chunk_order == "sequential":
-                    pass
-                elif ctx.chunk_order == "sequential_reverse":
-                    command_objects.reverse()
-                elif ctx.chunk_order == "even":
-                    command_objects = annealing(command_objects, 1000)
-                else:
-                    raise ValueError(f"Invalid chunk order: {ctx.chunk_order}")
-
-                if ctx.throughput_scaling:
-                    # make the chunk length distribution homogenous
-                    command_objects = annealing(command_objects, 1000)
+                command_objects = self.order_commands(command_objects, sequence.chunks)
 
                 print(
                     f"Starting encoding of {len(command_objects)} out of {len(sequence.chunks)} scenes"
@@ -221,62 +205,17 @@ class AlabamaEncodingJob:
                         * 100
                     )
 
-                kv = self.ctx.get_kv()
-                saved_progress = kv.get_global("pbar_progress")
-
-                pbar = tqdm(
-                    total=sum([c.chunk.length for c in command_objects]),
-                    desc="Encoding",
-                    unit="frame",
-                    dynamic_ncols=True,
-                    unit_scale=True,
-                    smoothing=0.2,
-                    initial=saved_progress if saved_progress is not None else 0,
-                )
-
-                saved_total = kv.get_global("pbar_total")
-                if saved_total is not None:
-                    pbar.total = saved_total
-
-                saved_estimation = kv.get_global("pbar_estimation")
-                if saved_estimation is not None:
-                    pbar.set_postfix(estimation=saved_estimation)
-
-                pbar.refresh()
+                pbar = self.create_progress_bar(command_objects)
 
                 if len(command_objects) == 0:
                     print("Nothing to encode, skipping")
                 else:
-                    try:
-                        await asyncio.create_task(
-                            execute_commands(
-                                ctx.use_celery,
-                                command_objects,
-                                ctx.multiprocess_workers,
-                                pin_to_cores=ctx.pin_to_cores,
-                                finished_scene_callback=update_proc_done,
-                                size_estimate_data=(
-                                    frames_encoded_so_far,
-                                    size_kb_so_far,
-                                ),
-                                throughput_scaling=ctx.throughput_scaling,
-                                pbar=pbar,
-                            )
-                        )
-                    except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
-                        print("Keyboard interrupt, stopping")
-                        # kill all async tasks
-                        pbar.close()
-                        for task in asyncio.all_tasks():
-                            task.cancel()
-
-                        # save pbar progress in kv
-                        kv = self.ctx.get_kv()
-                        kv.set_global("pbar_progress", pbar.n)
-                        if kv.get_global("pbar_total") is None:
-                            kv.set_global("pbar_total", pbar.total)
-                        kv.set_global("pbar_estimation", pbar.postfix.get("estimation"))
-                        quit()
+                    await self.run_commands(
+                        command_objects,
+                        pbar,
+                        finished_scene_callback=update_proc_done,
+                        size_estimate_data=(frames_encoded_so_far, size_kb_so_far),
+                    )
 
                 refine_steps = get_refine_steps(ctx)
                 for step in refine_steps:
@@ -375,6 +314,272 @@ class AlabamaEncodingJob:
 
         self.delete()
 
+    def is_chunk_done(self, chunk) -> bool:
+        ctx = self.ctx
+        if ctx.multi_res_pipeline:
+            enc = ctx.get_encoder()
+            vmafs = get_vmaf_list(enc.get_codec())
+
+            for vmaf in vmafs:
+                output_path = (
+                    f"{ctx.temp_folder}/"
+                    f"{chunk.chunk_index}_{vmaf}.{enc.get_chunk_file_extension()}"
+                )
+                if not os.path.exists(output_path):
+                    return False
+
+            return True
+        else:
+            return chunk.is_done(kv=ctx.get_kv())
+
+    def order_commands(
+        self, command_objects: List[ChunkEncoder], history: List[ChunkObject]
+    ) -> List[ChunkEncoder]:
+        """
+        Order the commands by `ctx.chunk_order`, with throughput scaling also spread the chunk lengths evenly
+        :param history: chunks of the whole sequence, the lpt cost model calibrates on the ones already encoded
+        """
+        ctx = self.ctx
+        workers = (
+            ctx.multiprocess_workers if ctx.multiprocess_workers > 0 else os.cpu_count()
+        )
+
+        # order chunks based on order
+        if ctx.chunk_order == "random":
+            random.shuffle(command_objects)
+        elif ctx.chunk_order == "length_asc":
+            command_objects.sort(key=lambda x: x.chunk.length)
+        elif ctx.chunk_order == "length_desc":
+            command_objects.sort(key=lambda x: x.chunk.length, reverse=True)
+        elif ctx.chunk_order == "sequential":
+            pass
+        elif ctx.chunk_order == "sequential_reverse":
+            command_objects.reverse()
+        elif ctx.chunk_order == "even":
+            command_objects = annealing(command_objects, 20000, workers)
+        elif ctx.chunk_order == "lpt" and not any(c.complexity > 0 for c in history):
+            # frame count & resolution are all the cost model has then, same order as length_desc
+            print(
+                "--chunk_order lpt needs the chunk complexities of --firstpass_index, ordering by length instead"
+            )
+            command_objects.sort(key=lambda x: x.chunk.length, reverse=True)
+        elif ctx.chunk_order == "lpt":
+            cost_model = ChunkCostModel(ctx.get_kv())
+            command_objects, makespan = lpt_order(
+                command_objects,
+                workers=workers,
+                cost_model=cost_model,
+                history=history,
+            )
+            # without measured encode times the model only knows how chunks compare to each other
+            unit = (
+                "s"
+                if cost_model.is_calibrated(history)
+                else " (relative, no encode times measured yet)"
+            )
+            print(
+                f"Predicted makespan of the LPT schedule on {workers} workers: {makespan:.1f}{unit}"
+            )
+        else:
+            raise ValueError(f"Invalid chunk order: {ctx.chunk_order}")
+
+        if ctx.throughput_scaling:
+            # make the chunk length distribution homogenous
+            command_objects = annealing(command_objects, 20000, workers)
+        return command_objects
+
+    def create_progress_bar(
+        self, command_objects: List[ChunkEncoder], use_saved_total=True
+    ) -> tqdm:
+        """
+        Encoding progress bar, picking up the progress saved when a previous run got interrupted
+        :param use_saved_total: take the total of the interrupted run, its total covered chunks that are done now
+        """
+        kv = self.ctx.get_kv()
+        saved_progress = kv.get_global("pbar_progress")
+
+        pbar = tqdm(
+            total=sum([c.chunk.length for c in command_objects]),
+            desc="Encoding",
+            unit="frame",
+            dynamic_ncols=True,
+            unit_scale=True,
+            smoothing=0.2,
+            initial=saved_progress if saved_progress is not None else 0,
+        )
+
+        saved_total = kv.get_global("pbar_total")
+        if saved_total is not None and use_saved_total:
+            pbar.total = saved_total
+        elif saved_progress is not None:
+            pbar.total += saved_progress
+
+        saved_estimation = kv.get_global("pbar_estimation")
+        if saved_estimation is not None:
+            pbar.set_postfix(estimation=saved_estimation)
+
+        pbar.refresh()
+        return pbar
+
+    async def run_commands(
+        self,
+        command_objects: List[ChunkEncoder],
+        pbar: tqdm,
+        finished_scene_callback: callable = None,
+        size_estimate_data: tuple = None,
+        command_stream: AsyncIterator[ChunkEncoder] = None,
+    ):
+        """
+        Run the commands with `execute_commands`, on a keyboard interrupt save the progress for the next run & quit
+        """
+        ctx = self.ctx
+        try:
+            await asyncio.create_task(
+                execute_commands(
+                    ctx.use_celery,
+                    command_objects,
+                    ctx.multiprocess_workers,
+                    pin_to_cores=ctx.pin_to_cores,
+                    finished_scene_callback=finished_scene_callback,
+                    size_estimate_data=size_estimate_data,
+                    throughput_scaling=ctx.throughput_scaling,
+                    pbar=pbar,
+                    command_stream=command_stream,
+                )
+            )
+        except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
+            print("Keyboard interrupt, stopping")
+            # kill all async tasks
+            pbar.close()
+            for task in asyncio.all_tasks():
+                task.cancel()
+
+            # save pbar progress in kv
+            kv = self.ctx.get_kv()
+            kv.set_global("pbar_progress", pbar.n)
+            # a streamed run only knows the total of the scenes detected so far
+            if kv.get_global("pbar_total") is None and command_stream is None:
+                kv.set_global("pbar_total", pbar.total)
+            kv.set_global("pbar_estimation", pbar.postfix.get("estimation"))
+            quit()
+
+    def get_keyframe_index_path(self) -> [str | None]:
+        if not self.ctx.keyframe_aligned_chunks:
+            return None
+        return self.ctx.temp_folder + "keyframe_index.npz"
+
+    def can_stream_sequence(self) -> bool:
+        """
+        Whether to start encoding while scenes are still being detected, only on a fresh local encode,
+        since offsets and static length scenes need the whole file
+        """
+        ctx = self.ctx
+        return (
+            ctx.streaming_scene_detection
+            and not ctx.use_celery
+            and not ctx.statically_sized_scenes
+            and ctx.start_offset == -1
+            and ctx.end_offset == -1
+            and not os.path.exists(ctx.temp_folder + "scene_cache.json")
+            and not self.encode_finished()
+        )
+
+    async def stream_sequence(self):
+        """
+        Encode chunks as the scene detection finds them. The sequence level analysis runs on the first
+        `streaming_analysis_prefix` chunks, after that every chunk is handed to the executor the moment it's detected,
+        so the detection is hidden behind encoding. Scene detection writes the same scene cache as `prepare_sequence`
+        once it's done, chunks that fail are picked up by the integrity check after.
+        Unlike the regular path `chunk_order` only orders the prefix, and the encoder threads aren't raised for short
+        sequences since the chunk count isn't known up front.
+        """
+        ctx = self.ctx
+        extension = ctx.get_encoder().get_chunk_file_extension()
+        sequence = ChunkSequence([])
+        sequence.input_file = ctx.input_file
+
+        def add_chunk(_chunk):
+            ChunkSequence([_chunk]).setup_paths(
+                temp_folder=ctx.temp_folder, extension=extension
+            )
+            sequence.chunks.append(_chunk)
+
+        async def detected_chunks():
+            # only detection failures fall back to detecting first, encode failures propagate like they usually do
+            try:
+                async for _chunk in stream_scene_detect(
+                    input_file=ctx.input_file,
+                    cache_file_path=ctx.temp_folder + "scene_cache.json",
+                    max_scene_length=ctx.max_scene_length,
+                    scene_merge=ctx.scene_merge,
+                    fast_detection=ctx.fast_scene_detection,
+                    keyframe_index_path=self.get_keyframe_index_path(),
+                ):
+                    yield _chunk
+            except Exception as e:
+                raise StreamingDetectionError(str(e)) from e
+
+        chunks = detected_chunks()
+        async for chunk in chunks:
+            add_chunk(chunk)
+            if len(sequence.chunks) >= self.streaming_analysis_prefix:
+                break
+
+        self.websiteUpdate.update_proc_done(10)
+        self.websiteUpdate.update_current_step_name("Analyzing content")
+        download_vmaf_models()
+        await run_sequence_pipeline(ctx, sequence)
+        ctx.get_kv().set_global("quiet_analyzing_content_logs", True)
+
+        self.websiteUpdate.update_proc_done(20)
+        self.websiteUpdate.update_current_step_name("Encoding scenes")
+
+        # chunks done by a previous run, they're skipped and count as finished
+        done_count = 0
+
+        async def detected_commands():
+            nonlocal done_count
+            async for _chunk in chunks:
+                add_chunk(_chunk)
+                if not self.is_chunk_done(_chunk):
+                    yield ChunkEncoder(ctx, _chunk)
+                else:
+                    done_count += 1
+
+        # the size estimation starts from the chunks of the prefix that are done already
+        frames_encoded_so_far = 0
+        size_kb_so_far = 0
+        command_objects = []
+        for chunk in sequence.chunks:
+            if not self.is_chunk_done(chunk):
+                command_objects.append(ChunkEncoder(ctx, chunk))
+            else:
+                done_count += 1
+                frames_encoded_so_far += chunk.get_frame_count()
+                size_kb_so_far += chunk.get_filesize() / 1000
+
+        # the rest of the chunks are encoded in the order they are detected
+        if ctx.chunk_order != "sequential" or ctx.throughput_scaling:
+            print(
+                f"Streaming scene detection: --chunk_order {ctx.chunk_order} only orders the first "
+                f"{len(command_objects)} chunks, the rest run in the order they're detected"
+            )
+        command_objects = self.order_commands(command_objects, sequence.chunks)
+
+        def update_proc_done(num_finished_scenes):
+            # the total grows while scenes are detected
+            self.websiteUpdate.update_proc_done(
+                (done_count + num_finished_scenes) / len(sequence.chunks) * 100
+            )
+
+        await self.run_commands(
+            command_objects,
+            self.create_progress_bar(command_objects, use_saved_total=False),
+            finished_scene_callback=update_proc_done,
+            size_estimate_data=(frames_encoded_so_far, size_kb_so_far),
+            command_stream=detected_commands(),
+        )
+
     def prepare_sequence(self):
         sequence: ChunkSequence = scene_detect(
             input_file=self.ctx.input_file,
@@ -386,6 +591,9 @@ class AlabamaEncodingJob:
             static_length=self.ctx.statically_sized_scenes,
             static_length_size=self.ctx.max_scene_length,
             scene_merge=self.ctx.scene_merge,
+            detection_workers=self.ctx.scene_detection_workers,
+            fast_detection=self.ctx.fast_scene_detection,
+            keyframe_index_path=self.get_keyframe_index_path(),
         )
         sequence.setup_paths(
             temp_folder=self.ctx.temp_folder,
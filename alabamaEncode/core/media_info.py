@@ -0,0 +1,153 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+
+from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.kv import AlabamaKv
+from alabamaEncode.core.util.path import PathAlabama
+
+
+class MediaInfo:
+    """
+    Everything the Ffmpeg helpers want to know about a file, from a single `ffprobe -show_streams -show_format` call.
+    Memoised per path and re-probed once the mtime or size changes. Probes of the source and the finished chunks
+    are persisted in the kv once one is attached with `MediaInfo.use_kv`, so resuming a job doesn't re-probe them,
+    short-lived files like rate probes are only memoised.
+    """
+
+    bucket = "media_info"
+    memo_size = 256
+
+    _memo: "OrderedDict[str, Tuple[str, MediaInfo]]" = OrderedDict()
+    _memo_lock = threading.Lock()
+    _kv: AlabamaKv = None
+    _persisted: List[str] = []
+
+    def __init__(self, probe: dict):
+        self.probe = probe
+        self.streams: List[dict] = probe.get("streams", [])
+        self.format: dict = probe.get("format", {})
+
+    @staticmethod
+    def use_kv(kv: AlabamaKv, persisted: List[str]):
+        """
+        Persist probes into `kv`, and load the ones saved by previous runs
+        :param persisted: files, or folders whose files, get persisted
+        """
+        saved = kv.get_all(MediaInfo.bucket)
+        with MediaInfo._memo_lock:
+            MediaInfo._kv = kv
+            MediaInfo._persisted = [os.path.abspath(p) for p in persisted]
+            for path, entry in saved.items():
+                if path not in MediaInfo._memo and "version" in entry:
+                    MediaInfo._remember(
+                        path, entry["version"], MediaInfo(entry["probe"])
+                    )
+
+    @staticmethod
+    def _remember(path: str, version: str, info: "MediaInfo"):
+        """
+        Memoise `info`, dropping the least recently used entries over `memo_size`, call with the lock held
+        """
+        MediaInfo._memo[path] = (version, info)
+        MediaInfo._memo.move_to_end(path)
+        while len(MediaInfo._memo) > MediaInfo.memo_size:
+            MediaInfo._memo.popitem(last=False)
+
+    @staticmethod
+    def _is_persisted(path: str) -> bool:
+        return path in MediaInfo._persisted or (
+            os.path.dirname(path) in MediaInfo._persisted
+        )
+
+    @staticmethod
+    def get(path: PathAlabama) -> "MediaInfo":
+        """
+        :param path: media file, must exist
+        :return: MediaInfo of the file, probed only if the file is new or changed since the last probe
+        """
+        abs_path = os.path.abspath(path.get())
+        stat = os.stat(abs_path)
+        version = f"{stat.st_mtime_ns}:{stat.st_size}"
+        with MediaInfo._memo_lock:
+            memo = MediaInfo._memo.get(abs_path)
+            if memo is not None and memo[0] == version:
+                MediaInfo._memo.move_to_end(abs_path)
+                return memo[1]
+
+        probe = json.loads(
+            run_cli(
+                [
+                    "ffprobe",
+                    "-v",
+                    "error",
+                    "-show_streams",
+                    "-show_format",
+                    "-of",
+                    "json",
+                    path.get(),
+                ]
+            )
+            .verify(fail_message=f"ffprobe failed on {path.get()}")
+            .strip_mp4_warning()
+            .get_output()
+        )
+        info = MediaInfo(probe)
+
+        with MediaInfo._memo_lock:
+            MediaInfo._remember(abs_path, version, info)
+            kv = MediaInfo._kv
+        if kv is not None and MediaInfo._is_persisted(abs_path):
+            # one entry per path, a changed file replaces its old probe
+            kv.set(MediaInfo.bucket, abs_path, {"version": version, "probe": probe})
+        return info
+
+    def get_video_stream(self) -> dict:
+        for stream in self.streams:
+            if stream.get("codec_type") == "video":
+                return stream
+        raise RuntimeError("No video stream found")
+
+    @property
+    def width(self) -> int:
+        return int(self.get_video_stream()["width"])
+
+    @property
+    def height(self) -> int:
+        return int(self.get_video_stream()["height"])
+
+    @property
+    def pix_fmt(self) -> str:
+        return self.get_video_stream().get("pix_fmt", "")
+
+    @property
+    def codec(self) -> str:
+        return self.get_video_stream().get("codec_name", "")
+
+    @property
+    def color_transfer(self) -> str:
+        return self.get_video_stream().get("color_transfer", "")
+
+    @property
+    def fps_fraction(self) -> str:
+        """
+        e.g. 24000/1001
+        """
+        return self.get_video_stream()["r_frame_rate"]
+
+    @property
+    def frame_rate(self) -> float:
+        numerator, denominator = self.fps_fraction.split("/")
+        return float(numerator) / float(denominator)
+
+    @property
+    def duration(self) -> [float | None]:
+        """
+        :return: container duration in seconds, None if the container doesn't say
+        """
+        duration = self.format.get("duration")
+        if duration is None or duration == "N/A":
+            return None
+        return float(duration)
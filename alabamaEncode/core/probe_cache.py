@@ -0,0 +1,259 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict
+
+from alabamaEncode.encoder.encoder import Encoder
+from alabamaEncode.encoder.stats import EncodeStats
+from alabamaEncode.metrics.metric import Metric
+from alabamaEncode.metrics.options import MetricOptions
+from alabamaEncode.metrics.result import MetricResult
+
+
+class ProbeCache:
+    """
+    Cross-job cache of probe results (metric + bitrate of a probe encode) in `~/.alabamaEncoder`.
+    Content addressed: the key is a hash of the source contents, the frame range, the filters,
+    the encoder with its version and every setting, and the metric options, so it doesn't matter
+    where the job's temp folder is or whether it still exists.
+    Least recently used entries are evicted once the cache grows over `max_size` bytes.
+    example:
+    cache = ProbeCache()
+    key = cache.get_key(enc, Metric.VMAF, vmaf_options)
+    stats = cache.get(key)
+    if stats is None:
+        stats = enc.run(metric_to_calculate=Metric.VMAF, metric_params=vmaf_options)
+        cache.set(key, stats)
+    """
+
+    default_path = "~/.alabamaEncoder/probe_cache.sqlite3"
+    max_size = 64 * 1024 * 1024
+    busy_timeout_ms = 60_000
+
+    # encoder fields that don't change the bitstream
+    ignored_encoder_fields = {
+        "chunk",
+        "output_path",
+        "threads",
+        "pin_to_core",
+        "niceness",
+        "running_on_celery",
+        "cache_decoded_frames",
+    }
+    ignored_metric_options = [
+        "threads",
+        "video_filters",
+        "cache_reference",
+        "reference_file",
+        "use_libvmaf",
+        # early stopped results aren't cached, the ones that are cover every frame either way
+        "early_stop_target",
+    ]
+    metric_result_fields = [
+        "fps",
+        "percentile_50",
+        "percentile_25",
+        "percentile_10",
+        "percentile_5",
+        "percentile_1",
+        "max",
+        "min",
+        "mean",
+        "harmonic_mean",
+        "std_dev",
+    ]
+
+    _source_fingerprints: Dict[str, str] = {}
+    _encoder_versions: Dict[str, str] = {}
+
+    def __init__(self, path: str = default_path, max_size: int = max_size):
+        self.path = os.path.expanduser(path)
+        self.max_size = max_size
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        db = self._connection()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS probes ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL) WITHOUT ROWID"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS probes_last_used ON probes (last_used)")
+
+    def __getstate__(self):
+        return {"path": self.path, "max_size": self.max_size}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"], state["max_size"])
+
+    def _connection(self) -> sqlite3.Connection:
+        # forked processes inherit the parent's connection, they have to open their own
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(
+                self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    @staticmethod
+    def get_source_fingerprint(path: str) -> str:
+        """
+        Identify a source by its size and a hash of its start, middle and end,
+        so renamed or copied sources still hit without hashing the whole file
+        """
+        stat = os.stat(path)
+        memo_key = f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}"
+        fingerprint = ProbeCache._source_fingerprints.get(memo_key)
+        if fingerprint is not None:
+            return fingerprint
+
+        sample_size = 1024 * 1024
+        digest = hashlib.blake2b(str(stat.st_size).encode(), digest_size=16)
+        with open(path, "rb") as f:
+            for offset in [0, stat.st_size // 2, max(0, stat.st_size - sample_size)]:
+                f.seek(offset)
+                digest.update(f.read(sample_size))
+        fingerprint = digest.hexdigest()
+        ProbeCache._source_fingerprints[memo_key] = fingerprint
+        return fingerprint
+
+    @staticmethod
+    def get_encoder_config(enc: Encoder) -> dict:
+        """
+        Every setting of the encoder, class defaults included, without evaluating properties
+        """
+        config = {}
+        for klass in reversed(type(enc).__mro__):
+            for name, value in vars(klass).items():
+                if name.startswith("_") or callable(value):
+                    continue
+                if isinstance(value, (property, staticmethod, classmethod)):
+                    continue
+                config[name] = value
+        for name, value in vars(enc).items():
+            if not name.startswith("_"):
+                config[name] = value
+        return {
+            name: str(value)
+            for name, value in sorted(config.items())
+            if name not in ProbeCache.ignored_encoder_fields
+        }
+
+    @staticmethod
+    def get_encoder_version(enc: Encoder) -> str:
+        name = type(enc).__name__
+        if name not in ProbeCache._encoder_versions:
+            ProbeCache._encoder_versions[name] = str(enc.get_version())
+        return ProbeCache._encoder_versions[name]
+
+    @staticmethod
+    def get_key(enc: Encoder, metric: Metric, metric_options: MetricOptions) -> str:
+        """
+        :param enc: encoder set up for the probe, with its chunk
+        :param metric: metric the probe calculates
+        :param metric_options: options the metric gets, `threads` and `video_filters` are
+        taken from the encoder same as `Encoder.run` does
+        """
+        chunk = enc.chunk
+        options = {
+            name: str(value)
+            for name, value in sorted(vars(metric_options).items())
+            if name not in ProbeCache.ignored_metric_options
+        }
+        for klass in type(metric_options).__mro__:
+            for name, value in vars(klass).items():
+                if name.startswith("_") or callable(value):
+                    continue
+                if name in ProbeCache.ignored_metric_options:
+                    continue
+                options.setdefault(name, str(value))
+        if hasattr(metric_options, "get_model"):
+            options["model"] = str(metric_options.get_model())
+
+        identity = {
+            "source": ProbeCache.get_source_fingerprint(chunk.path),
+            "first_frame_index": chunk.first_frame_index,
+            "last_frame_index": chunk.last_frame_index,
+            "end_override": chunk.end_override,
+            "video_filters": enc.video_filters,
+            "encoder": enc.get_pretty_name(),
+            "encoder_version": ProbeCache.get_encoder_version(enc),
+            "encoder_config": ProbeCache.get_encoder_config(enc),
+            "metric": str(metric),
+            "metric_options": dict(sorted(options.items())),
+        }
+        return hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key: str) -> [EncodeStats | None]:
+        db = self._connection()
+        row = db.execute("SELECT value FROM probes WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE probes SET last_used = ? WHERE key = ?", (time.time(), key))
+
+        value = json.loads(row[0])
+        metric_results = MetricResult()
+        for name, metric_value in value["metric_results"].items():
+            setattr(metric_results, name, metric_value)
+        return EncodeStats(
+            time_encoding=value["time_encoding"],
+            bitrate=value["bitrate"],
+            size=value["size"],
+            length_frames=value["length_frames"],
+            metric_result=metric_results,
+        )
+
+    def set(self, key: str, stats: EncodeStats):
+        """
+        Results of metrics that stopped early only cover some of the frames, those aren't cached
+        """
+        if stats.metric_results.stopped_early:
+            return
+        value = json.dumps(
+            {
+                "time_encoding": stats.time_encoding,
+                "bitrate": stats.bitrate,
+                "size": stats.size,
+                "length_frames": stats.length_frames,
+                "metric_results": {
+                    name: getattr(stats.metric_results, name)
+                    for name in self.metric_result_fields
+                },
+            }
+        )
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO probes (key, value, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, len(key) + len(value), time.time()),
+            )
+            self._evict(db)
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _evict(self, db: sqlite3.Connection):
+        """
+        Drop the least recently used entries once the cache is over `max_size`,
+        down to 90% of it so we don't evict on every set after the cache filled up
+        """
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM probes").fetchone()[0]
+        if total <= self.max_size:
+            return
+        target = self.max_size * 0.9
+        freed = 0
+        evicted = []
+        for key, size in db.execute("SELECT key, size FROM probes ORDER BY last_used"):
+            if total - freed <= target:
+                break
+            evicted.append((key,))
+            freed += size
+        db.executemany("DELETE FROM probes WHERE key = ?", evicted)
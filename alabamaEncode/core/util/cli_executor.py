@@ -1,19 +1,29 @@
+import codecs
 import os
 import re
+import selectors
+import shlex
+import signal
 import subprocess
 import time
+from collections import deque
 from queue import Queue
 from threading import Thread
 from typing import List, Callable, Optional
 
-__all__ = ["run_cli", "run_cli_parallel", "CliResult"]
+__all__ = ["run_cli", "run_cli_parallel", "CliResult", "CliPipeline"]
 
 
 class CliResult:
-    def __init__(self, return_code, output, time_taken=-1.0):
+
+    def __init__(self, return_code, output, time_taken=-1.0, stage_return_codes=None):
         self.return_code = return_code
         self.output = output
         self.time_taken = time_taken
+        # return code of every stage when running a CliPipeline
+        self.stage_return_codes = (
+            stage_return_codes if stage_return_codes is not None else [return_code]
+        )
 
     def __repr__(self):
         return f"ExecuteResult(return_code={self.return_code}, output={self.output})"
@@ -75,69 +85,207 @@ class CliResult:
         return float(self.output.strip())
 
 
+class _OutputRing:
+    """
+    Keeps the output of a process, only the last `max_size` characters if `max_size` is set
+    """
+
+    def __init__(self, max_size=-1):
+        self.max_size = max_size
+        self.parts = deque()
+        self.size = 0
+
+    def append(self, text: str):
+        if text == "":
+            return
+        self.parts.append(text)
+        self.size += len(text)
+        if self.max_size > 0:
+            while self.size - len(self.parts[0]) >= self.max_size:
+                self.size -= len(self.parts.popleft())
+
+    def get(self) -> str:
+        out = "".join(self.parts)
+        if self.max_size > 0:
+            out = out[-self.max_size :]
+        return out
+
+
+# progress lines of encoders end with a carriage return (or backspaces) instead of a newline
+_record_separator = re.compile(r"[\r\n\x08]+")
+
+
+class CliPipeline:
+    """
+    Shell-free replacement for `a | b | c > file`, made of argv lists wired together with pipes.
+    Like in a shell, the stderr of every stage ends up in the output of the result.
+    example:
+    run_cli(CliPipeline(["ffmpeg", "-i", path, "-f", "yuv4mpegpipe", "-"]).pipe(["ffprobe", "-"]))
+    """
+
+    def __init__(self, *stages: List[str], output_file: str = None):
+        """
+        :param stages: argv of each stage, stdout of a stage goes into the stdin of the next one
+        :param output_file: write the stdout of the last stage into this file (or fifo) instead of the output
+        """
+        self.stages = [[str(arg) for arg in stage] for stage in stages]
+        self.output_file = output_file
+
+    def pipe(self, stage: List[str]) -> "CliPipeline":
+        self.stages.append([str(arg) for arg in stage])
+        return self
+
+    def __str__(self):
+        out = " | ".join(shlex.join(stage) for stage in self.stages)
+        if self.output_file is not None:
+            out += f" > {shlex.quote(self.output_file)}"
+        return out
+
+
+def _spawn(cmd, output_fd: int) -> List[subprocess.Popen]:
+    """
+    Start a shell command string, an argv list or a CliPipeline with stdout & stderr going into output_fd
+    """
+    if isinstance(cmd, str):
+        return [
+            subprocess.Popen(
+                cmd,
+                shell=True,
+                stdin=subprocess.PIPE,
+                stdout=output_fd,
+                stderr=output_fd,
+            )
+        ]
+
+    pipeline = cmd if isinstance(cmd, CliPipeline) else CliPipeline(cmd)
+    final_stdout = output_fd
+    if pipeline.output_file is not None:
+        final_stdout = open(pipeline.output_file, "wb")
+
+    processes = []
+    previous_stdout = None
+    try:
+        for i, argv in enumerate(pipeline.stages):
+            is_last = i == len(pipeline.stages) - 1
+            processes.append(
+                subprocess.Popen(
+                    argv,
+                    stdin=(
+                        previous_stdout
+                        if previous_stdout is not None
+                        else subprocess.PIPE
+                    ),
+                    stdout=final_stdout if is_last else subprocess.PIPE,
+                    stderr=output_fd,
+                )
+            )
+            # the next stage owns it now, closing our copy lets SIGPIPE reach the writer
+            if previous_stdout is not None:
+                previous_stdout.close()
+            previous_stdout = processes[-1].stdout
+    except OSError:
+        # binary not found etc., don't leave half of the pipeline running
+        for process in processes:
+            process.kill()
+            process.wait()
+        raise
+    finally:
+        if pipeline.output_file is not None:
+            final_stdout.close()
+    return processes
+
+
 def run_cli(
     cmd,
     timeout_value=-1,
     on_output: Optional[Callable[[str], None]] = None,
+    max_output_size=-1,
 ) -> CliResult:
+    """
+    :param cmd: shell command string, argv list, or a CliPipeline; argv and pipelines don't spawn a shell
+    :param timeout_value: seconds before killing the process, -1 for no timeout
+    :param on_output: called with every line/progress record the process outputs, without the terminator
+    :param max_output_size: keep only the last N characters of the output, -1 to keep everything
+    """
     start = time.perf_counter()
-    p = subprocess.Popen(
-        cmd,
-        shell=True,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-    )
-
-    output = ""
-    while p.poll() is None:  # While the process is still running...
-        chunk = p.stdout.read(1).decode(errors="ignore")  # Read output chunk by chunk
-        output += chunk  # Add chunk to total output
-        if on_output is not None:  # If on_output is provided...
-            on_output(chunk)  # ...apply it to each chunk
-
-    if timeout_value > 0:
-        try:
-            p.wait(timeout=timeout_value)
-        except subprocess.TimeoutExpired:
-            p.kill()
-    else:
-        p.wait()
-
-    output += p.stdout.read().decode(errors="ignore")
+
+    read_fd, write_fd = os.pipe()
+    try:
+        processes = _spawn(cmd, write_fd)
+    except OSError as e:
+        os.close(read_fd)
+        # what a shell would report for a missing binary
+        return CliResult(127, str(e), time.perf_counter() - start)
+    finally:
+        os.close(write_fd)
+
+    output = _OutputRing(max_output_size)
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    pending = ""  # partial record that hasn't been terminated yet
+    deadline = start + timeout_value if timeout_value > 0 else None
+
+    def handle(text: str):
+        nonlocal pending
+        output.append(text)
+        if on_output is not None:
+            pending += text
+            records = _record_separator.split(pending)
+            pending = records.pop()
+            for record in records:
+                if record != "":
+                    on_output(record)
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(read_fd, selectors.EVENT_READ)
+        while True:
+            wait_for = None
+            if deadline is not None:
+                wait_for = deadline - time.perf_counter()
+                if wait_for <= 0:
+                    for process in processes:
+                        process.kill()
+                    break
+            if len(selector.select(timeout=wait_for)) == 0:
+                continue
+            data = os.read(read_fd, 65536)
+            if not data:  # EOF, every stage closed its output
+                break
+            handle(decoder.decode(data))
+    os.close(read_fd)
+
+    handle(decoder.decode(b"", final=True))
+    if on_output is not None and pending != "":
+        on_output(pending)
+
+    stage_return_codes = [process.wait() for process in processes]
+    for process in processes:
+        if process.stdin is not None:
+            process.stdin.close()
+
+    # like `set -o pipefail`, the rightmost failing stage decides, but an upstream stage being cut off by
+    # its reader exiting early is how pipelines normally end
+    return_code = 0
+    for i, code in enumerate(stage_return_codes):
+        is_last = i == len(stage_return_codes) - 1
+        if code != 0 and (is_last or code != -signal.SIGPIPE):
+            return_code = code
 
     end = time.perf_counter()
-    return CliResult(p.returncode, output, end - start)
+    return CliResult(return_code, output.get(), end - start, stage_return_codes)
 
 
 def _run_command(
-    cmd: str, result_queue: Queue, stream_to_stdout: bool, error_flag: List[bool]
+    cmd, result_queue: Queue, stream_to_stdout: bool, error_flag: List[bool]
 ):
-    process = subprocess.Popen(
-        cmd,
-        shell=True,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-    )
-    # output = ""
-    # for line in iter(lambda: process.stdout.read(1), b""):
-    #     # if stream_to_stdout:
-    #     # sys.stdout.write(line.decode("utf-8", errors="ignore"))
-    #     # print(line.decode("utf-8", errors="ignore"), end="")
-    #     output += str(line)
-
-    output = process.stdout.read().decode(errors="ignore")
-
-    process.wait()
-    result_queue.put(CliResult(process.returncode, output))
-
-    if process.returncode != 0:
+    result = run_cli(cmd)
+    result_queue.put(result)
+
+    if result.return_code != 0:
         error_flag[0] = True
 
 
 def run_cli_parallel(
-    cmds: List[str], timeout_value=-1, stream_to_stdout=False
+    cmds: List[str | List[str] | CliPipeline], timeout_value=-1, stream_to_stdout=False
 ) -> List[CliResult]:
     results = []
     result_queue = Queue()
@@ -1,21 +1,55 @@
+import shlex
 import subprocess
 
 from alabamaEncode.core.util.abort_controler import AbortControler
-from alabamaEncode.core.util.yuv import Reader
+from alabamaEncode.core.util.yuv import Frame, SharedFrameSlots, Y4mStream
 from alabamaEncode.scene.chunk import ChunkObject
 
 
-def get_yuv_frame_stream(chunk: ChunkObject, frame_callback, vf: str= "", abort_controler: AbortControler = None):
+def get_yuv_frame_stream(
+    chunk: ChunkObject,
+    frame_callback,
+    vf: str = "",
+    abort_controler: AbortControler = None,
+    slots: SharedFrameSlots = None,
+):
+    """
+    Decode the chunk into 8bit yuv and call `frame_callback` with a `Frame` for every frame.
+    Frames are read straight from ffmpeg into a reused numpy buffer, so `frame.buffer` is only valid during the
+    callback, copy it if it has to live longer.
+    :param slots: read every frame into a slot of these instead, `frame.slot` is the slot it's in,
+    the callback owns the slot and has to `release` it, e.g. once a worker process is done with it
+    """
     command = chunk.create_chunk_ffmpeg_pipe_command(video_filters=vf, bit_depth=8)
 
-    ffmpeg_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    ffmpeg_process = subprocess.Popen(
+        shlex.split(command), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
 
-    yuv_reader = Reader(frame_callback)
+    try:
+        try:
+            stream = Y4mStream(ffmpeg_process.stdout)
+        except ValueError:
+            return  # nothing decoded
 
-    while ffmpeg_process.poll() is None:
-        if abort_controler:
-            if abort_controler.aborted:
+        if slots is not None:
+            slots.allocate(stream.frame_size)
+
+        count = 0
+        while not (abort_controler and abort_controler.aborted):
+            slot = None
+            buffer = stream.buffer
+            if slots is not None:
+                slot = slots.acquire()
+                buffer = slots.get(slot)
+            if not stream.read_frame_into(buffer):
+                if slot is not None:
+                    slots.release(slot)
                 break
-        data = ffmpeg_process.stdout.read(1024 * 1024)
-        if data:
-            yuv_reader.decode(data)
+            frame_callback(Frame(buffer, stream.headers, count, slot))
+            count += 1
+    finally:
+        ffmpeg_process.stdout.close()
+        if ffmpeg_process.poll() is None:
+            ffmpeg_process.kill()
+        ffmpeg_process.wait()
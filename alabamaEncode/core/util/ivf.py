@@ -0,0 +1,216 @@
+"""
+Native IVF container support, the container SVT-AV1/aomenc/rav1e chunks are written in.
+Layout: 32 byte file header, then for every frame a 12 byte header (u32 size, u64 pts) followed by the frame data.
+"""
+
+import mmap
+import os
+import struct
+from typing import Iterator, NamedTuple, List
+
+__all__ = ["IvfError", "IvfHeader", "IvfFrame", "IvfReader", "concat_ivf"]
+
+IVF_SIGNATURE = b"DKIF"
+IVF_FILE_HEADER_SIZE = 32
+IVF_FRAME_HEADER_SIZE = 12
+
+# signature, version, header size, fourcc, width, height, timebase denominator, timebase numerator, frame count
+_file_header = struct.Struct("<4sHH4sHHIII4x")
+_frame_header = struct.Struct("<IQ")
+
+
+class IvfError(Exception):
+    def __init__(self, path: str, reason: str):
+        super().__init__(f"{path} is not a valid ivf file: {reason}")
+
+
+class IvfHeader(NamedTuple):
+    version: int
+    header_size: int
+    fourcc: bytes
+    width: int
+    height: int
+    timebase_denominator: int
+    timebase_numerator: int
+    frame_count: int  # what the muxer wrote, not necessarily the real count
+
+    def pack(self) -> bytes:
+        header = _file_header.pack(
+            IVF_SIGNATURE,
+            self.version,
+            self.header_size,
+            self.fourcc,
+            self.width,
+            self.height,
+            self.timebase_denominator,
+            self.timebase_numerator,
+            self.frame_count,
+        )
+        return header + b"\0" * (self.header_size - len(header))
+
+
+class IvfFrame(NamedTuple):
+    offset: int  # offset of the frame header in the file
+    size: int  # size of the frame data, without the frame header
+    pts: int
+
+
+class IvfReader:
+    """
+    Memory-mapped IVF reader
+    example:
+    with IvfReader("1.ivf") as ivf:
+        frame_count = sum(1 for _ in ivf.frames())
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._map = None
+        self.header: IvfHeader = None
+
+    def __enter__(self) -> "IvfReader":
+        self._file = open(self.path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < IVF_FILE_HEADER_SIZE:
+            self.close()
+            raise IvfError(self.path, "file is smaller than the ivf header")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        fields = _file_header.unpack_from(self._map, 0)
+        if fields[0] != IVF_SIGNATURE:
+            self.close()
+            raise IvfError(self.path, "missing DKIF signature")
+        self.header = IvfHeader(*fields[1:])
+        if self.header.header_size < IVF_FILE_HEADER_SIZE:
+            self.close()
+            raise IvfError(self.path, "header size too small")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def frames(self) -> Iterator[IvfFrame]:
+        """
+        Walk the frame headers, without touching the frame data
+        :raises IvfError: if the file is truncated mid-frame
+        """
+        offset = self.header.header_size
+        end = len(self._map)
+        while offset < end:
+            if offset + IVF_FRAME_HEADER_SIZE > end:
+                raise IvfError(self.path, f"truncated frame header at {offset}")
+            size, pts = _frame_header.unpack_from(self._map, offset)
+            if offset + IVF_FRAME_HEADER_SIZE + size > end:
+                raise IvfError(self.path, f"truncated frame at {offset}")
+            yield IvfFrame(offset, size, pts)
+            offset += IVF_FRAME_HEADER_SIZE + size
+
+    def count_frames(self) -> int:
+        """
+        :raises IvfError: if the file is truncated
+        """
+        return sum(1 for _ in self.frames())
+
+
+def _copy_range(source_fd: int, destination_fd: int, offset: int, count: int):
+    """
+    Append `count` bytes at `offset` of source to destination, in kernel space when the platform allows
+    """
+    while count > 0:
+        if hasattr(os, "copy_file_range"):
+            try:
+                copied = os.copy_file_range(source_fd, destination_fd, count, offset)
+            except OSError:
+                copied = os.sendfile(destination_fd, source_fd, offset, count)
+        else:
+            copied = os.sendfile(destination_fd, source_fd, offset, count)
+        if copied == 0:
+            raise IOError("Unexpected end of file while copying ivf frames")
+        offset += copied
+        count -= copied
+
+
+def concat_ivf(files: List[str], output: str) -> int:
+    """
+    Concatenate ivf files into one, rewriting the global header and the frame timestamps so they continue
+    from one file to the next. Frame data is never read into python, it's copied in kernel space.
+    :param files: ivf files in order, they must share the codec, resolution and timebase
+    :param output: path of the concatenated file
+    :raises IvfError: if the inputs are broken or don't match
+    :return: number of frames written
+    """
+    if len(files) == 0:
+        raise ValueError("No files to concatenate")
+
+    # walk every header first, so a broken chunk fails before we write anything
+    headers: List[IvfHeader] = []
+    frame_lists: List[List[IvfFrame]] = []
+    for path in files:
+        with IvfReader(path) as ivf:
+            headers.append(ivf.header)
+            frame_lists.append(list(ivf.frames()))
+
+    first = headers[0]
+    for path, header in zip(files, headers):
+        if (
+            header.fourcc != first.fourcc
+            or header.width != first.width
+            or header.height != first.height
+            or header.timebase_denominator != first.timebase_denominator
+            or header.timebase_numerator != first.timebase_numerator
+        ):
+            raise IvfError(
+                path, f"header {header} doesn't match the first file's {first}"
+            )
+
+    total_frames = sum(len(frames) for frames in frame_lists)
+
+    with open(output, "wb") as out:
+        out.write(
+            first._replace(
+                header_size=IVF_FILE_HEADER_SIZE, frame_count=total_frames
+            ).pack()
+        )
+        out.flush()
+        out_fd = out.fileno()
+
+        pts_offset = 0
+        for path, frames in zip(files, frame_lists):
+            if len(frames) == 0:
+                continue
+            first_pts = frames[0].pts
+            last_pts = frames[-1].pts
+            frame_duration = 1
+            if len(frames) > 1:
+                frame_duration = max(
+                    1, round((last_pts - first_pts) / (len(frames) - 1))
+                )
+
+            with open(path, "rb") as source:
+                source_fd = source.fileno()
+                for frame in frames:
+                    os.write(
+                        out_fd,
+                        _frame_header.pack(
+                            frame.size, pts_offset + frame.pts - first_pts
+                        ),
+                    )
+                    _copy_range(
+                        source_fd,
+                        out_fd,
+                        frame.offset + IVF_FRAME_HEADER_SIZE,
+                        frame.size,
+                    )
+
+            pts_offset += last_pts - first_pts + frame_duration
+
+    return total_frames
@@ -1,13 +1,20 @@
+import copy
+import fcntl
 import json
 import os
+import sqlite3
 import threading
+from contextlib import contextmanager
 
 
 class AlabamaKv(object):
     """
     AlabamaKv is a key-value store that stores data in a bucket, each bucket is file in a folder. Stored in json format.
-    It is used to store data between runs of alabamaEncode. Saving to files immediately because making this
-    thread safe is not worth it/needed.
+    It is used to store data between runs of alabamaEncode.
+    Every bucket is an in-memory dict backed by an append-only write-ahead log (`bucket.wal`, one json record
+    per line, fsynced on every set), that is periodically compacted into a `bucket.json` snapshot.
+    Writes take an flock on the log, and reads pick up records appended by other processes, so multiple
+    processes can share a folder.
     Prototypes:
     __init__(folder for buckets)
     set(bucket, key, value)
@@ -18,11 +25,24 @@ class AlabamaKv(object):
     set_global(key, value)  # shortcut for set("kv", key, value)
     """
 
+    # compact once the log holds this many more records than the bucket has keys
+    compaction_slack = 256
+
     def __init__(self, folder):
         self.mutex = threading.Lock()
         self.folder = folder
         if not os.path.exists(self.folder):
             os.makedirs(self.folder)
+        self._index = {}  # bucket -> dict of its content
+        # bucket -> (inode, bytes of the log replayed, records in the log)
+        self._log_state = {}
+
+    def __getstate__(self):
+        # the index is rebuilt from disk, locks can't be pickled (e.g. when sent to celery)
+        return {"folder": self.folder}
+
+    def __setstate__(self, state):
+        self.__init__(state["folder"])
 
     def get_global(self, key):
         return self.get("kv", key)
@@ -31,20 +51,32 @@ class AlabamaKv(object):
         return self.set("kv", key, value)
 
     def set(self, bucket, key, value, individual_mode=False):
+        """
+        :param individual_mode: kept for compatibility, every write is an individual log record now
+        """
+        key = str(key)
+        record = json.dumps({"k": key, "v": value}) + "\n"
         with self.mutex:
-            if individual_mode:
-                bucket_path = os.path.join(self.folder, bucket)
-                if not os.path.exists(bucket_path):
-                    os.makedirs(bucket_path)
-                key_path = os.path.join(bucket_path, f"{key}.json")
-                with open(key_path, "w") as f:
-                    json.dump(value, f)
-            else:
-                bucket_content = self._load(bucket)
-                bucket_content[key] = value
-                bucket_path = os.path.join(self.folder, bucket + ".json")
-                with open(bucket_path, "w") as f:
-                    json.dump(bucket_content, f)
+            log = self._lock_log(bucket)
+            try:
+                # catch up with other writers first, so our record lands after theirs in the index too
+                content = self._load(bucket)
+                log.write(record)
+                log.flush()
+                os.fsync(log.fileno())
+                content[key] = json.loads(record)["v"]
+                inode, offset, records = self._log_state[bucket]
+                self._log_state[bucket] = (
+                    inode,
+                    offset + len(record.encode()),
+                    records + 1,
+                )
+
+                if records + 1 > len(content) + self.compaction_slack:
+                    self._compact(bucket)
+            finally:
+                fcntl.flock(log, fcntl.LOCK_UN)
+                log.close()
 
     def get(self, bucket, key) -> [str | None]:
         with self.mutex:
@@ -53,30 +85,270 @@ class AlabamaKv(object):
                 key = str(key)
             if key not in b:
                 return None
-            return b[key]
+            return copy.deepcopy(b[key])
 
     def get_all(self, bucket):
         with self.mutex:
             b = self._load(bucket)
-            return b
+            return copy.deepcopy(b)
 
     def exists(self, bucket, key):
         with self.mutex:
             b = self._load(bucket)
-            return key in b
+            return str(key) in b
 
-    def _load(self, bucket_name: str) -> dict:
+    def _log_path(self, bucket_name: str) -> str:
+        return os.path.join(self.folder, bucket_name + ".wal")
+
+    def _lock_log(self, bucket_name: str):
+        """
+        Open the log of a bucket for appending and take its write lock
+        """
+        log_path = self._log_path(bucket_name)
+        while True:
+            log = open(log_path, "a")
+            fcntl.flock(log, fcntl.LOCK_EX)
+            # a compaction may have swapped the log while we waited, appending to the old one would lose the record
+            try:
+                if os.stat(log_path).st_ino == os.fstat(log.fileno()).st_ino:
+                    return log
+            except FileNotFoundError:
+                pass
+            fcntl.flock(log, fcntl.LOCK_UN)
+            log.close()
+
+    def _load_snapshot(self, bucket_name: str) -> dict:
+        """
+        Load what was compacted (or written by older versions, including individual_mode folders)
+        """
         bucket_path = os.path.join(self.folder, bucket_name)
         single_file_path = bucket_path + ".json"
-        if os.path.exists(single_file_path):
-            with open(single_file_path, "r") as f:
-                return json.load(f)
-        elif os.path.exists(bucket_path):
-            bucket_content = {}
+        bucket_content = {}
+        if os.path.isdir(bucket_path):
             for key_file in os.listdir(bucket_path):
                 key = os.path.splitext(key_file)[0]
                 with open(os.path.join(bucket_path, key_file)) as f:
                     bucket_content[key] = json.load(f)
-            return bucket_content
-        else:
-            return {}
+        # the snapshot goes on top, once compacted it has everything the folder has and newer
+        if os.path.exists(single_file_path):
+            with open(single_file_path, "r") as f:
+                bucket_content.update(json.load(f))
+        return bucket_content
+
+    def _load(self, bucket_name: str) -> dict:
+        """
+        Get the index of a bucket, replaying whatever got appended to its log since we last looked
+        """
+        log_path = self._log_path(bucket_name)
+        try:
+            stat = os.stat(log_path)
+            inode, size = stat.st_ino, stat.st_size
+        except FileNotFoundError:
+            inode, size = -1, 0
+
+        state = self._log_state.get(bucket_name)
+        if (
+            bucket_name not in self._index
+            or state is None
+            or state[0] != inode
+            or size < state[1]
+        ):
+            # first look, or the log got compacted by someone else
+            self._index[bucket_name] = self._load_snapshot(bucket_name)
+            state = (inode, 0, 0)
+
+        _, offset, records = state
+        if size > offset:
+            with open(log_path, "rb") as log:
+                log.seek(offset)
+                tail = log.read(size - offset)
+            # only whole lines, a torn last line is either still being written or left by a crash
+            tail = tail[: tail.rfind(b"\n") + 1]
+            content = self._index[bucket_name]
+            for line in tail.splitlines():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                content[record["k"]] = record["v"]
+                records += 1
+            offset += len(tail)
+
+        self._log_state[bucket_name] = (inode, offset, records)
+        return self._index[bucket_name]
+
+    def _compact(self, bucket_name: str):
+        """
+        Write the index into the snapshot and start a new empty log, the caller holds the log lock.
+        A crash in between only leaves records that get replayed on top of the snapshot again.
+        """
+        snapshot_path = os.path.join(self.folder, bucket_name + ".json")
+        log_path = self._log_path(bucket_name)
+
+        with open(snapshot_path + ".tmp", "w") as f:
+            json.dump(self._index[bucket_name], f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(snapshot_path + ".tmp", snapshot_path)
+
+        # a new file rather than truncating, so other processes see a new inode and reload
+        open(log_path + ".tmp", "w").close()
+        os.replace(log_path + ".tmp", log_path)
+        self._log_state[bucket_name] = (os.stat(log_path).st_ino, 0, 0)
+
+    @contextmanager
+    def batch(self):
+        """
+        Group several sets, e.g. when recording a whole probe sweep.
+        Every set is its own durable log record already, so this only exists to match backends that batch.
+        """
+        yield self
+
+
+class AlabamaSqliteKv(AlabamaKv):
+    """
+    AlabamaKv stored in a single WAL-mode SQLite database (`kv.sqlite3` in the folder), same interface.
+    Writers from any process on the host go through SQLite's locking, and sets inside `batch()` share a transaction:
+    with kv.batch():
+        for crf, score in probes:
+            kv.set("probes", crf, score)
+    Note that WAL mode relies on shared memory, so all processes need to be on the same host.
+    Buckets written by the file backend are imported the first time they are touched.
+    """
+
+    database_name = "kv.sqlite3"
+    busy_timeout_ms = 60_000
+
+    def __init__(self, folder):
+        super().__init__(folder)
+        self.database_path = os.path.join(self.folder, self.database_name)
+        self._local = threading.local()
+        self._imported = set()
+        with self._transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS kv ("
+                "bucket TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (bucket, key)) WITHOUT ROWID"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS imported (bucket TEXT PRIMARY KEY) WITHOUT ROWID"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # connections can't be shared between threads, one per thread,
+        # nor with forked processes (e.g. multiprocessing.Pool workers), those open their own
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(
+                self.database_path,
+                timeout=self.busy_timeout_ms / 1000,
+                isolation_level=None,
+            )
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+            self._local.db = db
+            self._local.pid = os.getpid()
+            self._local.batch_depth = 0
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        db = self._connection()
+        if self._local.batch_depth > 0:
+            # already inside a batch, it commits
+            yield db
+            return
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    @contextmanager
+    def batch(self):
+        with self._transaction():
+            self._local.batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._local.batch_depth -= 1
+
+    def _import_legacy(self, bucket: str):
+        """
+        Copy a bucket the file backend wrote into the database, once
+        """
+        if bucket in self._imported:
+            return
+        db = self._connection()
+        if (
+            db.execute("SELECT 1 FROM imported WHERE bucket = ?", (bucket,)).fetchone()
+            is None
+        ):
+            with self.mutex:
+                content = super()._load(bucket)
+            with self._transaction() as db:
+                db.executemany(
+                    "INSERT OR IGNORE INTO kv (bucket, key, value) VALUES (?, ?, ?)",
+                    [(bucket, k, json.dumps(v)) for k, v in content.items()],
+                )
+                db.execute("INSERT OR IGNORE INTO imported VALUES (?)", (bucket,))
+        self._imported.add(bucket)
+
+    def set(self, bucket, key, value, individual_mode=False):
+        self._import_legacy(bucket)
+        with self._transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO kv (bucket, key, value) VALUES (?, ?, ?)",
+                (bucket, str(key), json.dumps(value)),
+            )
+
+    def get(self, bucket, key) -> [str | None]:
+        self._import_legacy(bucket)
+        row = (
+            self._connection()
+            .execute(
+                "SELECT value FROM kv WHERE bucket = ? AND key = ?",
+                (bucket, str(key)),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def get_all(self, bucket):
+        self._import_legacy(bucket)
+        rows = (
+            self._connection()
+            .execute("SELECT key, value FROM kv WHERE bucket = ?", (bucket,))
+            .fetchall()
+        )
+        return {key: json.loads(value) for key, value in rows}
+
+    def exists(self, bucket, key):
+        self._import_legacy(bucket)
+        return (
+            self._connection()
+            .execute(
+                "SELECT 1 FROM kv WHERE bucket = ? AND key = ?", (bucket, str(key))
+            )
+            .fetchone()
+            is not None
+        )
+
+
+kv_backends = {"wal": AlabamaKv, "sqlite": AlabamaSqliteKv}
+
+
+def get_kv(folder: str, backend: str = "wal") -> AlabamaKv:
+    """
+    :param backend: one of `kv_backends`
+    """
+    if backend not in kv_backends:
+        raise ValueError(
+            f"Unknown kv backend {backend}, expected one of {list(kv_backends)}"
+        )
+    return kv_backends[backend](folder)
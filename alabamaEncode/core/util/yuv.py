@@ -1,8 +1,16 @@
+import queue
+import re
 from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+from typing import BinaryIO, Dict, Iterator, Tuple
+
+import numpy as np
 
 # https://github.com/ticapix/python-y4m
 
-class Frame(namedtuple('Frame', ['buffer', 'headers', 'count'])):
+class Frame(
+    namedtuple("Frame", ["buffer", "headers", "count", "slot"], defaults=[None])
+):
     def __repr__(self):
         return '<frame %d: %dx%d>' % (self.count, self.headers['H'], self.headers['W'])
 
@@ -82,3 +90,184 @@ class Reader(object):
             self._stream_headers['A'] = [int(n) for n in self._stream_headers['A'].split(':')]
         if 'C' not in self._stream_headers:
             self._stream_headers['C'] = '420jpeg'  # man yuv4mpeg
+
+
+def parse_stream_headers(line: bytes) -> dict:
+    headers = line.split(b" ")
+    assert headers[0] == b"YUV4MPEG2", "unknown type %s" % headers[0]
+    stream_headers = {}
+    for header in headers[1:]:
+        header = header.decode("ascii")
+        stream_headers[header[0]] = header[1:]
+    assert "W" in stream_headers, "No width header"
+    assert "H" in stream_headers, "No height header"
+    assert "F" in stream_headers, "No frame-rate header"
+    stream_headers["W"] = int(stream_headers["W"])
+    stream_headers["H"] = int(stream_headers["H"])
+    stream_headers["F"] = [int(n) for n in stream_headers["F"].split(":")]
+    if "A" in stream_headers:
+        stream_headers["A"] = [int(n) for n in stream_headers["A"].split(":")]
+    if "C" not in stream_headers:
+        stream_headers["C"] = "420jpeg"  # man yuv4mpeg
+    return stream_headers
+
+
+class Y4mStream:
+    """
+    Sequential y4m frame reader over a file-like object,
+    each frame is read straight into a reused numpy buffer
+    example:
+    stream = Y4mStream(open("in.y4m", "rb"))
+    for y, u, v in stream.frames():
+        ...
+    """
+
+    # chroma layout -> (chroma width divisor, chroma height divisor)
+    chroma_subsampling = {"420": (2, 2), "422": (2, 1), "444": (1, 1)}
+
+    def __init__(self, file: BinaryIO):
+        self.file = file
+        try:
+            self.headers = parse_stream_headers(file.readline().rstrip(b"\n"))
+        except (AssertionError, ValueError, IndexError) as e:
+            raise ValueError(f"Input is not a y4m stream: {e}")
+        self.width = self.headers["W"]
+        self.height = self.headers["H"]
+        colorspace = self.headers["C"]
+        # e.g. 420p10, while 420jpeg/420mpeg2/420paldv are all 8bit
+        depth = re.match(r"\d{3}p(\d+)", colorspace)
+        self.bit_depth = int(depth.group(1)) if depth else 8
+        self.chroma = colorspace[:3]
+        if self.chroma not in self.chroma_subsampling:
+            raise ValueError(f"Unsupported y4m colorspace {colorspace}")
+        x_div, y_div = self.chroma_subsampling[self.chroma]
+        chroma_shape = (-(-self.height // y_div), -(-self.width // x_div))
+        self.plane_shapes = [(self.height, self.width), chroma_shape, chroma_shape]
+        self.dtype = np.uint8 if self.bit_depth == 8 else np.uint16
+        self.buffer = np.empty(
+            sum(h * w for h, w in self.plane_shapes), dtype=self.dtype
+        )
+        self.frame_size = self.buffer.nbytes
+
+    def read_frame_into(self, buffer) -> bool:
+        """
+        Read the next frame into `buffer` (anything writable of `frame_size` bytes)
+        :return: False once the stream ended
+        """
+        raw = memoryview(buffer).cast("B")
+        frame_header = self.file.readline()
+        if not frame_header.startswith(b"FRAME"):
+            return False
+        read = 0
+        while read < len(raw):
+            count = self.file.readinto(raw[read:])
+            if not count:
+                return False  # truncated last frame
+            read += count
+        return True
+
+    def get_planes(
+        self, buffer: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Views of the y, u, v planes of a frame buffer
+        """
+        buffer = buffer.view(self.dtype)
+        planes = []
+        offset = 0
+        for h, w in self.plane_shapes:
+            planes.append(buffer[offset : offset + h * w].reshape(h, w))
+            offset += h * w
+        return tuple(planes)
+
+    def frames(self) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Yields views of the y, u, v planes, only valid until the next frame is read
+        """
+        planes = self.get_planes(self.buffer)
+        while self.read_frame_into(self.buffer):
+            yield planes
+
+
+class SharedFrameSlots:
+    """
+    A fixed number of frame sized buffers in shared memory, to hand frames to worker processes without pickling them.
+    The producer `acquire`s a free slot (waiting while all are in use), reads a frame into `get(slot)`
+    and passes `name` and the slot to the worker, which maps it with `SharedFrameSlots.read`.
+    The slot is `release`d once the worker is done with it.
+    example:
+    slots = SharedFrameSlots(12)
+    get_yuv_frame_stream(chunk, lambda frame: pool.apply_async(
+        worker, (slots.name, frame.slot, slots.frame_size), callback=lambda _, s=frame.slot: slots.release(s)
+    ), slots=slots)
+    """
+
+    _attached: Dict[str, shared_memory.SharedMemory] = {}  # per worker process
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.frame_size = 0
+        self.name = None
+        self._memory: shared_memory.SharedMemory = None
+        self._free = queue.Queue()
+
+    def allocate(self, frame_size: int):
+        """
+        Create the shared memory once the frame size is known
+        """
+        if self._memory is not None:
+            if frame_size != self.frame_size:
+                raise ValueError(
+                    "Shared frame slots already allocated for another frame size"
+                )
+            return
+        self.frame_size = frame_size
+        self._memory = shared_memory.SharedMemory(
+            create=True, size=frame_size * self.slots
+        )
+        self.name = self._memory.name
+        for slot in range(self.slots):
+            self._free.put(slot)
+
+    def acquire(self) -> int:
+        return self._free.get()
+
+    def release(self, slot: int):
+        self._free.put(slot)
+
+    def get(self, slot: int) -> np.ndarray:
+        return np.ndarray(
+            (self.frame_size,),
+            dtype=np.uint8,
+            buffer=self._memory.buf,
+            offset=slot * self.frame_size,
+        )
+
+    def close(self):
+        if self._memory is not None:
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
+
+    @staticmethod
+    def read(name: str, slot: int, frame_size: int) -> np.ndarray:
+        """
+        Map a slot in a worker process, the mapping is kept for the next frames
+        """
+        memory = SharedFrameSlots._attached.get(name)
+        if memory is None:
+            try:
+                # the producer owns it, the worker must not unlink it when exiting
+                memory = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:  # python < 3.13
+                # workers talk to the producer's tracker (inherited on fork, handed over on spawn),
+                # attaching registers the name there again, which is a no-op, unregistering would drop
+                # the producer's own registration. Only a tracker of our own has to forget it
+                own_tracker = resource_tracker._resource_tracker._fd is None
+                memory = shared_memory.SharedMemory(name=name)
+                if own_tracker:
+                    resource_tracker.unregister(memory._name, "shared_memory")
+            SharedFrameSlots._attached[name] = memory
+        return np.ndarray(
+            (frame_size,), dtype=np.uint8, buffer=memory.buf, offset=slot * frame_size
+        )
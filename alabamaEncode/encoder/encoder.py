@@ -8,6 +8,7 @@ from tqdm import tqdm
 
 from alabamaEncode.core.util.cli_executor import run_cli
 from alabamaEncode.core.ffmpeg import Ffmpeg
+from alabamaEncode.core.frame_cache import FrameCache
 from alabamaEncode.core.util.path import PathAlabama
 from alabamaEncode.encoder.codec import Codec
 from alabamaEncode.encoder.rate_dist import EncoderRateDistribution
@@ -104,6 +105,7 @@ class Encoder(ABC):
     hdr = False
 
     running_on_celery = False
+    cache_decoded_frames = False  # pipe the input from the FrameCache, for encodes repeated on the same chunk
 
     def supports_float_crfs(self) -> bool:
         return False
@@ -188,15 +190,13 @@ class Encoder(ABC):
                     parse_func = None
 
                     if has_frame_callback:
-                        # We can report progress to a callback
-                        output_buffer = ""
+                        # We can report progress to a callback,
+                        # run_cli hands us whole lines/progress records so there's no need to buffer
 
-                        def parse(string):
-                            nonlocal output_buffer
+                        def parse(record):
                             nonlocal times_called
                             nonlocal latest_frame_update
-                            output_buffer += string
-                            prog = self.parse_output_for_output(output_buffer)
+                            prog = self.parse_output_for_output(record)
 
                             if len(prog) > 0:
                                 times_called += 1
@@ -205,13 +205,15 @@ class Encoder(ABC):
                                 latest_frame_update = prog[0]
                                 on_frame_encoded(prog[0], prog[1], prog[2])
 
-                                output_buffer = ""
-
                         parse_func = parse
 
                     cli_out = (
                         run_cli(
-                            command, timeout_value=timeout_value, on_output=parse_func
+                            command,
+                            timeout_value=timeout_value,
+                            on_output=parse_func,
+                            # the encoder log is only printed when something fails, the tail is enough
+                            max_output_size=64 * 1024,
                         )
                         .verify()
                         .get_output()
@@ -221,7 +223,7 @@ class Encoder(ABC):
                 if self.running_on_celery:
                     # os.rename(celery_path, original_path)
                     # do a copy instead bc "invalid cross-device link"
-                    run_cli(f'cp "{celery_path}" "{original_path}"').verify()
+                    run_cli(["cp", celery_path, original_path]).verify()
                     os.remove(celery_path)
 
                 if has_frame_callback:
@@ -284,6 +286,7 @@ class Encoder(ABC):
                 self.chunk,
                 video_filters=self.video_filters,
                 get_db=True,
+                native=metric_params is not None and metric_params.use_native,
             )
             stats.ssim = ssim
             stats.ssim_db = ssim_db
@@ -307,6 +310,12 @@ class Encoder(ABC):
         """
         return cli command that pipes a y4m stream into stdout using the chunk object
         """
+        if self.cache_decoded_frames:
+            return FrameCache.get_pipe_command(
+                self.chunk,
+                video_filters=self.video_filters,
+                bit_depth=self.bit_override,
+            )
         return self.chunk.create_chunk_ffmpeg_pipe_command(
             video_filters=self.video_filters,
             bit_depth=self.bit_override,
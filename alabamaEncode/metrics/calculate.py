@@ -1,14 +1,20 @@
+import copy
 import os
 import re
+import shlex
+from typing import List, Tuple
 
+from alabamaEncode.core.frame_cache import FrameCache
 from alabamaEncode.core.util.bin_utils import get_binary
-from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.cli_executor import CliPipeline
 from alabamaEncode.core.util.path import PathAlabama
 from alabamaEncode.encoder.stats import EncodeStats
+from alabamaEncode.metrics.exception import VmafException
 from alabamaEncode.metrics.impl.ssimu2 import Ssimu2Options
 from alabamaEncode.metrics.impl.vmaf import VmafOptions
 from alabamaEncode.metrics.metric import Metric
 from alabamaEncode.metrics.options import MetricOptions
+from alabamaEncode.metrics.result import MetricResult
 from alabamaEncode.scene.chunk import ChunkObject
 
 
@@ -38,6 +44,13 @@ def calculate_metric(
                 chunk=_chunk,
                 vmaf_options=options if options is not None else VmafOptions(),
             )
+        case Metric.SSIM:
+            from alabamaEncode.metrics.impl.ssim import calc_ssim
+
+            return calc_ssim(
+                chunk=_chunk,
+                options=options if options is not None else MetricOptions(),
+            )
         case Metric.SSIMULACRA2:
             from alabamaEncode.metrics.impl.ssimu2 import calc_ssimu2
 
@@ -49,28 +62,81 @@ def calculate_metric(
             raise NotImplementedError(f"Metric {metric} not implemented")
 
 
-def cleanup_input_pipes(output: dict):
-    if os.path.exists(output["ref_pipe"]):
-        os.remove(output["ref_pipe"])
-    if os.path.exists(output["dist_pipe"]):
-        os.remove(output["dist_pipe"])
-
-
-def get_input_pipes(chunk: ChunkObject, options: MetricOptions) -> dict:
+def calculate_metric_batch(
+    chunk: ChunkObject,
+    distorted_paths: List[str],
+    options=None,
+    metric: Metric = Metric.VMAF,
+    batch_size: int = 8,
+) -> List[MetricResult]:
     """
-    Create two named pipes that will output distorted and reference yuv frames,
-    return the pipe paths and the commands that will feed them
+    Score several encodes of the same chunk, e.g. convex hull candidates, while decoding the reference only once.
+    With libvmaf up to `batch_size` candidates are scored in a single pass over the reference,
+    which is read from the FrameCache when it's enabled and otherwise streamed from the source once per batch.
+    Candidates scored one by one decode the reference each, unless it's cached.
+    Candidates are scaled to `options.ref` like in `calculate_metric`,
+    so they can differ in resolution but otherwise have to be encoded from the same filtered source.
+    :return: results in the order of `distorted_paths`
     """
+    if options is None:
+        options = VmafOptions() if metric == Metric.VMAF else Ssimu2Options()
+    if len(distorted_paths) == 0:
+        return []
 
-    video_filters = options.video_filters
+    reference_file = options.reference_file
+    if reference_file is None and options.cache_reference:
+        # a whole decoded chunk is too big to write out just for this, only use it when it's cached anyway
+        reference_filters, _ = get_metric_filters(options)
+        reference_file = FrameCache.get(chunk, video_filters=reference_filters)
 
-    assert os.path.exists(chunk.path)
-    assert os.path.exists(chunk.chunk_path)
+    batch_options = copy.copy(options)
+    batch_options.reference_file = reference_file
+
+    def get_candidate(path: str) -> ChunkObject:
+        candidate = copy.deepcopy(chunk)
+        candidate.chunk_path = path
+        return candidate
+
+    if metric == Metric.VMAF and getattr(options, "use_libvmaf", False):
+        from alabamaEncode.metrics.impl.vmaf import calc_vmaf_batch_in_process
+        from alabamaEncode.metrics.impl.libvmaf import LibVmaf
+
+        if LibVmaf.get() is not None:
+            results = []
+            try:
+                for i in range(0, len(distorted_paths), batch_size):
+                    results += calc_vmaf_batch_in_process(
+                        [
+                            get_candidate(path)
+                            for path in distorted_paths[i : i + batch_size]
+                        ],
+                        batch_options,
+                    )
+                return results
+            except VmafException as e:
+                print(f"libvmaf batch failed, scoring the candidates one by one: {e}")
+
+    return [
+        calculate_metric(
+            chunk=get_candidate(path), options=batch_options, metric=metric
+        )
+        for path in distorted_paths
+    ]
+
+
+def cleanup_input_pipes(output: dict):
+    pipes = [output["ref_pipe"]]
+    pipes += output["dist_pipes"] if "dist_pipes" in output else [output["dist_pipe"]]
+    for pipe in pipes:
+        if os.path.exists(pipe):
+            os.remove(pipe)
 
-    random_bit = os.urandom(16).hex()
-    pipe_ref_path = f"/tmp/{os.path.basename(chunk.path)}_{random_bit}.pipe"
-    pipe_dist_path = f"/tmp/{os.path.basename(chunk.chunk_path)}_{random_bit}.pipe"
 
+def get_metric_filters(options: MetricOptions) -> Tuple[str, str]:
+    """
+    :return: the video filters for the reference and for the distorted side, comma separated
+    """
+    video_filters = options.video_filters
     dist_filter = ""
 
     if options.ref is not None:
@@ -85,7 +151,7 @@ def get_input_pipes(chunk: ChunkObject, options: MetricOptions) -> dict:
         vf.append(comparison_scaling)
         video_filters = ",".join(vf)
 
-        dist_filter = f" -vf {comparison_scaling} "
+        dist_filter = comparison_scaling
 
     if options.denoise_reference:
         # before scaling use the `vaguedenoiser` filter
@@ -95,32 +161,105 @@ def get_input_pipes(chunk: ChunkObject, options: MetricOptions) -> dict:
         video_filters = ",".join(vf)
 
     video_filters = ",".join([f for f in video_filters.split(",") if f != ""])
+    return video_filters, dist_filter
+
+
+def _get_reference_command(
+    chunk: ChunkObject, options: MetricOptions, video_filters: str, pipe: str
+) -> CliPipeline:
+    cached_reference = options.reference_file
+    if cached_reference is None and options.cache_reference:
+        cached_reference = FrameCache.get(chunk, video_filters=video_filters)
+
+    if cached_reference is not None:
+        return CliPipeline(["cat", cached_reference], output_file=pipe)
 
     if video_filters != "":
         video_filters = f" -vf {video_filters} "
-
-    ref_pipe_command = (
-        f"{get_binary('ffmpeg')} -v error -nostdin -hwaccel auto {chunk.get_ss_ffmpeg_command_pair()}"
-        f" -pix_fmt yuv420p10le -an -sn -strict -1 {video_filters} -f yuv4mpegpipe - > {pipe_ref_path}"
+    return CliPipeline(
+        shlex.split(
+            f"{get_binary('ffmpeg')} -v error -nostdin -hwaccel auto {chunk.get_ss_ffmpeg_command_pair()}"
+            f" -pix_fmt yuv420p10le -an -sn -strict -1 {video_filters} -f yuv4mpegpipe -"
+        ),
+        output_file=pipe,
     )
-    dist_pipe_command = (
-        f'{get_binary("ffmpeg")} -v error -nostdin -filmgrain 0 -hwaccel auto -i "{chunk.chunk_path}" '
-        f"-pix_fmt yuv420p10le -an -sn -strict -1 {dist_filter} -f yuv4mpegpipe - > {pipe_dist_path}"
+
+
+def _get_distorted_command(
+    distorted_path: str, dist_filter: str, pipe: str
+) -> CliPipeline:
+    if dist_filter != "":
+        dist_filter = f" -vf {dist_filter} "
+    return CliPipeline(
+        shlex.split(
+            f'{get_binary("ffmpeg")} -v error -nostdin -filmgrain 0 -hwaccel auto -i "{distorted_path}" '
+            f"-pix_fmt yuv420p10le -an -sn -strict -1 {dist_filter} -f yuv4mpegpipe -"
+        ),
+        output_file=pipe,
     )
 
+
+def _make_pipe(path: str) -> str:
     # TODO: WINDOWS SUPPORT
-    run_cli(f"mkfifo {pipe_ref_path}")
-    run_cli(f"mkfifo {pipe_dist_path}")
+    os.mkfifo(path)
+    return path
+
+
+def get_input_pipes(chunk: ChunkObject, options: MetricOptions) -> dict:
+    """
+    Create two named pipes that will output distorted and reference yuv frames,
+    return the pipe paths and the commands that will feed them
+    """
+    assert os.path.exists(chunk.path)
+    assert os.path.exists(chunk.chunk_path)
+
+    random_bit = os.urandom(16).hex()
+    pipe_ref_path = f"/tmp/{os.path.basename(chunk.path)}_{random_bit}.pipe"
+    pipe_dist_path = f"/tmp/{os.path.basename(chunk.chunk_path)}_{random_bit}.pipe"
+
+    video_filters, dist_filter = get_metric_filters(options)
+
+    return {
+        "ref_pipe": _make_pipe(pipe_ref_path),
+        "dist_pipe": _make_pipe(pipe_dist_path),
+        "ref_command": _get_reference_command(
+            chunk, options, video_filters, pipe_ref_path
+        ),
+        "dist_command": _get_distorted_command(
+            chunk.chunk_path, dist_filter, pipe_dist_path
+        ),
+    }
+
+
+def get_batch_input_pipes(chunks: List[ChunkObject], options: MetricOptions) -> dict:
+    """
+    `get_input_pipes` for several distorted inputs of the same chunk, they share one reference pipe
+    :param chunks: copies of the same chunk, each with the `chunk_path` of one distorted input
+    """
+    for chunk in chunks:
+        assert os.path.exists(chunk.chunk_path)
+    reference = chunks[0]
+    assert os.path.exists(reference.path)
+
+    random_bit = os.urandom(16).hex()
+    pipe_ref_path = f"/tmp/{os.path.basename(reference.path)}_{random_bit}.pipe"
+    pipe_dist_paths = [
+        f"/tmp/{os.path.basename(chunk.chunk_path)}_{random_bit}_{i}.pipe"
+        for i, chunk in enumerate(chunks)
+    ]
 
-    # check if both pipes are created
-    assert os.path.exists(pipe_ref_path)
-    assert os.path.exists(pipe_dist_path)
+    video_filters, dist_filter = get_metric_filters(options)
 
     return {
-        "ref_pipe": pipe_ref_path,
-        "dist_pipe": pipe_dist_path,
-        "ref_command": ref_pipe_command,
-        "dist_command": dist_pipe_command,
+        "ref_pipe": _make_pipe(pipe_ref_path),
+        "dist_pipes": [_make_pipe(path) for path in pipe_dist_paths],
+        "ref_command": _get_reference_command(
+            reference, options, video_filters, pipe_ref_path
+        ),
+        "dist_commands": [
+            _get_distorted_command(chunk.chunk_path, dist_filter, path)
+            for chunk, path in zip(chunks, pipe_dist_paths)
+        ],
     }
 
 
@@ -0,0 +1,568 @@
+"""
+In-process VMAF through libvmaf's C api, so probes don't pay for spawning the vmaf cli,
+a json log round trip and reloading the model every time.
+Optional, if libvmaf can't be loaded `calc_vmaf` keeps using the cli.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+from alabamaEncode.core.util.cli_executor import run_cli, CliPipeline
+from alabamaEncode.core.util.yuv import Y4mStream
+from alabamaEncode.metrics.exception import VmafException
+
+VMAF_LOG_LEVEL_NONE = 0
+VMAF_PIX_FMT_YUV420P = 1
+VMAF_PIX_FMT_YUV422P = 2
+VMAF_PIX_FMT_YUV444P = 3
+VMAF_MODEL_FLAG_ENABLE_TRANSFORM = 1 << 1
+VMAF_POOL_METHOD_MEAN = 3
+VMAF_POOL_METHOD_HARMONIC_MEAN = 4
+
+
+class _VmafConfiguration(ctypes.Structure):
+    _fields_ = [
+        ("log_level", ctypes.c_int),
+        ("n_threads", ctypes.c_uint),
+        ("n_subsample", ctypes.c_uint),
+        ("cpumask", ctypes.c_uint64),
+        ("gpumask", ctypes.c_uint64),
+    ]
+
+
+class _VmafModelConfig(ctypes.Structure):
+    _fields_ = [
+        ("name", ctypes.c_char_p),
+        ("flags", ctypes.c_uint64),
+    ]
+
+
+class _VmafPicture(ctypes.Structure):
+    _fields_ = [
+        ("pix_fmt", ctypes.c_int),
+        ("bpc", ctypes.c_uint),
+        ("w", ctypes.c_uint * 3),
+        ("h", ctypes.c_uint * 3),
+        ("stride", ctypes.c_ssize_t * 3),
+        ("data", ctypes.c_void_p * 3),
+        ("ref", ctypes.c_void_p),
+        ("priv", ctypes.c_void_p),
+    ]
+
+
+# y4m chroma layout -> libvmaf pixel format
+_pix_fmts = {
+    "420": VMAF_PIX_FMT_YUV420P,
+    "422": VMAF_PIX_FMT_YUV422P,
+    "444": VMAF_PIX_FMT_YUV444P,
+}
+
+
+class VmafScores(NamedTuple):
+    scores: np.ndarray  # per frame, NaN where subsampled out or not reached
+    mean: float
+    harmonic_mean: float
+    stopped_early: bool = False
+
+
+def _open_y4m(file: BinaryIO) -> Y4mStream:
+    try:
+        return Y4mStream(file)
+    except ValueError as e:
+        raise VmafException(str(e))
+
+
+class LibVmaf:
+    """
+    Loaded once per process with `LibVmaf.get()`, models stay loaded between measurements
+    example:
+    scores = LibVmaf.get().compute(ref_y4m, dist_y4m, model_version="vmaf_v0.6.1", threads=4)
+    """
+
+    _instance: "LibVmaf" = None
+    _instance_lock = threading.Lock()
+    _unavailable = False
+
+    def __init__(self, library_path: str):
+        lib = ctypes.CDLL(library_path)
+        self.lib = lib
+        lib.vmaf_init.argtypes = [ctypes.POINTER(ctypes.c_void_p), _VmafConfiguration]
+        lib.vmaf_model_load.argtypes = [
+            ctypes.POINTER(ctypes.c_void_p),
+            ctypes.POINTER(_VmafModelConfig),
+            ctypes.c_char_p,
+        ]
+        lib.vmaf_model_load_from_path.argtypes = [
+            ctypes.POINTER(ctypes.c_void_p),
+            ctypes.POINTER(_VmafModelConfig),
+            ctypes.c_char_p,
+        ]
+        lib.vmaf_use_features_from_model.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        lib.vmaf_picture_alloc.argtypes = [
+            ctypes.POINTER(_VmafPicture),
+            ctypes.c_int,
+            ctypes.c_uint,
+            ctypes.c_uint,
+            ctypes.c_uint,
+        ]
+        lib.vmaf_picture_unref.argtypes = [ctypes.POINTER(_VmafPicture)]
+        lib.vmaf_read_pictures.argtypes = [
+            ctypes.c_void_p,
+            ctypes.POINTER(_VmafPicture),
+            ctypes.POINTER(_VmafPicture),
+            ctypes.c_uint,
+        ]
+        lib.vmaf_score_at_index.argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_void_p,
+            ctypes.POINTER(ctypes.c_double),
+            ctypes.c_uint,
+        ]
+        lib.vmaf_score_pooled.argtypes = [
+            ctypes.c_void_p,
+            ctypes.c_void_p,
+            ctypes.c_int,
+            ctypes.POINTER(ctypes.c_double),
+            ctypes.c_uint,
+            ctypes.c_uint,
+        ]
+        lib.vmaf_close.argtypes = [ctypes.c_void_p]
+        lib.vmaf_version.restype = ctypes.c_char_p
+        self._models: Dict[Tuple[str, str, int], ctypes.c_void_p] = {}
+        self._models_lock = threading.Lock()
+
+    @staticmethod
+    def find_library() -> [str | None]:
+        path = os.environ.get("ALABAMA_LIBVMAF")
+        if path is not None and os.path.exists(path):
+            return path
+        return ctypes.util.find_library("vmaf")
+
+    @staticmethod
+    def get() -> "LibVmaf":
+        """
+        :return: the process wide instance, None if libvmaf isn't available
+        """
+        with LibVmaf._instance_lock:
+            if LibVmaf._instance is None and not LibVmaf._unavailable:
+                path = LibVmaf.find_library()
+                try:
+                    if path is None:
+                        raise OSError("libvmaf not found")
+                    LibVmaf._instance = LibVmaf(path)
+                except (OSError, AttributeError):
+                    LibVmaf._unavailable = True
+            return LibVmaf._instance
+
+    def get_version(self) -> str:
+        return self.lib.vmaf_version().decode()
+
+    def _get_model(
+        self, model_path: str = None, model_version: str = None, flags: int = 0
+    ) -> ctypes.c_void_p:
+        key = (model_path, model_version, flags)
+        with self._models_lock:
+            if key not in self._models:
+                model = ctypes.c_void_p()
+                config = _VmafModelConfig(name=b"vmaf", flags=flags)
+                if model_path is not None:
+                    err = self.lib.vmaf_model_load_from_path(
+                        ctypes.byref(model), ctypes.byref(config), model_path.encode()
+                    )
+                else:
+                    err = self.lib.vmaf_model_load(
+                        ctypes.byref(model),
+                        ctypes.byref(config),
+                        model_version.encode(),
+                    )
+                if err != 0:
+                    raise VmafException(
+                        f"libvmaf could not load model {model_path or model_version}: {err}"
+                    )
+                self._models[key] = model
+            return self._models[key]
+
+    def _to_picture(self, stream: Y4mStream, planes) -> _VmafPicture:
+        picture = _VmafPicture()
+        if (
+            self.lib.vmaf_picture_alloc(
+                ctypes.byref(picture),
+                _pix_fmts[stream.chroma],
+                stream.bit_depth,
+                stream.width,
+                stream.height,
+            )
+            != 0
+        ):
+            raise VmafException("libvmaf could not allocate a picture")
+        for i, plane in enumerate(planes):
+            h, w = plane.shape
+            stride = picture.stride[i] // plane.itemsize
+            target = np.ctypeslib.as_array(
+                ctypes.cast(
+                    picture.data[i],
+                    ctypes.POINTER(
+                        ctypes.c_uint8 if plane.itemsize == 1 else ctypes.c_uint16
+                    ),
+                ),
+                shape=(h, stride),
+            )
+            target[:, :w] = plane
+        return picture
+
+    def _read_pictures(
+        self,
+        context: ctypes.c_void_p,
+        reference_stream: Y4mStream,
+        reference_planes,
+        distorted_stream: Y4mStream,
+        distorted_planes,
+        index: int,
+        fail_message: str,
+    ):
+        """
+        Hand a frame pair to libvmaf, it takes ownership of the pictures and unrefs them once it's done,
+        the ones it didn't take because something failed are unref'd here
+        """
+        reference_picture = self._to_picture(reference_stream, reference_planes)
+        try:
+            distorted_picture = self._to_picture(distorted_stream, distorted_planes)
+        except BaseException:
+            self.lib.vmaf_picture_unref(ctypes.byref(reference_picture))
+            raise
+        if (
+            self.lib.vmaf_read_pictures(
+                context,
+                ctypes.byref(reference_picture),
+                ctypes.byref(distorted_picture),
+                index,
+            )
+            != 0
+        ):
+            self.lib.vmaf_picture_unref(ctypes.byref(reference_picture))
+            self.lib.vmaf_picture_unref(ctypes.byref(distorted_picture))
+            raise VmafException(fail_message)
+
+    def compute(
+        self,
+        reference: BinaryIO,
+        distorted: BinaryIO,
+        model_path: str = None,
+        model_version: str = "vmaf_v0.6.1",
+        enable_transform: bool = False,
+        threads: int = 1,
+        subsample: int = 1,
+        early_stop_target: float = None,
+        early_stop_z: float = 2.0,
+        early_stop_min_scores: int = 8,
+    ) -> VmafScores:
+        """
+        :param reference: y4m stream of the reference
+        :param distorted: y4m stream of the distorted, same size and format as the reference
+        :param model_path: json model to load, otherwise the built-in `model_version` is used
+        :param subsample: score every nth frame
+        :param early_stop_target: stop reading frames once the confidence interval of the running mean
+        (mean ± early_stop_z standard errors) is entirely above or below this,
+        the result then only covers the frames read so far
+        """
+        model = self._get_model(
+            model_path,
+            model_version,
+            VMAF_MODEL_FLAG_ENABLE_TRANSFORM if enable_transform else 0,
+        )
+        context = self._init_context(model, threads, subsample)
+        try:
+            reference_stream = _open_y4m(reference)
+            distorted_stream = _open_y4m(distorted)
+            if (reference_stream.width, reference_stream.height) != (
+                distorted_stream.width,
+                distorted_stream.height,
+            ):
+                raise VmafException(
+                    f"reference is {reference_stream.width}x{reference_stream.height} "
+                    f"but distorted is {distorted_stream.width}x{distorted_stream.height}"
+                )
+
+            subsample = max(subsample, 1)
+            poll_interval = max(subsample * 4, 16)
+            running = []  # scores already available while still reading
+            stopped_early = False
+            score = ctypes.c_double()
+
+            count = 0
+            for reference_planes, distorted_planes in zip(
+                reference_stream.frames(), distorted_stream.frames()
+            ):
+                self._read_pictures(
+                    context,
+                    reference_stream,
+                    reference_planes,
+                    distorted_stream,
+                    distorted_planes,
+                    count,
+                    fail_message=f"libvmaf failed reading frame {count}",
+                )
+                count += 1
+
+                if early_stop_target is not None and count % poll_interval == 0:
+                    # motion needs the next frames and features are extracted on libvmaf's threads,
+                    # so only some of the read frames can be scored yet, stop at the first one that can't
+                    for index in range(len(running) * subsample, count - 2, subsample):
+                        if (
+                            self.lib.vmaf_score_at_index(
+                                context, model, ctypes.byref(score), index
+                            )
+                            != 0
+                        ):
+                            break
+                        running.append(score.value)
+                    if len(running) >= early_stop_min_scores:
+                        mean = np.mean(running)
+                        half_width = (
+                            early_stop_z
+                            * np.std(running, ddof=1)
+                            / np.sqrt(len(running))
+                        )
+                        if (
+                            mean - half_width > early_stop_target
+                            or mean + half_width < early_stop_target
+                        ):
+                            stopped_early = True
+                            break
+
+            if not stopped_early:
+                # let the feeders finish writing whatever is left if one stream was longer
+                for stream in [reference, distorted]:
+                    while stream.read(1024 * 1024):
+                        pass
+            return self._collect_scores(context, model, count, subsample, stopped_early)
+        finally:
+            self.lib.vmaf_close(context)
+
+    def compute_batch(
+        self,
+        reference: BinaryIO,
+        distorted: List[BinaryIO],
+        model_path: str = None,
+        model_version: str = "vmaf_v0.6.1",
+        enable_transform: bool = False,
+        threads: int = 1,
+        subsample: int = 1,
+    ) -> List[VmafScores]:
+        """
+        Score several distorted streams against one pass over the reference,
+        each reference frame is read once and handed to every candidate's context
+        :param distorted: y4m streams, all the size and format of the reference
+        :return: scores in the order of `distorted`
+        """
+        model = self._get_model(
+            model_path,
+            model_version,
+            VMAF_MODEL_FLAG_ENABLE_TRANSFORM if enable_transform else 0,
+        )
+        subsample = max(subsample, 1)
+        contexts = []
+        try:
+            for _ in distorted:
+                # the candidates are scored side by side, split the threads between them
+                contexts.append(
+                    self._init_context(
+                        model, max(threads // len(distorted), 1), subsample
+                    )
+                )
+
+            reference_stream = _open_y4m(reference)
+            distorted_streams = [_open_y4m(stream) for stream in distorted]
+            for index, stream in enumerate(distorted_streams):
+                if (stream.width, stream.height) != (
+                    reference_stream.width,
+                    reference_stream.height,
+                ):
+                    raise VmafException(
+                        f"reference is {reference_stream.width}x{reference_stream.height} "
+                        f"but distorted {index} is {stream.width}x{stream.height}"
+                    )
+
+            distorted_frames = [stream.frames() for stream in distorted_streams]
+            counts = [0] * len(distorted)
+            for reference_planes in reference_stream.frames():
+                if all(frames is None for frames in distorted_frames):
+                    break
+                for index, frames in enumerate(distorted_frames):
+                    if frames is None:
+                        continue
+                    distorted_planes = next(frames, None)
+                    if distorted_planes is None:
+                        distorted_frames[index] = None  # shorter than the reference
+                        continue
+                    # every context gets its own reference copy
+                    self._read_pictures(
+                        contexts[index],
+                        reference_stream,
+                        reference_planes,
+                        distorted_streams[index],
+                        distorted_planes,
+                        counts[index],
+                        fail_message=f"libvmaf failed reading frame {counts[index]} of distorted {index}",
+                    )
+                    counts[index] += 1
+
+            # let the feeders finish writing whatever is left if some stream was longer
+            for stream in [reference] + distorted:
+                while stream.read(1024 * 1024):
+                    pass
+
+            return [
+                self._collect_scores(context, model, count, subsample)
+                for context, count in zip(contexts, counts)
+            ]
+        finally:
+            for context in contexts:
+                self.lib.vmaf_close(context)
+
+    def _init_context(
+        self, model: ctypes.c_void_p, threads: int, subsample: int
+    ) -> ctypes.c_void_p:
+        context = ctypes.c_void_p()
+        config = _VmafConfiguration(
+            log_level=VMAF_LOG_LEVEL_NONE,
+            n_threads=max(threads, 1),
+            n_subsample=max(subsample, 1),
+        )
+        if self.lib.vmaf_init(ctypes.byref(context), config) != 0:
+            raise VmafException("libvmaf could not init a context")
+        if self.lib.vmaf_use_features_from_model(context, model) != 0:
+            self.lib.vmaf_close(context)
+            raise VmafException("libvmaf could not set up the model features")
+        return context
+
+    def _collect_scores(
+        self,
+        context: ctypes.c_void_p,
+        model: ctypes.c_void_p,
+        count: int,
+        subsample: int,
+        stopped_early: bool = False,
+    ) -> VmafScores:
+        """
+        Flush a context that was fed `count` frames and read back its per-frame and pooled scores
+        """
+        if count == 0:
+            raise VmafException("No frames to compare")
+        if self.lib.vmaf_read_pictures(context, None, None, 0) != 0:
+            raise VmafException("libvmaf failed flushing")
+
+        score = ctypes.c_double()
+        scores = np.full(count, np.nan)
+        for index in range(0, count, subsample):
+            if (
+                self.lib.vmaf_score_at_index(context, model, ctypes.byref(score), index)
+                == 0
+            ):
+                scores[index] = score.value
+
+        pooled = []
+        for method in [VMAF_POOL_METHOD_MEAN, VMAF_POOL_METHOD_HARMONIC_MEAN]:
+            if (
+                self.lib.vmaf_score_pooled(
+                    context, model, method, ctypes.byref(score), 0, count - 1
+                )
+                != 0
+            ):
+                raise VmafException("libvmaf failed pooling the scores")
+            pooled.append(score.value)
+        return VmafScores(scores, pooled[0], pooled[1], stopped_early)
+
+
+def calc_vmaf_libvmaf(
+    ref_command: CliPipeline,
+    dist_command: CliPipeline,
+    ref_pipe: str,
+    dist_pipe: str,
+    **kwargs,
+) -> VmafScores:
+    """
+    Run the commands feeding the reference & distorted fifos and score them in-process
+    :param kwargs: passed to `LibVmaf.compute`
+    """
+    lib = LibVmaf.get()
+    if lib is None:
+        raise VmafException("libvmaf is not available")
+
+    with ThreadPoolExecutor(max_workers=2) as feeders:
+        ref_future = feeders.submit(run_cli, ref_command)
+        dist_future = feeders.submit(run_cli, dist_command)
+        try:
+            with open(ref_pipe, "rb") as reference, open(dist_pipe, "rb") as distorted:
+                result = lib.compute(reference, distorted, **kwargs)
+        except BaseException:
+            # make sure the feeders aren't left blocked on a fifo nobody reads anymore
+            for pipe in [ref_pipe, dist_pipe]:
+                try:
+                    fd = os.open(pipe, os.O_RDONLY | os.O_NONBLOCK)
+                    os.close(fd)
+                except OSError:
+                    pass
+            raise
+        try:
+            for future in [ref_future, dist_future]:
+                feeder = future.result()
+                # feeders die of a broken pipe when we stop early, that's expected
+                if not result.stopped_early:
+                    feeder.verify(fail_message="Feeding libvmaf failed")
+        except (RuntimeError, OSError) as e:
+            # so callers fall back to the vmaf cli like on any other libvmaf failure
+            raise VmafException(str(e))
+    return result
+
+
+def calc_vmaf_libvmaf_batch(
+    ref_command: CliPipeline,
+    ref_pipe: str,
+    dist_commands: List[CliPipeline],
+    dist_pipes: List[str],
+    **kwargs,
+) -> List[VmafScores]:
+    """
+    `calc_vmaf_libvmaf` for several distorted inputs sharing one reference
+    :param kwargs: passed to `LibVmaf.compute_batch`
+    """
+    lib = LibVmaf.get()
+    if lib is None:
+        raise VmafException("libvmaf is not available")
+
+    pipes = [ref_pipe] + dist_pipes
+    with ThreadPoolExecutor(max_workers=len(pipes)) as feeders:
+        futures = [
+            feeders.submit(run_cli, command)
+            for command in [ref_command] + dist_commands
+        ]
+        streams = []
+        try:
+            # every feeder only blocks on its own fifo, so opening them one after the other can't deadlock
+            for pipe in pipes:
+                streams.append(open(pipe, "rb"))
+            results = lib.compute_batch(streams[0], streams[1:], **kwargs)
+        except BaseException:
+            for pipe in pipes:
+                try:
+                    fd = os.open(pipe, os.O_RDONLY | os.O_NONBLOCK)
+                    os.close(fd)
+                except OSError:
+                    pass
+            raise
+        finally:
+            for stream in streams:
+                stream.close()
+        try:
+            for future in futures:
+                future.result().verify(fail_message="Feeding libvmaf failed")
+        except (RuntimeError, OSError) as e:
+            raise VmafException(str(e))
+    return results
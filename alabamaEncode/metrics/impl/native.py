@@ -0,0 +1,427 @@
+"""
+SSIM and SSIMULACRA2 computed in-process with numpy over the decoded y4m frames,
+instead of running ffmpeg's ssim filter / ssimulacra2_rs and scraping their text output.
+Frames are read with the shared `Y4mStream` and scored on a thread pool, numpy releases the GIL in the kernels.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.yuv import Y4mStream
+from alabamaEncode.metrics.exception import MetricException
+from alabamaEncode.metrics.options import MetricOptions
+from alabamaEncode.scene.chunk import ChunkObject
+
+Planes = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def ssim_plane(reference: np.ndarray, distorted: np.ndarray, max_value: int) -> float:
+    """
+    SSIM of one plane the way ffmpeg's ssim filter does it,
+    unweighted 8x8 windows on a 4 pixel grid, built from sums of 4x4 blocks
+    """
+    h4, w4 = reference.shape[0] // 4, reference.shape[1] // 4
+    if h4 < 2 or w4 < 2:
+        raise MetricException("Plane too small for ssim")
+    a = reference[: h4 * 4, : w4 * 4].astype(np.float64)
+    b = distorted[: h4 * 4, : w4 * 4].astype(np.float64)
+
+    def window_sums(x: np.ndarray) -> np.ndarray:
+        blocks = x.reshape(h4, 4, w4, 4).sum(axis=(1, 3))
+        return blocks[:-1, :-1] + blocks[1:, :-1] + blocks[:-1, 1:] + blocks[1:, 1:]
+
+    s1 = window_sums(a)
+    s2 = window_sums(b)
+    ss = window_sums(a * a + b * b)
+    s12 = window_sums(a * b)
+
+    c1 = (0.01 * max_value) ** 2 * 64
+    c2 = (0.03 * max_value) ** 2 * 64 * 63
+    variances = ss * 64 - s1 * s1 - s2 * s2
+    covariance = s12 * 64 - s1 * s2
+    ssim = (2 * s1 * s2 + c1) * (2 * covariance + c2)
+    ssim /= (s1 * s1 + s2 * s2 + c1) * (variances + c2)
+    return float(ssim.mean())
+
+
+def ssim_frame(reference: Planes, distorted: Planes, bit_depth: int) -> float:
+    """
+    :return: the `All` ssim of a frame, the planes weighted by their size
+    """
+    max_value = (1 << bit_depth) - 1
+    total = 0.0
+    pixels = 0
+    for reference_plane, distorted_plane in zip(reference, distorted):
+        total += ssim_plane(reference_plane, distorted_plane, max_value) * (
+            reference_plane.size
+        )
+        pixels += reference_plane.size
+    return total / pixels
+
+
+def ssim_to_db(ssim: float) -> float:
+    if ssim >= 1:
+        return float("inf")
+    return float(-10 * np.log10(1 - ssim))
+
+
+# SSIMULACRA2, https://github.com/cloudinary/ssimulacra2
+
+_ssimulacra2_scales = 6
+_ssimulacra2_weights = np.array(
+    [
+        0.0,
+        0.0007376606707406586,
+        0.0,
+        0.0,
+        0.0007793481682867309,
+        0.0,
+        0.0,
+        0.0004371155730107379,
+        0.0,
+        1.1041726426657346,
+        0.00066284834129271,
+        0.00015231632783718752,
+        0.0,
+        0.0016406437456599754,
+        0.0,
+        1.8422455520539298,
+        11.441172603757666,
+        0.0,
+        0.0007989109436015163,
+        0.000176816438078653,
+        0.0,
+        1.8787594979546387,
+        10.94906990605142,
+        0.0,
+        0.0007289346991508072,
+        0.9677937080626833,
+        0.0,
+        0.00014003424285435884,
+        0.9981766977854967,
+        0.00031949755934435053,
+        0.0004550992113792063,
+        0.0,
+        0.0,
+        0.0013648766163243398,
+        0.0,
+        0.0,
+        0.0,
+        0.0,
+        0.0,
+        7.466890328078848,
+        0.0,
+        17.445833984131262,
+        0.0006235601634041466,
+        0.0,
+        0.0,
+        6.683678146179332,
+        0.00037724407979611296,
+        1.027889937768264,
+        225.20515300849274,
+        0.0,
+        0.0,
+        19.213238186143016,
+        0.0011401524586618361,
+        0.001237755635509985,
+        176.39317598450694,
+        0.0,
+        0.0,
+        24.43300999870476,
+        0.28520802612117757,
+        0.0004485436923833408,
+        0.0,
+        0.0,
+        0.0,
+        34.77906344483772,
+        44.835625328877896,
+        0.0,
+        0.0,
+        0.0,
+        0.0,
+        0.0,
+        0.0,
+        0.0,
+        0.0,
+        0.0008680556573291698,
+        0.0,
+        0.0,
+        0.0,
+        0.0,
+        0.0,
+        0.0005313191874358747,
+        0.0,
+        0.00016533814161379112,
+        0.0,
+        0.0,
+        0.0,
+        0.0,
+        0.0,
+        0.0004179171803251336,
+        0.0017290828234722833,
+        0.0,
+        0.0020827005846636437,
+        0.0,
+        0.0,
+        8.826982764996862,
+        23.19243343998926,
+        0.0,
+        95.1080498811086,
+        0.9863978034400682,
+        0.9834382792465353,
+        0.0012286405048278493,
+        171.2667255897307,
+        0.9807858872435379,
+        0.0,
+        0.0,
+        0.0,
+        0.0005130064588990679,
+        0.0,
+        0.00010854057858411537,
+    ]
+)
+
+# opsin absorbance of linear rgb, rows are l, m, s
+_opsin_matrix = np.array(
+    [
+        [0.30, 0.622, 0.078],
+        [0.23, 0.692, 0.078],
+        [0.24342268924547819, 0.20476744424496821, 0.55180986650955360],
+    ],
+    dtype=np.float32,
+)
+_opsin_bias = np.float32(0.0037930732552754493)
+
+_gaussian_radius = 5
+_gaussian_kernel = np.exp(
+    -0.5 * (np.arange(-_gaussian_radius, _gaussian_radius + 1) / 1.5) ** 2
+)
+_gaussian_kernel = (_gaussian_kernel / _gaussian_kernel.sum()).astype(np.float32)
+
+
+def yuv_to_linear_rgb(planes: Planes, bit_depth: int) -> np.ndarray:
+    """
+    Limited range BT.709 yuv to linear rgb, chroma upsampled by repetition
+    :return: (3, height, width) float32
+    """
+    y, u, v = planes
+    height, width = y.shape
+    scale = 1 << (bit_depth - 8)
+    u = u.repeat(-(-height // u.shape[0]), axis=0).repeat(
+        -(-width // u.shape[1]), axis=1
+    )
+    v = v.repeat(-(-height // v.shape[0]), axis=0).repeat(
+        -(-width // v.shape[1]), axis=1
+    )
+    luma = (y.astype(np.float32) - 16 * scale) / (219 * scale)
+    cb = (u[:height, :width].astype(np.float32) - 128 * scale) / (224 * scale)
+    cr = (v[:height, :width].astype(np.float32) - 128 * scale) / (224 * scale)
+
+    rgb = np.stack(
+        [
+            luma + 1.5748 * cr,
+            luma - 0.18732427 * cb - 0.46812427 * cr,
+            luma + 1.8556 * cb,
+        ]
+    )
+    np.clip(rgb, 0, 1, out=rgb)
+    # inverse of the BT.709 OETF
+    return np.where(
+        rgb < 0.081, rgb / 4.5, ((rgb + 0.099) / 1.099) ** np.float32(1 / 0.45)
+    ).astype(np.float32)
+
+
+def _linear_rgb_to_xyb(rgb: np.ndarray) -> np.ndarray:
+    """
+    XYB as ssimulacra2 uses it, shifted & scaled to be positive
+    """
+    mixed = np.tensordot(_opsin_matrix, rgb, axes=1) + _opsin_bias
+    np.maximum(mixed, 0, out=mixed)
+    mixed = np.cbrt(mixed) - np.cbrt(_opsin_bias)
+    x = 0.5 * (mixed[0] - mixed[1])
+    y = 0.5 * (mixed[0] + mixed[1])
+    b = mixed[2]
+    return np.stack([x * 14 + 0.42, y + 0.01, (b - y) + 0.55])
+
+
+def _blur(image: np.ndarray) -> np.ndarray:
+    """
+    Separable gaussian (sigma 1.5) over the last two axes, edges clamped
+    """
+    r = _gaussian_radius
+    padded = np.pad(image, ((0, 0), (r, r), (0, 0)), mode="edge")
+    vertical = np.zeros_like(image)
+    for i, weight in enumerate(_gaussian_kernel):
+        vertical += weight * padded[:, i : i + image.shape[1], :]
+    padded = np.pad(vertical, ((0, 0), (0, 0), (r, r)), mode="edge")
+    result = np.zeros_like(image)
+    for i, weight in enumerate(_gaussian_kernel):
+        result += weight * padded[:, :, i : i + image.shape[2]]
+    return result
+
+
+def _downsample(rgb: np.ndarray) -> np.ndarray:
+    """
+    2x2 box downscale, odd edges repeated
+    """
+    _, height, width = rgb.shape
+    rgb = np.pad(rgb, ((0, 0), (0, height % 2), (0, width % 2)), mode="edge")
+    return 0.25 * (
+        rgb[:, 0::2, 0::2]
+        + rgb[:, 1::2, 0::2]
+        + rgb[:, 0::2, 1::2]
+        + rgb[:, 1::2, 1::2]
+    )
+
+
+def _norms(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: 1-norm and 4-norm of each channel
+    """
+    flat = values.reshape(values.shape[0], -1).astype(np.float64)
+    squared = flat * flat
+    return flat.mean(axis=1), np.sqrt(np.sqrt((squared * squared).mean(axis=1)))
+
+
+def ssimulacra2_frame(reference_rgb: np.ndarray, distorted_rgb: np.ndarray) -> float:
+    """
+    :param reference_rgb: linear rgb, (3, height, width) float32
+    :param distorted_rgb: linear rgb of the same size
+    """
+    # per scale & channel: ssim 1/4-norm, artifact 1/4-norm, detail loss 1/4-norm
+    features = np.zeros((3, _ssimulacra2_scales, 6))
+    for scale in range(_ssimulacra2_scales):
+        if reference_rgb.shape[1] < 8 or reference_rgb.shape[2] < 8:
+            break
+        if scale > 0:
+            reference_rgb = _downsample(reference_rgb)
+            distorted_rgb = _downsample(distorted_rgb)
+
+        reference = _linear_rgb_to_xyb(reference_rgb)
+        distorted = _linear_rgb_to_xyb(distorted_rgb)
+
+        mu1 = _blur(reference)
+        mu2 = _blur(distorted)
+        sigma11 = _blur(reference * reference) - mu1 * mu1
+        sigma22 = _blur(distorted * distorted) - mu2 * mu2
+        sigma12 = _blur(reference * distorted) - mu1 * mu2
+
+        # luminance term is 1 - (mu1 - mu2)^2 instead of the usual one, and as an error 1 - ssim
+        ssim_error = 1 - (1 - (mu1 - mu2) ** 2) * (2 * sigma12 + 0.0009) / (
+            sigma11 + sigma22 + 0.0009
+        )
+        np.maximum(ssim_error, 0, out=ssim_error)
+
+        edge_difference = (1 + np.abs(distorted - mu2)) / (
+            1 + np.abs(reference - mu1)
+        ) - 1
+        artifact = np.maximum(edge_difference, 0)
+        detail_lost = np.maximum(-edge_difference, 0)
+
+        for i, values in enumerate([ssim_error, artifact, detail_lost]):
+            one_norm, four_norm = _norms(values)
+            features[:, scale, i] = one_norm
+            features[:, scale, i + 3] = four_norm
+
+    score = float(np.dot(_ssimulacra2_weights, np.abs(features).ravel()))
+    score *= 0.9562382616834844
+    score = (
+        2.326765642916932 * score
+        - 0.020884521182843837 * score**2
+        + 6.248496625763138e-05 * score**3
+    )
+    if score > 0:
+        return 100.0 - 10.0 * score**0.6276336467831387
+    return 100.0
+
+
+def ssimulacra2_yuv_frame(
+    reference: Planes, distorted: Planes, bit_depth: int
+) -> float:
+    return ssimulacra2_frame(
+        yuv_to_linear_rgb(reference, bit_depth),
+        yuv_to_linear_rgb(distorted, bit_depth),
+    )
+
+
+def score_frames(
+    chunk: ChunkObject,
+    options: MetricOptions,
+    score_frame: Callable[[Planes, Planes, int], float],
+) -> Tuple[np.ndarray, float]:
+    """
+    Decode the reference & distorted of a chunk like the cli metrics get them and score every frame pair,
+    `options.threads` frames at a time
+    :param score_frame: (reference planes, distorted planes, bit depth) -> score
+    :return: per-frame scores and the frames scored per second
+    """
+    from alabamaEncode.metrics.calculate import get_input_pipes, cleanup_input_pipes
+
+    owo = get_input_pipes(chunk=chunk, options=options)
+    threads = max(options.threads, 1)
+    start = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=2) as feeders, ThreadPoolExecutor(
+            max_workers=threads
+        ) as workers:
+            feeder_futures = [
+                feeders.submit(run_cli, owo["ref_command"]),
+                feeders.submit(run_cli, owo["dist_command"]),
+            ]
+            scores: List = []
+            try:
+                with open(owo["ref_pipe"], "rb") as ref, open(
+                    owo["dist_pipe"], "rb"
+                ) as dist:
+                    reference_stream = Y4mStream(ref)
+                    distorted_stream = Y4mStream(dist)
+                    if reference_stream.plane_shapes != distorted_stream.plane_shapes:
+                        raise MetricException(
+                            f"reference is {reference_stream.width}x{reference_stream.height} "
+                            f"but distorted is {distorted_stream.width}x{distorted_stream.height}"
+                        )
+                    bit_depth = reference_stream.bit_depth
+                    for reference_planes, distorted_planes in zip(
+                        reference_stream.frames(), distorted_stream.frames()
+                    ):
+                        # the streams reuse their buffers, keep a bounded amount of frames in flight
+                        if len(scores) >= threads * 2:
+                            scores[len(scores) - threads * 2].result()
+                        scores.append(
+                            workers.submit(
+                                score_frame,
+                                tuple(plane.copy() for plane in reference_planes),
+                                tuple(plane.copy() for plane in distorted_planes),
+                                bit_depth,
+                            )
+                        )
+                    for stream in [ref, dist]:
+                        while stream.read(1024 * 1024):
+                            pass
+            except BaseException as e:
+                # make sure the feeders aren't left blocked on a fifo nobody reads anymore
+                for pipe in [owo["ref_pipe"], owo["dist_pipe"]]:
+                    try:
+                        os.close(os.open(pipe, os.O_RDONLY | os.O_NONBLOCK))
+                    except OSError:
+                        pass
+                if isinstance(e, ValueError):
+                    raise MetricException(f"Could not read the metric input: {e}")
+                raise
+            for future in feeder_futures:
+                try:
+                    future.result().verify()
+                except RuntimeError as e:
+                    raise MetricException(f"Decoding the metric input failed: {e}")
+            scores = np.array([future.result() for future in scores])
+    finally:
+        cleanup_input_pipes(owo)
+
+    if len(scores) == 0:
+        raise MetricException("No frames to compare")
+    return scores, len(scores) / max(time.time() - start, 1e-3)
@@ -1,15 +1,19 @@
 import re
+import shlex
 
 from alabamaEncode.core.util.bin_utils import get_binary
-from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.cli_executor import run_cli, CliPipeline
 from alabamaEncode.scene.chunk import ChunkObject
 
 
 def get_video_psnr(distorted_path, in_chunk: ChunkObject = None):
-    null_ = in_chunk.create_chunk_ffmpeg_pipe_command()
-    null_ += f" | {get_binary('ffmpeg')} -hide_banner -i - "
-
-    null_ += f" -i {distorted_path} -filter_complex psnr -f null -"
+    null_ = CliPipeline(
+        shlex.split(in_chunk.create_chunk_ffmpeg_pipe_command()),
+        shlex.split(
+            f"{get_binary('ffmpeg')} -hide_banner -i - "
+            f" -i {distorted_path} -filter_complex psnr -f null -"
+        ),
+    )
 
     result_string = run_cli(null_).get_output()
     try:
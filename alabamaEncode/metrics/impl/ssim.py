@@ -1,25 +1,91 @@
+import copy
 import os
 import re
+import shlex
 
 from alabamaEncode.core.util.bin_utils import get_binary
-from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.cli_executor import run_cli, CliPipeline
+from alabamaEncode.metrics.exception import MetricException
+from alabamaEncode.metrics.impl.native import score_frames, ssim_frame, ssim_to_db
+from alabamaEncode.metrics.options import MetricOptions
+from alabamaEncode.metrics.result import ArrayMetricResult
 from alabamaEncode.scene.chunk import ChunkObject
 
 
+class SsimResult(ArrayMetricResult):
+    @property
+    def db(self) -> float:
+        return ssim_to_db(self.mean)
+
+    def __str__(self):
+        return f"{self.mean}"
+
+    def __repr__(self):
+        return (
+            f"SsimResult(mean={self.mean},"
+            f" db={self.db},"
+            f" prct_1={self.percentile_1},"
+            f" std_dev={self.std_dev})"
+        )
+
+
+def calc_ssim_native(chunk: ChunkObject, options: MetricOptions) -> SsimResult:
+    """
+    Per-frame ssim of `chunk.chunk_path` against the chunk, computed with numpy
+    """
+    scores, fps = score_frames(chunk, options, ssim_frame)
+    return SsimResult(scores=scores, fps=fps)
+
+
+def calc_ssim(chunk: ChunkObject, options: MetricOptions) -> SsimResult:
+    if options.use_native:
+        try:
+            return calc_ssim_native(chunk, options)
+        except MetricException as e:
+            print(f"Native ssim failed, falling back to ffmpeg: {e}")
+
+    result = SsimResult()
+    result.mean = get_video_ssim(
+        chunk.chunk_path, chunk, video_filters=options.video_filters
+    )
+    return result
+
+
 def get_video_ssim(
     distorted_path,
     in_chunk: ChunkObject = None,
     print_output=False,
     get_db=False,
     video_filters="",
+    native=False,
 ):
+    """
+    :param native: compute it with numpy instead of ffmpeg's ssim filter, ffmpeg is still used if that fails
+    """
     if not os.path.exists(in_chunk.path) or not os.path.exists(distorted_path):
         raise FileNotFoundError(
             f"File {in_chunk.path} or {distorted_path} does not exist"
         )
-    null_ = in_chunk.create_chunk_ffmpeg_pipe_command(video_filters=video_filters)
 
-    null_ += f" | {get_binary('ffmpeg')} -hide_banner -i - -i {distorted_path} -filter_complex ssim -f null -"
+    if native:
+        chunk = copy.deepcopy(in_chunk)
+        chunk.chunk_path = distorted_path
+        try:
+            result = calc_ssim_native(chunk, MetricOptions(video_filters=video_filters))
+            if get_db is True:
+                return result.mean, result.db
+            return result.mean
+        except MetricException as e:
+            print(f"Native ssim failed, falling back to ffmpeg: {e}")
+
+    null_ = CliPipeline(
+        shlex.split(
+            in_chunk.create_chunk_ffmpeg_pipe_command(video_filters=video_filters)
+        ),
+        shlex.split(
+            f"{get_binary('ffmpeg')} -hide_banner -i - -i {distorted_path} -filter_complex ssim -f null -"
+        ),
+    )
 
     result_string = run_cli(null_).get_output()
     if print_output:
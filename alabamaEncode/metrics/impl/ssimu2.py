@@ -1,12 +1,18 @@
+import shlex
+from functools import cached_property
+
+import numpy as np
+
 from alabamaEncode.core.util.bin_utils import get_binary, register_bin
 from alabamaEncode.core.util.cli_executor import run_cli_parallel
 from alabamaEncode.core.util.path import PathAlabama
 
 
-from alabamaEncode.metrics.exception import Ssimu2Exception
+from alabamaEncode.metrics.exception import MetricException, Ssimu2Exception
+from alabamaEncode.metrics.impl.native import score_frames, ssimulacra2_yuv_frame
 from alabamaEncode.metrics.metric import Metric
 from alabamaEncode.metrics.options import MetricOptions
-from alabamaEncode.metrics.result import MetricResult
+from alabamaEncode.metrics.result import ArrayMetricResult
 from alabamaEncode.scene.chunk import ChunkObject
 
 
@@ -21,6 +27,13 @@ def calc_ssimu2(
 ):
     assert ssimu2_options is not None
 
+    if ssimu2_options.use_native:
+        try:
+            scores, fps = score_frames(chunk, ssimu2_options, ssimulacra2_yuv_frame)
+            return Ssimu2Result(scores=scores, fps=fps)
+        except MetricException as e:
+            print(f"Native ssimulacra2 failed, falling back to ssimulacra2_rs: {e}")
+
     from alabamaEncode.metrics.calculate import get_input_pipes
 
     owo = get_input_pipes(chunk=chunk, options=ssimu2_options)
@@ -36,7 +49,7 @@ def calc_ssimu2(
         [
             ref_command,
             dist_command,
-            main_command,
+            shlex.split(main_command),
         ]
     )
 
@@ -55,8 +68,15 @@ def calc_ssimu2(
     return Ssimu2Result(cli_results[2].output)
 
 
-class Ssimu2Result(MetricResult):
-    def __init__(self, cli_out: str):
+class Ssimu2Result(ArrayMetricResult):
+    def __init__(self, cli_out: str = None, scores=None, fps=None):
+        """
+        :param cli_out: summary printed by ssimulacra2_rs, its values take precedence
+        :param scores: per-frame scores
+        """
+        super().__init__(scores=scores, fps=fps)
+        if cli_out is None:
+            return
         for line in cli_out.split("\n"):
             if "Mean" in line:
                 self.mean = float(line.split(":")[1])
@@ -69,6 +89,13 @@ class Ssimu2Result(MetricResult):
             if "95th Percentile" in line:
                 self.percentile_95 = float(line.split(":")[1])
 
+    @cached_property
+    def percentile_95(self):
+        if not self.has_scores():
+            return -1
+        index = int(len(self.scores) * 0.95)
+        return float(np.partition(self.scores, index)[index])
+
     def __str__(self):
         return f"{self.mean}"
 
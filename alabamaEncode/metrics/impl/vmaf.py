@@ -1,19 +1,30 @@
 import json
 import os
-from statistics import mean
+import shlex
+import time
+from typing import List
+
+import numpy as np
 
 from alabamaEncode.core.util.bin_utils import get_binary
 from alabamaEncode.core.util.bin_utils import register_bin
 from alabamaEncode.core.util.cli_executor import run_cli_parallel
 from alabamaEncode.core.util.path import PathAlabama
 from alabamaEncode.metrics.exception import VmafException
+from alabamaEncode.metrics.impl.libvmaf import (
+    LibVmaf,
+    VmafScores,
+    calc_vmaf_libvmaf,
+    calc_vmaf_libvmaf_batch,
+)
 from alabamaEncode.metrics.metric import Metric
 from alabamaEncode.metrics.options import MetricOptions
-from alabamaEncode.metrics.result import MetricResult
+from alabamaEncode.metrics.result import ArrayMetricResult
 from alabamaEncode.scene.chunk import ChunkObject
 
 
 class VmafOptions(MetricOptions):
+
     def __init__(
         self,
         phone=False,
@@ -21,6 +32,8 @@ class VmafOptions(MetricOptions):
         neg=False,
         no_motion=False,
         subsample=-1,
+        use_libvmaf=False,
+        early_stop_target=None,
         **kwargs,
     ):
         self.phone = phone
@@ -28,6 +41,10 @@ class VmafOptions(MetricOptions):
         self.neg = neg
         self.no_motion = no_motion
         self.subsample = subsample
+        # score in-process through libvmaf when it's available
+        self.use_libvmaf = use_libvmaf
+        # stop scoring once the mean is confidently above/below this, only with libvmaf
+        self.early_stop_target = early_stop_target
         super().__init__(**kwargs)
 
     def get_model(self) -> str or None:
@@ -72,6 +89,107 @@ class VmafOptions(MetricOptions):
         assert VmafOptions(neg=True).get_model() != VmafOptions().get_model()
 
 
+def get_libvmaf_kwargs(vmaf_options: VmafOptions) -> dict:
+    """
+    Translate the options into `LibVmaf.compute` arguments
+    """
+    model_path = None
+    model_version = "vmaf_v0.6.1"
+    enable_transform = False
+    model = vmaf_options.get_model()
+    if model is not None:
+        for option in model.split(":"):
+            if option.startswith("path="):
+                model_path = option[len("path=") :]
+            elif option == "enable_transform":
+                enable_transform = True
+    else:
+        if vmaf_options.uhd:
+            model_version = "vmaf_4k_v0.6.1"
+        elif vmaf_options.neg:
+            model_version = "vmaf_v0.6.1neg"
+        enable_transform = vmaf_options.phone
+
+    return {
+        "model_path": model_path,
+        "model_version": model_version,
+        "enable_transform": enable_transform,
+        "threads": vmaf_options.threads,
+        "subsample": (
+            vmaf_options.subsample
+            if vmaf_options.subsample is not None and vmaf_options.subsample > 0
+            else 1
+        ),
+    }
+
+
+def get_libvmaf_result(scores: VmafScores, seconds: float) -> "VmafResult":
+    valid = ~np.isnan(scores.scores)
+    result = VmafResult(
+        pooled_metrics={
+            "vmaf": {"mean": scores.mean, "harmonic_mean": scores.harmonic_mean}
+        },
+        scores=scores.scores[valid],
+        frame_numbers=np.flatnonzero(valid),
+        fps=len(scores.scores) / max(seconds, 1e-3),
+    )
+    result.stopped_early = scores.stopped_early
+    return result
+
+
+def calc_vmaf_in_process(chunk: ChunkObject, vmaf_options: VmafOptions):
+    """
+    Same as `calc_vmaf`, but scored by the process wide libvmaf instance instead of the vmaf cli
+    """
+    from alabamaEncode.metrics.calculate import get_input_pipes, cleanup_input_pipes
+
+    owo = get_input_pipes(chunk=chunk, options=vmaf_options)
+    start = time.time()
+    try:
+        scores = calc_vmaf_libvmaf(
+            ref_command=owo["ref_command"],
+            dist_command=owo["dist_command"],
+            ref_pipe=owo["ref_pipe"],
+            dist_pipe=owo["dist_pipe"],
+            early_stop_target=vmaf_options.early_stop_target,
+            **get_libvmaf_kwargs(vmaf_options),
+        )
+    finally:
+        cleanup_input_pipes(owo)
+
+    return get_libvmaf_result(scores, time.time() - start)
+
+
+def calc_vmaf_batch_in_process(
+    chunks: List[ChunkObject], vmaf_options: VmafOptions
+) -> List["VmafResult"]:
+    """
+    `calc_vmaf_in_process` for several encodes of the same chunk, scored in one pass over the reference
+    :param chunks: copies of the chunk, each with the `chunk_path` of one encode
+    """
+    from alabamaEncode.metrics.calculate import (
+        get_batch_input_pipes,
+        cleanup_input_pipes,
+    )
+
+    owo = get_batch_input_pipes(chunks=chunks, options=vmaf_options)
+    start = time.time()
+    try:
+        batch_scores = calc_vmaf_libvmaf_batch(
+            ref_command=owo["ref_command"],
+            ref_pipe=owo["ref_pipe"],
+            dist_commands=owo["dist_commands"],
+            dist_pipes=owo["dist_pipes"],
+            **get_libvmaf_kwargs(vmaf_options),
+        )
+    finally:
+        cleanup_input_pipes(owo)
+
+    # the candidates were scored side by side, they share the wall time
+    seconds = (time.time() - start) / len(chunks)
+    return [get_libvmaf_result(scores, seconds) for scores in batch_scores]
+
+
 def calc_vmaf(
     chunk: ChunkObject,
     vmaf_options: VmafOptions,
@@ -79,6 +197,12 @@ def calc_vmaf(
 ):
     assert vmaf_options is not None
 
+    if getattr(vmaf_options, "use_libvmaf", False) and LibVmaf.get() is not None:
+        try:
+            return calc_vmaf_in_process(chunk, vmaf_options)
+        except VmafException as e:
+            print(f"libvmaf failed, falling back to the vmaf cli: {e}")
+
     from alabamaEncode.metrics.calculate import get_input_pipes
 
     owo = get_input_pipes(chunk=chunk, options=vmaf_options)
@@ -110,7 +234,7 @@ def calc_vmaf(
         [
             ref_command,
             dist_command,
-            vmaf_command,
+            shlex.split(vmaf_command),
         ]
     )
 
@@ -143,46 +267,49 @@ def calc_vmaf(
     return result
 
 
-class VmafResult(MetricResult):
-    def __init__(self, _frames=None, pooled_metrics=None, fps=None):
+class VmafResult(ArrayMetricResult):
+    def __init__(
+        self,
+        _frames=None,
+        pooled_metrics=None,
+        fps=None,
+        scores=None,
+        frame_numbers=None,
+    ):
+        """
+        :param _frames: the `frames` of a vmaf json log, only the scores are kept
+        :param scores: per-frame scores, instead of a log
+        """
         if pooled_metrics is None:
             pooled_metrics = {}
 
-        self.fps = fps
-        self.frames = _frames
-
         if _frames is not None:
-            frames = []
-            for frame in _frames:
-                if "vmaf" in frame["metrics"]:
-                    frames.append([frame["frameNum"], frame["metrics"]["vmaf"]])
-                else:
-                    frames.append([frame["frameNum"], frame["metrics"]["phonevmaf"]])
-            frames.sort(key=lambda x: x[0])
-            # calc 1 5 10 25 50 percentiles
-            vmaf_scores = [x[1] for x in frames]
-            vmaf_scores.sort()
-            self.percentile_1 = vmaf_scores[int(len(vmaf_scores) * 0.01)]
-            self.percentile_5 = vmaf_scores[int(len(vmaf_scores) * 0.05)]
-            self.percentile_10 = vmaf_scores[int(len(vmaf_scores) * 0.1)]
-            self.percentile_25 = vmaf_scores[int(len(vmaf_scores) * 0.25)]
-            self.percentile_50 = vmaf_scores[int(len(vmaf_scores) * 0.5)]
-
-            if "vmaf" in pooled_metrics:
-                self.mean = pooled_metrics["vmaf"]["mean"]
-                self.harmonic_mean = pooled_metrics["vmaf"]["harmonic_mean"]
-            else:
-                self.mean = mean([x[1] for x in frames])
-                self.harmonic_mean = 1 / mean([1 / x[1] for x in frames if x[1] != 0])
-
-            self.max = max([x[1] for x in frames])
-            self.min = min([x[1] for x in frames])
+            frame_numbers = np.fromiter(
+                (frame["frameNum"] for frame in _frames),
+                dtype=np.int32,
+                count=len(_frames),
+            )
+            scores = np.fromiter(
+                (
+                    (
+                        frame["metrics"]["vmaf"]
+                        if "vmaf" in frame["metrics"]
+                        else frame["metrics"]["phonevmaf"]
+                    )
+                    for frame in _frames
+                ),
+                dtype=np.float32,
+                count=len(_frames),
+            )
 
-            self.std_dev = 0
-            for frame in frames:
-                self.std_dev += (frame[1] - self.mean) ** 2
-            self.std_dev /= len(frames)
-            self.std_dev **= 0.5
+        pooled = pooled_metrics.get("vmaf", {})
+        super().__init__(
+            scores=scores,
+            frame_numbers=frame_numbers,
+            fps=fps,
+            mean=pooled.get("mean"),
+            harmonic_mean=pooled.get("harmonic_mean"),
+        )
 
     def __str__(self):
         return f"{self.mean}"
@@ -8,6 +8,11 @@ class MetricOptions(ABC):
     denoise_reference = False
     video_filters = ""
     threads = 1
+    cache_reference = False  # read the reference from the FrameCache, for metrics repeated on the same chunk
+    reference_file = (
+        None  # already filtered reference y4m, read instead of decoding the source
+    )
+    use_native = False  # score ssim/ssimulacra2 in-process with numpy, the cli tools are the fallback
 
     def __init__(
         self,
@@ -1,4 +1,7 @@
 from abc import ABC
+from functools import cached_property
+
+import numpy as np
 
 
 class MetricResult(ABC):
@@ -17,3 +20,108 @@ class MetricResult(ABC):
     mean = -1
     harmonic_mean = -1
     std_dev = -1
+    stopped_early = False  # only a prefix of the frames got scored, see VmafOptions.early_stop_target
+
+
+class ArrayMetricResult(MetricResult):
+    """
+    Metric result backed by per-frame scores, kept as a compact float32 array instead of the raw log,
+    so results of long chunks stay small when deep-copied or pickled through celery.
+    Statistics are computed vectorised on first access,
+    pooled values reported by the metric tool can be passed in to take precedence.
+    """
+
+    def __init__(
+        self,
+        scores=None,
+        frame_numbers=None,
+        fps=None,
+        mean: float = None,
+        harmonic_mean: float = None,
+    ):
+        self.fps = fps
+        self.scores = None
+        self.frame_numbers = None
+        if scores is not None:
+            scores = np.asarray(scores, dtype=np.float32)
+            if frame_numbers is None:
+                frame_numbers = np.arange(len(scores), dtype=np.int32)
+            frame_numbers = np.asarray(frame_numbers, dtype=np.int32)
+            order = np.argsort(frame_numbers, kind="stable")
+            self.scores = scores[order]
+            self.frame_numbers = frame_numbers[order]
+        # instance attributes shadow the lazy properties below
+        if mean is not None:
+            self.mean = mean
+        if harmonic_mean is not None:
+            self.harmonic_mean = harmonic_mean
+
+    def has_scores(self) -> bool:
+        return self.scores is not None and len(self.scores) > 0
+
+    def get_frame_scores(self) -> dict:
+        """
+        :return: frame number -> score
+        """
+        if not self.has_scores():
+            return {}
+        return dict(zip(self.frame_numbers.tolist(), self.scores.tolist()))
+
+    @cached_property
+    def _percentiles(self) -> dict:
+        # same picks as indexing the sorted scores with int(len * p), without a full sort
+        if not self.has_scores():
+            return {}
+        indexes = {p: int(len(self.scores) * p) for p in [0.01, 0.05, 0.1, 0.25, 0.5]}
+        partitioned = np.partition(self.scores, sorted(set(indexes.values())))
+        return {p: float(partitioned[i]) for p, i in indexes.items()}
+
+    @cached_property
+    def percentile_1(self):
+        return self._percentiles.get(0.01, -1)
+
+    @cached_property
+    def percentile_5(self):
+        return self._percentiles.get(0.05, -1)
+
+    @cached_property
+    def percentile_10(self):
+        return self._percentiles.get(0.1, -1)
+
+    @cached_property
+    def percentile_25(self):
+        return self._percentiles.get(0.25, -1)
+
+    @cached_property
+    def percentile_50(self):
+        return self._percentiles.get(0.5, -1)
+
+    @cached_property
+    def mean(self):
+        if not self.has_scores():
+            return -1
+        return float(np.mean(self.scores, dtype=np.float64))
+
+    @cached_property
+    def harmonic_mean(self):
+        if not self.has_scores():
+            return -1
+        nonzero = self.scores[self.scores != 0].astype(np.float64)
+        if len(nonzero) == 0:
+            return -1
+        return float(1 / np.mean(1 / nonzero))
+
+    @cached_property
+    def max(self):
+        return float(np.max(self.scores)) if self.has_scores() else -1
+
+    @cached_property
+    def min(self):
+        return float(np.min(self.scores)) if self.has_scores() else -1
+
+    @cached_property
+    def std_dev(self):
+        if not self.has_scores():
+            return -1
+        deviation = self.scores.astype(np.float64) - self.mean
+        return float(np.sqrt(np.mean(deviation * deviation)))
@@ -0,0 +1,132 @@
+import heapq
+from typing import List, Dict, Tuple
+
+from alabamaEncode.core.chunk_job import ChunkEncoder
+from alabamaEncode.core.util.kv import AlabamaKv
+from alabamaEncode.parallel_execution.chunk_ledger import ChunkLedger
+from alabamaEncode.scene.chunk import ChunkObject
+
+
+class ChunkCostModel:
+    """
+    Predicts how long a chunk will take to encode from its frame count, resolution and complexity,
+    calibrated against the `chunk_timing` and `chunk_ledger` history of the job when there is any.
+    Without history the predictions are in relative units, which is all the ordering needs.
+    Without complexities (from the first pass index) the chunks of a sequence only differ in frame count,
+    measured times only exist for chunks that are done, so the ordering is then the same as by length.
+    """
+
+    def __init__(self, kv: AlabamaKv = None):
+        self.kv = kv
+
+    @staticmethod
+    def get_work(chunk: ChunkObject, mean_complexity: float = -1) -> float:
+        """
+        :return: the amount of work in a chunk, in megapixel-frames scaled by its relative complexity
+        """
+        pixels = 1920 * 1080
+        if chunk.width > 0 and chunk.height > 0:
+            pixels = chunk.width * chunk.height
+
+        work = chunk.get_frame_count() * pixels / 1_000_000
+
+        if chunk.complexity > 0 and mean_complexity > 0:
+            work *= chunk.complexity / mean_complexity
+
+        return work
+
+    def get_measured_times(self) -> Dict[int, float]:
+        """
+        :return: chunk_index -> seconds it took to encode, from previous (attempts of) encodes
+        """
+        measured = {}
+        if self.kv is None:
+            return measured
+
+        for index, entry in self.kv.get_all(ChunkLedger.bucket).items():
+            if entry.get("success", False) and entry.get("end", -1) > 0:
+                measured[int(index)] = entry["end"] - entry["start"]
+
+        # chunk_timing is written by the ChunkEncoder itself, so it's the more accurate one
+        for index, timing in self.kv.get_all("chunk_timing").items():
+            if "chunk" in timing and timing["chunk"] > 0:
+                measured[int(index)] = timing["chunk"]
+
+        return measured
+
+    def is_calibrated(self, history: List[ChunkObject]) -> bool:
+        """
+        :return: whether any chunk of `history` has a measured time, i.e. predictions are in seconds
+        """
+        measured = self.get_measured_times()
+        return any(c.chunk_index in measured for c in history)
+
+    def predict(
+        self, chunks: List[ChunkObject], history: List[ChunkObject] = None
+    ) -> Dict[int, float]:
+        """
+        Predict the encode time of chunks
+        :param chunks: chunks to predict
+        :param history: chunks of the sequence whose measured times can be used to calibrate the model,
+         defaults to `chunks`
+        :return: chunk_index -> predicted seconds (or relative cost if there is no history yet)
+        """
+        if history is None:
+            history = chunks
+
+        complexities = [c.complexity for c in history if c.complexity > 0]
+        mean_complexity = (
+            sum(complexities) / len(complexities) if len(complexities) > 0 else -1
+        )
+
+        measured = self.get_measured_times()
+
+        # seconds per unit of work, fitted on every chunk we have a timing for
+        seconds_per_work = 1.0
+        measured_work = 0
+        measured_time = 0
+        for c in history:
+            if c.chunk_index in measured:
+                measured_work += self.get_work(c, mean_complexity)
+                measured_time += measured[c.chunk_index]
+        if measured_work > 0 and measured_time > 0:
+            seconds_per_work = measured_time / measured_work
+
+        predictions = {}
+        for c in chunks:
+            if c.chunk_index in measured:
+                predictions[c.chunk_index] = measured[c.chunk_index]
+            else:
+                predictions[c.chunk_index] = (
+                    self.get_work(c, mean_complexity) * seconds_per_work
+                )
+        return predictions
+
+
+def lpt_order(
+    command_objects: List[ChunkEncoder],
+    workers: int,
+    cost_model: ChunkCostModel,
+    history: List[ChunkObject] = None,
+) -> Tuple[List[ChunkEncoder], float]:
+    """
+    Longest-processing-time-first ordering, since the executor hands the next chunk to whatever slot frees up first,
+    dispatching in descending predicted cost is the LPT list schedule
+    :param command_objects: chunks to order
+    :param workers: number of parallel workers to simulate the schedule on
+    :param cost_model: model to predict the chunk cost with
+    :param history: chunks to calibrate the model with, see ChunkCostModel.predict
+    :return: ordered commands and the predicted makespan
+    """
+    costs = cost_model.predict([c.chunk for c in command_objects], history=history)
+    ordered = sorted(
+        command_objects, key=lambda x: costs[x.chunk.chunk_index], reverse=True
+    )
+
+    # simulate the schedule, each chunk goes to the worker that frees up first
+    worker_loads = [0.0] * max(1, min(workers, len(ordered)))
+    for command in ordered:
+        least_loaded = heapq.heappop(worker_loads)
+        heapq.heappush(worker_loads, least_loaded + costs[command.chunk.chunk_index])
+
+    return ordered, max(worker_loads)
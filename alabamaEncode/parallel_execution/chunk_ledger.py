@@ -0,0 +1,57 @@
+import time
+from typing import Dict
+
+from alabamaEncode.core.util.kv import AlabamaKv
+from alabamaEncode.scene.chunk import ChunkObject
+
+
+class ChunkLedger:
+    """
+    Per-chunk record of how each encode went in the local executor (start, end, core, fps, bytes),
+    persisted in the kv so it survives restarts and can feed later scheduling decisions
+    """
+
+    bucket = "chunk_ledger"
+
+    def __init__(self, kv: AlabamaKv):
+        self.kv = kv
+        self.entries: Dict[int, dict] = {}
+
+    def start(self, chunk: ChunkObject, core: int = -1, slot: int = -1):
+        self.entries[chunk.chunk_index] = {
+            "chunk_index": chunk.chunk_index,
+            "frames": chunk.get_frame_count(),
+            "start": time.time(),
+            "end": -1,
+            "core": core,
+            "slot": slot,
+            "fps": -1,
+            "bytes": -1,
+            "success": False,
+        }
+
+    def finish(self, chunk: ChunkObject, stats: dict = None) -> dict:
+        """
+        Close the entry of a chunk and save it to the kv
+        :param chunk: the chunk that finished
+        :param stats: EncodeStats dict returned by the ChunkEncoder, None if the encode failed
+        :return: the finished entry
+        """
+        entry = self.entries[chunk.chunk_index]
+        entry["end"] = time.time()
+        took = entry["end"] - entry["start"]
+        if took > 0:
+            entry["fps"] = round(entry["frames"] / took, 2)
+        if stats is not None:
+            entry["bytes"] = int(stats["size"] * 1000)
+            entry["success"] = True
+
+        self.kv.set(self.bucket, chunk.chunk_index, entry, individual_mode=True)
+        return entry
+
+    def get_all(self) -> Dict[int, dict]:
+        """
+        :return: every entry recorded so far, including ones from previous runs
+        """
+        saved = {int(k): v for k, v in self.kv.get_all(self.bucket).items()}
+        return {**saved, **self.entries}
@@ -2,13 +2,14 @@ import asyncio
 import os
 import time
 from concurrent.futures import ThreadPoolExecutor
-from typing import List, Tuple
+from typing import AsyncIterator, List, Tuple
 
 import psutil
 from tqdm import tqdm
 
 from alabamaEncode.core.chunk_job import ChunkEncoder
 from alabamaEncode.parallel_execution.celery_app import run_command_on_celery, app
+from alabamaEncode.parallel_execution.chunk_ledger import ChunkLedger
 from alabamaEncode.parallel_execution.command import BaseCommandObject
 
 
@@ -21,6 +22,7 @@ async def execute_commands(
     size_estimate_data: tuple = None,
     throughput_scaling=False,
     pbar: tqdm = None,
+    command_stream: AsyncIterator[BaseCommandObject] = None,
 ):
     """
     Execute a list of commands in parallel
@@ -32,8 +34,26 @@ async def execute_commands(
     :param multiprocess_workers: number of workers in multiprocess mode, -1 for auto adjust
     :param finished_scene_callback: call when a scene finishes, contains the number of finished scenes
     :param size_estimate_data: tuple(frames, kB) of scenes encoded so far for the estimate
+    :param command_stream: more commands that arrive while the others are already running, e.g. chunks of scenes that
+    are still being detected, they have to be the same kind as `command_objects`
     """
-    if command_objects is None or len(command_objects) == 0:
+    command_objects = list(command_objects) if command_objects is not None else []
+    if use_celery and command_stream is not None:
+        command_objects += [command async for command in command_stream]
+        command_stream = None
+    if len(command_objects) == 0 and command_stream is not None:
+        # the first command tells us what kind of commands these are
+        first_command = await anext(command_stream, None)
+        if first_command is None:
+            command_stream = None
+        else:
+            command_objects.append(first_command)
+            pbar.total += (
+                first_command.chunk.length
+                if isinstance(first_command, ChunkEncoder)
+                else 1
+            )
+    if len(command_objects) == 0:
         return
     are_commands_adaptive_commands = isinstance(command_objects[0], ChunkEncoder)
 
@@ -53,9 +73,12 @@ async def execute_commands(
         for a in command_objects:
             a.run_on_celery = True
 
-        running_tasks = [
-            run_command_on_celery.delay(command) for command in command_objects
-        ]
+        # tie each task to its command, tasks finish in any order
+        task_commands = {
+            run_command_on_celery.delay(command): command
+            for command in command_objects
+        }
+        running_tasks = list(task_commands.keys())
         pbar.set_description(f"WORKERS - ESTM BITRATE -")
 
         while True:
@@ -71,9 +94,7 @@ async def execute_commands(
                     if task.ready():
                         result = task.get()
                         if are_commands_adaptive_commands and result is not None:
-                            finished_command = command_objects[
-                                running_tasks.index(task)
-                            ]
+                            finished_command = task_commands[task]
                             pbar.update(finished_command.chunk.get_frame_count())
                             pinned_code, stats = result
                             encoded_frames_so_far += stats["length_frames"]
@@ -100,7 +121,7 @@ async def execute_commands(
                 raise e
         pbar.close()
     else:
-        futures, completed_count = [], 0
+        completed_count = 0
 
         core_count, auto_scale = os.cpu_count(), multiprocess_workers == -1
         target_cpu_utilization, max_mem_usage = 95, 80
@@ -161,7 +182,7 @@ async def execute_commands(
             previuus_thughput = current_thughput
             current_thughput = sum(thughput_history) / len(thughput_history)
             # tqdm.write(
-            #     f"Current throughput: {current_thughput:.2f} f/s, Last: {previuus_thughput:.2f} f/s, currently running jobs: {len(futures)}"
+            #     f"Current throughput: {current_thughput:.2f} f/s, Last: {previuus_thughput:.2f} f/s, currently running jobs: {len(running_slots)}"
             # )
 
         def callback_wrapper():
@@ -179,105 +200,221 @@ async def execute_commands(
 
         pbar.set_description(f"WORKERS: - CPU -% SWAP -%")
 
-        while completed_count < total_scenes:
-            currently_running_jobs = len(futures)
-
-            # Start new jobs if we are under the local_jobs_limit
-            while (
-                currently_running_jobs <= local_jobs_limit
-                and completed_count + currently_running_jobs < total_scenes
-            ):
-                command = command_objects[completed_count + currently_running_jobs]
-                if pin_to_cores and 0 in used_cores:
-                    core = used_cores.index(0)
-                    used_cores[core] = 1
-                    command.pin_to_core = core
-                future = loop.run_in_executor(executor, command.run)
-                futures.append(future)
-                currently_running_jobs = len(futures)
-
-            # wait for any of the tasks to finish
-            done, pending = await asyncio.wait(futures, timeout=7)
-            futures = [f for f in futures if not f.done()]
-            currently_running_jobs = len(futures)
-
-            # do stuff with the finished tasks
-            for future in done:
-                rslt = await future
-                units_encoded = 1
-                if are_commands_adaptive_commands and rslt is not None:
-                    pined_core: int = rslt[0]
-                    stats = rslt[1]
-                    command_object = command_objects[completed_count]
-                    if not command_object.supports_encoded_a_frame_callback():
-                        units_encoded = command_object.chunk.get_frame_count()
-                        frames_encoded(units_encoded)
-                    if stats is not None:
-                        encoded_frames_so_far += stats["length_frames"]
-                        encoded_size_so_far += stats["size"]
-
-                    if pin_to_cores:
-                        used_cores[pined_core] = 0
-
-                pbar.update(units_encoded)
-
-                completed_count += 1
-
-            # update the progress bar with the current system stats
-            bitrate_estimate = " ESTM BITRATE N/A"
-            if encoded_frames_so_far > 0:
-                fps = command_objects[0].chunk.framerate
-                bitrate_estimate = (
-                    f" ESTM BITRATE {((encoded_size_so_far * 8) / (encoded_frames_so_far / fps)):.2f} "
-                    f"kb/s"
+        # finished futures push themselves here, so we wake up the moment a chunk is done
+        # instead of polling, and can immediately hand the freed slot to the next chunk
+        completion_queue: asyncio.Queue = asyncio.Queue()
+        # how often to refresh the progress bar stats & job limits if nothing finishes
+        stats_refresh_interval = 7
+        last_stats_refresh = 0
+
+        running_slots = {}  # future -> slot index it occupies
+        running_commands = {}  # future -> command it is running
+        slot_free_since = {}  # slot index -> time it went idle
+        slot_idle_time = {}  # slot index -> total seconds spent idle between chunks
+        next_command_index = 0
+
+        ledger = None
+
+        stream_exhausted = command_stream is None
+
+        async def pull_commands():
+            nonlocal total_scenes, stream_exhausted
+            try:
+                async for command in command_stream:
+                    if are_commands_adaptive_commands:
+                        command.encoded_a_frame_callback = (
+                            lambda frame, bitrate, fps: callback_wrapper()
+                        )
+                        pbar.total += command.chunk.length
+                    else:
+                        pbar.total += 1
+                    pbar.refresh()
+                    command_objects.append(command)
+                    total_scenes += 1
+                    # wake up the loop below so the command starts right away if there is a free slot
+                    completion_queue.put_nowait(None)
+            finally:
+                stream_exhausted = True
+                completion_queue.put_nowait(None)
+
+        stream_task = (
+            asyncio.ensure_future(pull_commands())
+            if command_stream is not None
+            else None
+        )
+
+        def start_command(command):
+            nonlocal ledger
+            # take the lowest free slot so the idle time accounting stays stable
+            taken_slots = set(running_slots.values())
+            slot = 0
+            while slot in taken_slots:
+                slot += 1
+
+            now = time.time()
+            if slot in slot_free_since:
+                slot_idle_time[slot] = (
+                    slot_idle_time.get(slot, 0) + now - slot_free_since.pop(slot)
                 )
-            cpu_percent = psutil.cpu_percent()
-            memory_percent = psutil.virtual_memory().percent
-            pbar.set_description(
-                f"WORKERS {currently_running_jobs} CPU {int(cpu_percent)}% "
-                f"MEM {int(memory_percent)}%{bitrate_estimate}"
-            )
-            # change the local_jobs_limit based on the picked strategy
-            if throughput_scaling:
-                if thouput_compare != current_thughput:
-                    tqdm.write(
-                        f"Checking throughput, current: {current_thughput:.2f} f/s, previous: {previuus_thughput:.2f} f/s"
+            else:
+                slot_idle_time.setdefault(slot, 0)
+
+            if pin_to_cores and 0 in used_cores:
+                core = used_cores.index(0)
+                used_cores[core] = 1
+                command.pin_to_core = core
+            if ledger is None and are_commands_adaptive_commands:
+                ledger = ChunkLedger(command.ctx.get_kv())
+            if ledger is not None:
+                ledger.start(command.chunk, core=command.pin_to_core, slot=slot)
+            future = loop.run_in_executor(executor, command.run)
+            running_slots[future] = slot
+            running_commands[future] = command
+            future.add_done_callback(completion_queue.put_nowait)
+
+        try:
+            while completed_count < total_scenes or not stream_exhausted:
+                # Start new jobs if we are under the local_jobs_limit
+                while (
+                    len(running_slots) <= local_jobs_limit
+                    and next_command_index < total_scenes
+                ):
+                    start_command(command_objects[next_command_index])
+                    next_command_index += 1
+
+                currently_running_jobs = len(running_slots)
+
+                # wait for the first task to finish, timing out only to refresh the stats
+                done = []
+                try:
+                    done.append(
+                        await asyncio.wait_for(
+                            completion_queue.get(), timeout=stats_refresh_interval
+                        )
                     )
-                    # if we observe that throughput is decreasing, reverse the trend
-                    if previuus_thughput > current_thughput:
-                        thouput_reverse_trend_trigger_counter += 1
-                        if thouput_reverse_trend_trigger_counter <= 2:
-                            thouput_reverse_trend_trigger_counter = 0
-                            if thouput_change_trend == -1:
-                                thouput_change_trend = 1
-                            elif thouput_change_trend == 1:
-                                thouput_change_trend = -1
-                            tqdm.write(
-                                f"Reversing jobs limit trend to {'increasing' if thouput_change_trend == 1 else 'decreasing'}"
-                            )
-                            if thouput_change_trend == 1:
-                                tqdm.write(
-                                    f"Increasing local_jobs_limit to {local_jobs_limit + 1}"
-                                )
-                                local_jobs_limit += 1
-                            # if the throughput is decreasing, decrease the local_jobs_limit
-                            elif thouput_change_trend == -1:
+                except asyncio.TimeoutError:
+                    pass
+                while not completion_queue.empty():
+                    done.append(completion_queue.get_nowait())
+
+                # do stuff with the finished tasks
+                for future in done:
+                    if future is None:
+                        continue  # new commands arrived
+                    slot_free_since[running_slots.pop(future)] = time.time()
+                    command_object = running_commands.pop(future)
+
+                    # free the core even if the chunk failed, otherwise it's lost for the rest of the run
+                    pinned_core = getattr(command_object, "pin_to_core", -1)
+                    if pin_to_cores and pinned_core != -1:
+                        used_cores[pinned_core] = 0
+
+                    rslt = future.result()
+                    units_encoded = 1
+                    stats = None
+                    if are_commands_adaptive_commands and rslt is not None:
+                        stats = rslt[1]
+                        if not command_object.supports_encoded_a_frame_callback():
+                            units_encoded = command_object.chunk.get_frame_count()
+                            frames_encoded(units_encoded)
+                        if stats is not None:
+                            encoded_frames_so_far += stats["length_frames"]
+                            encoded_size_so_far += stats["size"]
+
+                    if ledger is not None:
+                        ledger.finish(command_object.chunk, stats)
+
+                    pbar.update(units_encoded)
+
+                    completed_count += 1
+
+                currently_running_jobs = len(running_slots)
+
+                if finished_scene_callback is not None:
+                    finished_scene_callback(completed_count)
+
+                # every finished chunk & streamed command wakes us up, only sample the system and move the
+                # job limit once per refresh interval so it doesn't swing by one on every event
+                if time.time() - last_stats_refresh < stats_refresh_interval:
+                    continue
+                last_stats_refresh = time.time()
+
+                # update the progress bar with the current system stats
+                bitrate_estimate = " ESTM BITRATE N/A"
+                if encoded_frames_so_far > 0:
+                    fps = command_objects[0].chunk.framerate
+                    bitrate_estimate = (
+                        f" ESTM BITRATE {((encoded_size_so_far * 8) / (encoded_frames_so_far / fps)):.2f} "
+                        f"kb/s"
+                    )
+                cpu_percent = psutil.cpu_percent()
+                memory_percent = psutil.virtual_memory().percent
+                pbar.set_description(
+                    f"WORKERS {currently_running_jobs} CPU {int(cpu_percent)}% "
+                    f"MEM {int(memory_percent)}%{bitrate_estimate}"
+                )
+                # change the local_jobs_limit based on the picked strategy
+                if throughput_scaling:
+                    if thouput_compare != current_thughput:
+                        tqdm.write(
+                            f"Checking throughput, current: {current_thughput:.2f} f/s, previous: {previuus_thughput:.2f} f/s"
+                        )
+                        # if we observe that throughput is decreasing, reverse the trend
+                        if previuus_thughput > current_thughput:
+                            thouput_reverse_trend_trigger_counter += 1
+                            if thouput_reverse_trend_trigger_counter <= 2:
+                                thouput_reverse_trend_trigger_counter = 0
+                                if thouput_change_trend == -1:
+                                    thouput_change_trend = 1
+                                elif thouput_change_trend == 1:
+                                    thouput_change_trend = -1
                                 tqdm.write(
-                                    f"Decreasing local_jobs_limit to {local_jobs_limit - 1}"
+                                    f"Reversing jobs limit trend to {'increasing' if thouput_change_trend == 1 else 'decreasing'}"
                                 )
-                                local_jobs_limit -= 1
-
-                            thouput_compare = current_thughput
-            elif auto_scale and currently_running_jobs > 0:             
-                local_jobs_limit += (
-                    1
-                    if cpu_percent <= target_cpu_utilization
-                    and memory_percent <= max_mem_usage
-                    else -1
+                                if thouput_change_trend == 1:
+                                    tqdm.write(
+                                        f"Increasing local_jobs_limit to {local_jobs_limit + 1}"
+                                    )
+                                    local_jobs_limit += 1
+                                # if the throughput is decreasing, decrease the local_jobs_limit
+                                elif thouput_change_trend == -1:
+                                    tqdm.write(
+                                        f"Decreasing local_jobs_limit to {local_jobs_limit - 1}"
+                                    )
+                                    local_jobs_limit -= 1
+
+                                thouput_compare = current_thughput
+                elif auto_scale and currently_running_jobs > 0:
+                    local_jobs_limit += (
+                        1
+                        if cpu_percent <= target_cpu_utilization
+                        and memory_percent <= max_mem_usage
+                        else -1
+                    )
+                    local_jobs_limit = max(1, min(local_jobs_limit, max_jobs_limit))
+
+            pbar.close()
+
+            if stream_task is not None:
+                await stream_task  # raises if the stream failed
+        finally:
+            # a failing command ends the loop early, don't leave the stream being pulled
+            if stream_task is not None and not stream_task.done():
+                stream_task.cancel()
+                try:
+                    await stream_task
+                except asyncio.CancelledError:
+                    pass
+
+        # slots still free at this point waited on the tail of the job, not on us
+        finished_at = time.time()
+        tail_idle_time = sum(finished_at - t for t in slot_free_since.values())
+        if len(slot_idle_time) > 0:
+            tqdm.write(
+                f"Slot idle time between chunks: {sum(slot_idle_time.values()):.1f}s total, "
+                + ", ".join(
+                    f"#{slot} {idle:.1f}s"
+                    for slot, idle in sorted(slot_idle_time.items())
                 )
-                local_jobs_limit = max(1, min(local_jobs_limit, max_jobs_limit))
-
-            if finished_scene_callback is not None:
-                finished_scene_callback(completed_count)
-
-        pbar.close()
+                + f"; idle waiting on the last chunks: {tail_idle_time:.1f}s"
+            )
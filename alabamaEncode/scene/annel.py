@@ -1,7 +1,9 @@
 import math
-import random
+import os
 from typing import List
 
+import numpy as np
+
 from alabamaEncode.core.chunk_job import ChunkEncoder
 
 
@@ -10,51 +12,86 @@ def total_length(scenes: List[ChunkEncoder]) -> int:
 
 
 def get_variance(scenes: List[ChunkEncoder]) -> float:
-    avg_length = total_length(scenes) / len(scenes)
-    variance = sum((scene.chunk.length - avg_length) ** 2 for scene in scenes) / len(
-        scenes
-    )
-    return variance
-
-
-def annealing(scenes: List[ChunkEncoder], iterations: int) -> List[ChunkEncoder]:
-
-    if len(scenes) < 2:
-        return scenes
+    return float(np.var([scene.chunk.length for scene in scenes]))
 
-    current_solution = scenes.copy()
-    best_solution = scenes.copy()
-    temperature = 1.0
-    cooling_rate = 0.95
 
-    for _ in range(iterations):
-        neighbor_solution = current_solution.copy()
-
-        # Swap two random scenes
-        idx1, idx2 = random.sample(range(len(neighbor_solution)), 2)
-        neighbor_solution[idx1], neighbor_solution[idx2] = (
-            neighbor_solution[idx2],
-            neighbor_solution[idx1],
-        )
-
-        # Calculate the variance of current and neighbor solutions
-        current_variance = get_variance(current_solution)
-        neighbor_variance = get_variance(neighbor_solution)
+def get_worker_loads(lengths: np.ndarray, workers: int) -> np.ndarray:
+    """
+    :return: the amount of frames each worker gets when the scenes are dispatched in order, round-robin
+    """
+    return np.bincount(
+        np.arange(len(lengths)) % workers, weights=lengths, minlength=workers
+    )
 
-        # Calculate the change in variance
-        delta_variance = neighbor_variance - current_variance
 
-        # Accept the neighbor solution if it's better or according to the temperature and a random probability
-        if delta_variance < 0 or random.uniform(0, 1) < math.exp(
-            -delta_variance / temperature
-        ):
-            current_solution = neighbor_solution
+def annealing(
+    scenes: List[ChunkEncoder], iterations: int, workers: int = -1
+) -> List[ChunkEncoder]:
+    """
+    Reorder scenes so that when dispatched in order across `workers` every worker gets a similar amount of frames.
+    Simulated annealing on the variance of the per-worker load, a swap only moves frames between two workers,
+    so its variance delta is computed in O(1) instead of rescoring the whole order
+    :param scenes: scenes to reorder
+    :param iterations: number of swaps to try
+    :param workers: number of parallel workers, -1 for the core count
+    :return: reordered scenes
+    """
+    if workers == -1:
+        workers = os.cpu_count()
+    workers = min(workers, len(scenes))
+
+    if len(scenes) < 2 or workers < 2 or iterations < 1:
+        return scenes
 
-        # Update the best solution
-        if get_variance(current_solution) < get_variance(best_solution):
-            best_solution = current_solution
+    lengths = np.array([scene.chunk.length for scene in scenes], dtype=np.float64)
+    loads = get_worker_loads(lengths, workers)
+
+    rng = np.random.default_rng()
+    positions_a = rng.integers(0, len(scenes), iterations)
+    positions_b = rng.integers(0, len(scenes), iterations)
+    coin_flips = rng.random(iterations)
+
+    # start hot enough to accept a swap of two average scenes, end ~10^4 times colder
+    temperature = max(float(np.var(lengths)), 1.0) / workers
+    cooling_rate = 1e-4 ** (1 / iterations)
+
+    # the hot loop is scalar math, plain lists are faster to index than numpy arrays
+    order = list(range(len(scenes)))
+    lengths = lengths.tolist()
+    loads = loads.tolist()
+
+    variance_delta_so_far = 0.0
+    best_variance_delta = 0.0
+    # swaps done since the best order was seen, undone at the end instead of copying the order on every improvement
+    swaps_since_best = []
+
+    for a, b, coin_flip in zip(
+        positions_a.tolist(), positions_b.tolist(), coin_flips.tolist()
+    ):
+        worker_a, worker_b = a % workers, b % workers
+        if worker_a == worker_b:
+            temperature *= cooling_rate
+            continue
+
+        moved = lengths[order[b]] - lengths[order[a]]
+        load_a, load_b = loads[worker_a], loads[worker_b]
+        # ((a + m)² + (b - m)² - a² - b²) / workers, the mean load doesn't change
+        delta_variance = 2 * moved * (load_a - load_b + moved) / workers
+
+        if delta_variance < 0 or coin_flip < math.exp(-delta_variance / temperature):
+            order[a], order[b] = order[b], order[a]
+            loads[worker_a] = load_a + moved
+            loads[worker_b] = load_b - moved
+            variance_delta_so_far += delta_variance
+            swaps_since_best.append((a, b))
+
+            if variance_delta_so_far < best_variance_delta:
+                best_variance_delta = variance_delta_so_far
+                swaps_since_best.clear()
 
-        # Cool down the temperature
         temperature *= cooling_rate
 
-    return best_solution
+    for a, b in reversed(swaps_since_best):
+        order[a], order[b] = order[b], order[a]
+
+    return [scenes[i] for i in order]
@@ -3,6 +3,7 @@ import os.path
 from tqdm import tqdm
 
 from alabamaEncode.core.ffmpeg import Ffmpeg
+from alabamaEncode.core.util.ivf import IvfReader, IvfError
 from alabamaEncode.core.util.kv import AlabamaKv
 from alabamaEncode.core.util.path import PathAlabama
 
@@ -173,6 +174,20 @@ class ChunkObject:
     def log_prefix(self):
         return f"[{self.chunk_index}] "
 
+    def get_encoded_frame_count(self) -> int:
+        """
+        Frame count of the encoded chunk, validated in the same single pass over the file.
+        Ivf chunks are parsed natively without spawning anything, other containers take one ffprobe demux
+        :return: frame count, -1 if the chunk is broken
+        """
+        if os.path.splitext(self.chunk_path)[1] == ".ivf":
+            try:
+                with IvfReader(self.chunk_path) as ivf:
+                    return ivf.count_frames()
+            except IvfError:
+                return -1
+        return Ffmpeg.get_frame_count_verified(PathAlabama(self.chunk_path))
+
     def verify_integrity(self, length_of_sequence=-1, quiet=False) -> bool:
         """
         checks the integrity of a chunk
@@ -184,11 +199,10 @@ class ChunkObject:
             return True
 
         try:
-            path = PathAlabama(self.chunk_path)
-            if Ffmpeg.check_for_invalid(path):
+            actual_frame_count = self.get_encoded_frame_count()
+            if actual_frame_count == -1:
                 raise FfmpegDecodeFailException()
 
-            actual_frame_count = Ffmpeg.get_frame_count(path)
             expected_frame_count = self.last_frame_index - self.first_frame_index
 
             if actual_frame_count != expected_frame_count:
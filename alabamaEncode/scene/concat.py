@@ -1,4 +1,7 @@
 import os
+import shlex
+import shutil
+import subprocess
 import tempfile
 import time
 from typing import List
@@ -8,6 +11,7 @@ from tqdm import tqdm
 from alabamaEncode.core.ffmpeg import Ffmpeg
 from alabamaEncode.core.util.bin_utils import get_binary
 from alabamaEncode.core.util.cli_executor import run_cli
+from alabamaEncode.core.util.ivf import concat_ivf, IvfError, IvfReader
 from alabamaEncode.core.util.path import PathAlabama
 
 
@@ -102,7 +106,7 @@ class VideoConcatenator:
                     f'{get_binary("ffmpeg")} -v error -y -stats {start_offset} -i {og_file.get_safe()} {end_offset} '
                     f'-map 0:s:{sub_counter} "{out_path}"'
                 )
-                run_cli(a)
+                run_cli(shlex.split(a))
             except Exception as e:
                 # print(e)
                 pass
@@ -131,13 +135,50 @@ class VideoConcatenator:
 
         self.vid_output = f"{self.temp_dir}vid{concat_vid_ext}"
         print("Concating Video")
-        if not os.path.exists(self.vid_output):
-            os.system(
-                f'{get_binary("ffmpeg")} -y -stats -v error -f concat '
-                f'-safe 0 -i "{concat_file_path}" -c:v copy -map_metadata -1 -vsync cfr "{self.vid_output}"'
-            )
-        if Ffmpeg.check_for_invalid(PathAlabama(self.vid_output)):
-            raise Exception("Concating chunks failed")
+        concated_natively = False
+        if concat_vid_ext == ".ivf" and all(f.endswith(".ivf") for f in self.files):
+            # ivf chunks can be stitched by rewriting the headers, no need to push them through ffmpeg
+            if not os.path.exists(self.vid_output):
+                try:
+                    concat_ivf(self.files, self.vid_output)
+                except IvfError as e:
+                    print(f"Native ivf concat failed, falling back to ffmpeg: {e}")
+                    if os.path.exists(self.vid_output):
+                        os.remove(self.vid_output)
+            if os.path.exists(self.vid_output):
+                try:
+                    with IvfReader(self.vid_output) as ivf:
+                        ivf.count_frames()
+                    concated_natively = True
+                except IvfError:
+                    os.remove(self.vid_output)
+
+        if not concated_natively:
+            if not os.path.exists(self.vid_output):
+                subprocess.run(
+                    [
+                        get_binary("ffmpeg"),
+                        "-y",
+                        "-stats",
+                        "-v",
+                        "error",
+                        "-f",
+                        "concat",
+                        "-safe",
+                        "0",
+                        "-i",
+                        concat_file_path,
+                        "-c:v",
+                        "copy",
+                        "-map_metadata",
+                        "-1",
+                        "-vsync",
+                        "cfr",
+                        self.vid_output,
+                    ]
+                )
+            if Ffmpeg.check_for_invalid(PathAlabama(self.vid_output)):
+                raise Exception("Concating chunks failed")
 
         os.remove(concat_file_path)
 
@@ -172,7 +213,7 @@ class VideoConcatenator:
 
         encode_audio = " ".join(vec)
         if not os.path.exists(self.audio_output):
-            os.system(encode_audio)
+            subprocess.run(shlex.split(encode_audio))
         if Ffmpeg.check_for_invalid(PathAlabama(self.audio_output)):
             raise Exception("Audio Track encoding Failed")
 
@@ -241,7 +282,7 @@ class VideoConcatenator:
             ]
 
             encode_audio = " ".join(vec)
-            os.system(encode_audio)
+            subprocess.run(shlex.split(encode_audio))
             if Ffmpeg.check_for_invalid(PathAlabama(self.output)):
                 print("Invalid file found, exiting")
                 return
@@ -262,8 +303,19 @@ class VideoConcatenator:
             if not has_audio_track:
                 print("No audio track found, not encoding")
             print("Skipping audio")
-            os.system(
-                f"{get_binary('ffmpeg')} -y -stats -v error -i {self.vid_output} -c copy {self.output}"
+            subprocess.run(
+                [
+                    get_binary("ffmpeg"),
+                    "-y",
+                    "-stats",
+                    "-v",
+                    "error",
+                    "-i",
+                    self.vid_output,
+                    "-c",
+                    "copy",
+                    self.output,
+                ]
             )
             os.remove(self.vid_output)
             if Ffmpeg.check_for_invalid(PathAlabama(self.output)):
@@ -334,7 +386,7 @@ class VideoConcatenator:
             ]
 
             final_command = " ".join(vec)
-            out = run_cli(final_command).verify().get_output()
+            out = run_cli(shlex.split(final_command)).verify().get_output()
             if (
                 "Subtitle encoding currently only possible from text to text or bitmap to bitmap"
                 in str(out)
@@ -344,7 +396,7 @@ class VideoConcatenator:
                     if "mov_text" in a or "map 2:s" in a:
                         vec.remove(a)
                 final_command = " ".join(vec)
-                run_cli(final_command).verify()
+                run_cli(shlex.split(final_command)).verify()
         else:
             subs_i = ""
             subs_map = ""
@@ -373,7 +425,7 @@ class VideoConcatenator:
                 f"{title_bit} -map 0:v -map 1:a {subs_map} -movflags +faststart -map_chapters -1 "
                 f'-c:v copy -c:a copy -vsync cfr "{self.output}"'
             )
-            os.system(final_command)
+            subprocess.run(shlex.split(final_command))
 
         os.remove(self.vid_output)
         os.remove(self.audio_output)
@@ -404,7 +456,7 @@ def test():
     create_fake_ivf_and_test(temp_dir)
 
     # remove temp dir
-    os.system(f"rm -rf {temp_dir}")
+    shutil.rmtree(temp_dir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+import os
+
+import numpy as np
+
+from alabamaEncode.core.util.cli_executor import run_cli
+
+
+class KeyframeIndex:
+    """
+    Display order frame numbers of a source's keyframes, read from the packet flags with ffprobe (demux only,
+    nothing gets decoded) and saved as a .npz so it's read once per job, or again once the source changed.
+    Seeking to a chunk decodes from the keyframe at or before its first frame, a chunk that starts on a keyframe
+    doesn't decode anything it throws away.
+    example:
+    index = KeyframeIndex.build(input_file, f"{temp_folder}keyframe_index.npz")
+    wasted = index.get_wasted_frames(chunk.first_frame_index)
+    """
+
+    def __init__(self, keyframes: np.ndarray):
+        self.keyframes = keyframes
+
+    def __len__(self):
+        return len(self.keyframes)
+
+    @staticmethod
+    def read_keyframes(input_file: str) -> np.ndarray:
+        """
+        :return: sorted frame numbers of the keyframes of the first video stream
+        """
+        output = (
+            run_cli(
+                [
+                    "ffprobe",
+                    "-v",
+                    "error",
+                    "-select_streams",
+                    "v:0",
+                    "-show_entries",
+                    "packet=pts,flags",
+                    "-of",
+                    "csv=p=0",
+                    input_file,
+                ]
+            )
+            .verify(fail_message=f"Reading the packets of {input_file} failed")
+            .get_output()
+        )
+
+        pts = []
+        is_keyframe = []
+        for line in output.splitlines():
+            fields = line.strip().split(",")
+            if len(fields) < 2:
+                continue
+            pts.append(fields[0])
+            is_keyframe.append("K" in fields[1])
+        if len(pts) == 0:
+            raise RuntimeError(f"No video packets in {input_file}")
+
+        # packets are in decode order, the frame number is the rank of the pts,
+        # streams without timestamps (e.g. raw annex b) don't reorder, so it's the packet number
+        frame_numbers = np.arange(len(pts))
+        if "N/A" not in pts:
+            frame_numbers[np.argsort(np.array(pts, dtype=np.int64), kind="stable")] = (
+                np.arange(len(pts))
+            )
+        return np.sort(frame_numbers[np.array(is_keyframe)])
+
+    @staticmethod
+    def build(input_file: str, index_path: str):
+        """
+        Load the index from `index_path`, or read the keyframes of `input_file` and save it there.
+        The size & mtime of the source are saved along, the index is rebuilt when they don't match anymore
+        """
+        stat = os.stat(input_file)
+        source = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        if os.path.exists(index_path):
+            saved = np.load(index_path)
+            if isinstance(saved, np.lib.npyio.NpzFile):
+                with saved:
+                    if np.array_equal(saved["source"], source):
+                        return KeyframeIndex(saved["keyframes"])
+
+        keyframes = KeyframeIndex.read_keyframes(input_file)
+        with open(f"{index_path}.tmp", "wb") as f:
+            np.savez(f, keyframes=keyframes, source=source)
+        os.replace(f"{index_path}.tmp", index_path)
+        return KeyframeIndex(keyframes)
+
+    def get_keyframe_before(self, frame: int) -> int:
+        """
+        :return: the keyframe at or before `frame`, where decoding has to start to get it
+        """
+        i = np.searchsorted(self.keyframes, frame, side="right") - 1
+        return int(self.keyframes[i]) if i >= 0 else 0
+
+    def get_wasted_frames(self, frame: int) -> int:
+        """
+        :return: how many frames are decoded and thrown away when seeking to `frame`
+        """
+        return frame - self.get_keyframe_before(frame)
+
+    def get_nearest_keyframe(self, frame: int, tolerance: int) -> int:
+        """
+        :return: the keyframe closest to `frame` that's at most `tolerance` frames away, `frame` if there's none
+        """
+        i = np.searchsorted(self.keyframes, frame)
+        candidates = [
+            int(self.keyframes[j]) for j in [i - 1, i] if 0 <= j < len(self.keyframes)
+        ]
+        candidates = [c for c in candidates if abs(c - frame) <= tolerance]
+        if len(candidates) == 0:
+            return frame
+        return min(candidates, key=lambda c: abs(c - frame))
@@ -1,14 +1,615 @@
+import asyncio
 import copy
 import json
 import os
-
-from scenedetect import detect, AdaptiveDetector
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import AsyncIterator, Callable, Iterator, List, Tuple
+
+import numpy as np
+from scenedetect import (
+    detect,
+    AdaptiveDetector,
+    FrameTimecode,
+    SceneManager,
+    open_video,
+)
+from scenedetect.scene_manager import get_scenes_from_cuts
+from tqdm import tqdm
 
 from alabamaEncode.core.ffmpeg import Ffmpeg
+from alabamaEncode.core.util.bin_utils import get_binary
 from alabamaEncode.core.util.path import PathAlabama
 from alabamaEncode.scene.chunk import ChunkObject
+from alabamaEncode.scene.keyframe_index import KeyframeIndex
 from alabamaEncode.scene.sequence import ChunkSequence
 
+detector_options = dict(window_width=10, adaptive_threshold=2.5, min_content_val=12)
+# seconds, shorter segments aren't worth the seek and process startup
+min_segment_length = 60
+# seconds decoded before each segment to line it up with the previous one
+segment_overlap = 1
+# height the fast path scores frames at, and how many frames it reads & scores at once
+fast_detection_height = 360
+fast_detection_batch = 64
+
+
+class StreamingDetectionError(Exception):
+    """
+    Scene detection failed while chunks were streamed out of it, detecting the whole file first can still work
+    """
+
+
+class _FrameScoreRecorder(AdaptiveDetector):
+    """
+    Keeps the content score of every frame it sees, so the cut decisions can be made over the whole timeline later
+    :param frame_score_callback: called with every score instead of keeping them
+    """
+
+    def __init__(self, frame_score_callback: Callable[[float], None] = None):
+        super().__init__(**detector_options)
+        self.frame_scores = []
+        self.frame_score_callback = frame_score_callback
+
+    def _calculate_frame_score(self, timecode, frame_img) -> float:
+        score = super()._calculate_frame_score(timecode, frame_img)
+        if self.frame_score_callback is not None:
+            self.frame_score_callback(score)
+        else:
+            self.frame_scores.append(score)
+        return score
+
+
+class _FrameScoreReplay(AdaptiveDetector):
+    """
+    AdaptiveDetector that is given the content score of every frame instead of computing it from the frame
+    """
+
+    def __init__(self):
+        super().__init__(**detector_options)
+        self._next_score = None
+
+    def _calculate_frame_score(self, timecode, frame_img) -> float:
+        return self._next_score
+
+    def push(self, timecode: FrameTimecode, score: float) -> List[FrameTimecode]:
+        """
+        :return: cuts that became final with this frame, they lag `window_width` frames behind it
+        """
+        self._next_score = score
+        return self.process_frame(timecode, None)
+
+
+def _get_segment_frame_scores(
+    input_file: str, first_frame: int, last_frame: int
+) -> Tuple[int, List[float]]:
+    """
+    Content score of every frame in [first_frame, last_frame), -1 to go until the end of the file
+    :return: first_frame and the scores
+    """
+    video = open_video(input_file)
+    if first_frame > 0:
+        video.seek(first_frame)
+    detector = _FrameScoreRecorder()
+    scene_manager = SceneManager()
+    scene_manager.add_detector(detector)
+    scene_manager.detect_scenes(
+        video=video, end_time=last_frame if last_frame != -1 else None
+    )
+    return first_frame, detector.frame_scores
+
+
+def _stitch_segment(
+    frame_scores: List[float], segment_first_frame: int, segment: List[float]
+) -> int:
+    """
+    Find where `segment` (its first score is always 0, there is no previous frame) lines up with the end of
+    `frame_scores` by matching the scores they overlap in. Seeking can land a frame or two off
+    :return: the offset of `segment` in `frame_scores`
+    :raises ValueError: when no offset matches the overlap exactly
+    """
+    overlap = len(frame_scores) - segment_first_frame
+    best_offset, best_error = None, None
+    for shift in [0, -1, 1, -2, 2]:
+        offset = segment_first_frame + shift
+        if offset < 0 or offset >= len(frame_scores):
+            continue
+        length = min(len(frame_scores) - offset, len(segment)) - 1
+        if length <= 0:
+            continue
+        error = np.abs(
+            np.array(frame_scores[offset + 1 : offset + 1 + length])
+            - np.array(segment[1 : 1 + length])
+        ).mean()
+        if best_error is None or error < best_error:
+            best_offset, best_error = offset, error
+        if error == 0:
+            break
+    if best_offset is None:
+        raise ValueError(
+            f"Scene detection segment at frame {segment_first_frame} doesn't overlap the previous one"
+        )
+    if best_error:
+        # the cuts around the seam could differ from a single pass, let the caller fall back to one
+        raise ValueError(
+            f"Scene detection segment at frame {segment_first_frame} doesn't line up with the previous one"
+            f" over the {overlap} frame overlap"
+        )
+    return best_offset
+
+
+def detect_scenes_segmented(
+    input_file: str, framerate: float, workers: int = -1
+) -> List[Tuple[int, int]]:
+    """
+    Same scenes as `scenedetect.detect` with the adaptive detector, but the timeline is split into segments
+    that are scored in parallel, each in its own process seeking to its start.
+    The content scores only depend on a frame and the one before it, so each segment decodes a short overlap in front
+    of it to line up with the previous one, and the adaptive cut decision (which looks at a window around every frame
+    and at the last cut) is replayed over the stitched scores of the whole timeline, giving identical cuts.
+    :param workers: number of processes, -1 for one per core
+    :return: list of (start frame, end frame) scenes
+    """
+    if workers == -1:
+        workers = os.cpu_count()
+    total_frames = Ffmpeg.get_frame_count_fast(PathAlabama(input_file))
+    segments = max(1, min(workers, total_frames // int(min_segment_length * framerate)))
+    overlap = max(
+        int(segment_overlap * framerate), 2 * detector_options["window_width"] + 1
+    )
+
+    boundaries = [int(total_frames * i / segments) for i in range(segments)] + [-1]
+    print(f"Running scene detection in {segments} segments")
+
+    results = [None] * segments
+    with ProcessPoolExecutor(max_workers=segments) as executor:
+        futures = {
+            executor.submit(
+                _get_segment_frame_scores,
+                input_file,
+                max(0, boundaries[i] - overlap),
+                boundaries[i + 1],
+            ): i
+            for i in range(segments)
+        }
+        with tqdm(total=segments, desc="Scene detection segments") as progress:
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                progress.update()
+
+    frame_scores = []
+    for i, (first_frame, segment) in enumerate(results):
+        if i == 0:
+            frame_scores = list(segment)
+            continue
+        offset = _stitch_segment(frame_scores, first_frame, segment)
+        # the previous segment ends at this one's boundary, keep everything past it
+        frame_scores += segment[len(frame_scores) - offset :]
+
+    detector = _FrameScoreReplay()
+    cuts = []
+    for frame, score in enumerate(frame_scores):
+        cuts += detector.push(FrameTimecode(frame, framerate), score)
+    if len(cuts) == 0:
+        return []
+    scene_list = get_scenes_from_cuts(
+        cut_list=sorted(set(cuts)),
+        start_pos=FrameTimecode(0, framerate),
+        end_pos=FrameTimecode(len(frame_scores), framerate),
+    )
+    return [(scene[0].get_frames(), scene[1].get_frames()) for scene in scene_list]
+
+
+def get_luma_pipe_command(input_file: str, width: int, height: int) -> List[str]:
+    """
+    :return: argv of an ffmpeg that decodes the input and writes raw gray8 frames of `width`x`height` to stdout
+    """
+    return [
+        get_binary("ffmpeg"),
+        "-v",
+        "error",
+        "-nostdin",
+        "-hwaccel",
+        "auto",
+        "-i",
+        input_file,
+        "-map",
+        "0:v:0",
+        "-an",
+        "-sn",
+        "-vf",
+        f"scale={width}:{height}:flags=area",
+        "-pix_fmt",
+        "gray",
+        "-f",
+        "rawvideo",
+        "-",
+    ]
+
+
+def iter_luma_frame_scores(
+    input_file: str, width: int, height: int, batch: int = fast_detection_batch
+) -> Iterator[np.ndarray]:
+    """
+    Luma-only content score (mean absolute difference to the previous frame) of every frame,
+    yielded `batch` frames at a time, the first frame scores 0.
+    Frames are read straight from ffmpeg into a ring of `batch` + 1 frames, the extra slot carries the last frame of
+    the previous batch over so every frame is compared with the one before it.
+    Raises RuntimeError once all frames are read if ffmpeg failed, the scores would end where it stopped
+    """
+    frame_size = width * height
+    ring = np.empty((batch + 1, height, width), dtype=np.uint8)
+    ring_bytes = memoryview(ring.reshape(-1))
+    have_previous = False
+
+    errors = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        get_luma_pipe_command(input_file, width, height),
+        stdout=subprocess.PIPE,
+        stderr=errors,
+    )
+    try:
+        while True:
+            filled = 0
+            view = ring_bytes[frame_size:]
+            while filled < len(view):
+                read = process.stdout.readinto(view[filled:])
+                if not read:
+                    break
+                filled += read
+            frames = filled // frame_size
+            if frames == 0:
+                break
+
+            current = ring[1 : frames + 1]
+            previous = ring[0:frames]
+            if not have_previous:
+                current, previous = current[1:], previous[1:]
+            difference = np.maximum(current, previous)
+            difference -= np.minimum(current, previous)
+            scores = (
+                difference.reshape(len(difference), -1).sum(axis=1, dtype=np.uint64)
+                / frame_size
+            )
+            if not have_previous:
+                scores = np.concatenate([[0.0], scores])
+                have_previous = True
+            yield scores
+
+            ring[0] = ring[frames]
+            if frames < batch:
+                break
+
+        if process.wait() != 0:
+            errors.seek(0)
+            raise RuntimeError(
+                f"ffmpeg failed decoding {input_file}: {errors.read()[-1000:].decode(errors='ignore').strip()}"
+            )
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        errors.close()
+
+
+def verify_decoded_frame_count(
+    input_file: str, decoded_frames: int, expected_frames: int, framerate: float
+):
+    """
+    ffmpeg can exit cleanly after dropping frames it failed to decode, a shorter timeline would silently cut off the
+    end of the encode. The expected count comes from the container duration, so allow a bit of slack for streams
+    that end before the audio does
+    """
+    if decoded_frames < expected_frames - max(2 * framerate, expected_frames * 0.01):
+        raise RuntimeError(
+            f"ffmpeg only decoded {decoded_frames} of ~{expected_frames} frames from {input_file}"
+        )
+
+
+def adaptive_cuts(
+    frame_scores: np.ndarray,
+    window_width: int = 10,
+    adaptive_threshold: float = 2.5,
+    min_content_val: float = 12,
+    min_scene_len: int = 15,
+) -> List[int]:
+    """
+    Vectorised `AdaptiveDetector` decision over the content scores of a whole timeline:
+    a frame is a cut if its score is `adaptive_threshold` times the average of the `window_width` frames around it,
+    at least `min_content_val`, and it's `min_scene_len` frames after the last cut
+    :return: frame numbers of the cuts
+    """
+    frame_scores = np.asarray(frame_scores, dtype=np.float64)
+    if len(frame_scores) < 2 * window_width + 1:
+        return []
+    target = frame_scores[window_width:-window_width]
+    windows = np.lib.stride_tricks.sliding_window_view(
+        frame_scores, 2 * window_width + 1
+    )
+    average = (windows.sum(axis=1) - target) / (2 * window_width)
+    average_is_zero = np.abs(average) < 0.00001
+    adaptive_ratio = np.where(
+        average_is_zero,
+        np.where(target >= min_content_val, 255.0, 0.0),
+        np.minimum(target / np.where(average_is_zero, 1, average), 255.0),
+    )
+    candidates = (
+        np.flatnonzero(
+            (adaptive_ratio >= adaptive_threshold) & (target >= min_content_val)
+        )
+        + window_width
+    )
+
+    cuts = []
+    last_cut = 0
+    for frame in candidates:
+        if frame - last_cut >= min_scene_len:
+            cuts.append(int(frame))
+            last_cut = frame
+    return cuts
+
+
+def detect_scenes_fast(input_file: str) -> List[Tuple[int, int]]:
+    """
+    Fast scene detection: ffmpeg (with hwaccel where available) decodes and scales the input down to
+    `fast_detection_height` gray8 frames, the content scores are luma-only differences computed with numpy over
+    batches of frames and the cuts come from the vectorised adaptive decision.
+    Runs at several hundred fps on 4k sources, at the cost of ignoring hue & saturation changes
+    :return: list of (start frame, end frame) scenes, like `scenedetect.detect`
+    """
+    source_width = Ffmpeg.get_width(PathAlabama(input_file))
+    source_height = Ffmpeg.get_height(PathAlabama(input_file))
+    height = min(fast_detection_height, source_height)
+    width = max(2, round(source_width * height / source_height / 2) * 2)
+
+    expected_frames = Ffmpeg.get_frame_count_fast(PathAlabama(input_file))
+    frame_scores = []
+    with tqdm(
+        total=expected_frames,
+        unit="frames",
+        desc="Fast scene detection",
+    ) as progress:
+        for scores in iter_luma_frame_scores(input_file, width, height):
+            frame_scores.append(scores)
+            progress.update(len(scores))
+    if len(frame_scores) == 0:
+        raise RuntimeError(f"ffmpeg didn't decode any frames from {input_file}")
+    frame_scores = np.concatenate(frame_scores)
+    verify_decoded_frame_count(
+        input_file,
+        len(frame_scores),
+        expected_frames,
+        Ffmpeg.get_video_frame_rate(PathAlabama(input_file)),
+    )
+
+    cuts = adaptive_cuts(frame_scores, **detector_options)
+    if len(cuts) == 0:
+        return []
+    boundaries = [0] + cuts + [len(frame_scores)]
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def split_scene(
+    start_frame: int,
+    end_frame: int,
+    max_duration_frames: int,
+    keyframes: KeyframeIndex = None,
+) -> List[Tuple[int, int]]:
+    """
+    Split a scene longer than `max_duration_frames` into evenly sized chunks that are within it
+    :param keyframes: move the splits onto nearby keyframes of the source, so seeking to those chunks doesn't
+    decode frames that get thrown away, chunks still stay within `max_duration_frames`
+    :return: list of (start frame, end frame) chunks
+    """
+    duration = end_frame - start_frame
+    if duration <= max_duration_frames:
+        return [(start_frame, end_frame)]
+
+    num_chunks = int(duration / max_duration_frames) + 1
+    chunk_duration = duration / num_chunks
+    splits = [int(start_frame + j * chunk_duration) for j in range(1, num_chunks)]
+    if keyframes is not None:
+        tolerance = int(
+            min(chunk_duration / 4, (max_duration_frames - chunk_duration) / 2)
+        )
+        splits = [keyframes.get_nearest_keyframe(split, tolerance) for split in splits]
+
+    # any remaining frames end up in the last chunk
+    boundaries = [start_frame] + splits + [end_frame]
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _load_keyframe_index(input_file: str, index_path: str) -> [KeyframeIndex | None]:
+    """
+    :return: the keyframe index of the source, None if it's not wanted or the source has no usable packet flags
+    """
+    if index_path is None or index_path == "":
+        return None
+    try:
+        keyframes = KeyframeIndex.build(input_file, index_path)
+    except RuntimeError as e:
+        print(f"Failed to index the keyframes ({e}), chunks won't be keyframe aligned")
+        return None
+    print(f"Found {len(keyframes)} keyframes in the source")
+    return keyframes
+
+
+def _print_wasted_decode(
+    chunks: List[ChunkObject], keyframes: KeyframeIndex, baseline_starts: List[int]
+):
+    """
+    :param baseline_starts: first frames the chunks would have without keyframe alignment, for comparison
+    """
+    wasted = [keyframes.get_wasted_frames(c.first_frame_index) for c in chunks]
+    baseline = [keyframes.get_wasted_frames(start) for start in baseline_starts]
+    aligned = sum(1 for w in wasted if w == 0)
+    baseline_aligned = sum(1 for w in baseline if w == 0)
+    print(
+        f"{aligned}/{len(chunks)} chunks start on a keyframe ({baseline_aligned} without aligning), "
+        f"{np.mean(wasted):.1f} frames decoded before the first frame per chunk on average "
+        f"({np.mean(baseline):.1f} without aligning)"
+    )
+
+
+def _detect_scenes_incrementally(
+    input_file: str,
+    framerate: float,
+    scene_callback: Callable[[Tuple[int, int]], None],
+    fast_detection=False,
+) -> List[Tuple[int, int]]:
+    """
+    Runs the detection, calling `scene_callback` with every scene as soon as the cut that ends it is final.
+    The scores are fed one frame at a time through the same adaptive decision as the other paths,
+    so the scenes are the same ones `detect_scenes_fast` / `scenedetect.detect` find
+    :return: the whole scene list
+    """
+    detector = _FrameScoreReplay()
+    scene_list = []
+    frame = 0
+    last_cut = 0
+
+    def on_frame_score(score: float):
+        nonlocal frame, last_cut
+        for cut in detector.push(FrameTimecode(frame, framerate), score):
+            scene_list.append((last_cut, cut.frame_num))
+            scene_callback(scene_list[-1])
+            last_cut = cut.frame_num
+        frame += 1
+
+    if fast_detection:
+        source_width = Ffmpeg.get_width(PathAlabama(input_file))
+        source_height = Ffmpeg.get_height(PathAlabama(input_file))
+        height = min(fast_detection_height, source_height)
+        width = max(2, round(source_width * height / source_height / 2) * 2)
+        for scores in iter_luma_frame_scores(input_file, width, height):
+            for score in scores:
+                on_frame_score(float(score))
+        verify_decoded_frame_count(
+            input_file,
+            frame,
+            Ffmpeg.get_frame_count_fast(PathAlabama(input_file)),
+            framerate,
+        )
+    else:
+        scene_manager = SceneManager()
+        scene_manager.add_detector(_FrameScoreRecorder(on_frame_score))
+        scene_manager.detect_scenes(video=open_video(input_file), show_progress=True)
+
+    # without any cuts the detectors don't return any scenes either
+    if len(scene_list) > 0:
+        scene_list.append((last_cut, frame))
+        scene_callback(scene_list[-1])
+    return scene_list
+
+
+async def stream_scene_detect(
+    input_file: str,
+    cache_file_path: str,
+    max_scene_length: int = 10,
+    scene_merge=False,
+    fast_detection=False,
+    keyframe_index_path: str = None,
+) -> AsyncIterator[ChunkObject]:
+    """
+    Scene detection that yields every chunk as soon as it's final, while the rest of the file is still being
+    detected, so they can already be encoded. Detection runs in a thread.
+    Chunks, chunk indexes and the `cache_file_path` / `.untouched` caches it writes once it's done are the same as
+    `scene_detect`'s, offsets and static length scenes aren't supported
+    """
+    framerate: float = Ffmpeg.get_video_frame_rate(PathAlabama(input_file))
+    width: int = Ffmpeg.get_width(PathAlabama(input_file))
+    height: int = Ffmpeg.get_height(PathAlabama(input_file))
+    max_duration_frames = int(max_scene_length * framerate)
+    keyframes = _load_keyframe_index(input_file, keyframe_index_path)
+
+    loop = asyncio.get_running_loop()
+    scenes: asyncio.Queue = asyncio.Queue()
+    detection_result = []
+
+    def detect_scenes():
+        try:
+            detection_result.append(
+                _detect_scenes_incrementally(
+                    input_file,
+                    framerate,
+                    lambda scene: loop.call_soon_threadsafe(scenes.put_nowait, scene),
+                    fast_detection=fast_detection,
+                )
+            )
+        except BaseException as e:
+            detection_result.append(e)
+        loop.call_soon_threadsafe(scenes.put_nowait, None)
+
+    print("Running scene detection, encoding chunks as they are detected")
+    threading.Thread(target=detect_scenes, daemon=True).start()
+
+    seq = ChunkSequence([])
+    seq.input_file = input_file
+    baseline_starts = []
+
+    def make_chunk(
+        start_frame: int, end_frame: int, baseline_start: int = None
+    ) -> ChunkObject:
+        baseline_starts.append(
+            start_frame if baseline_start is None else baseline_start
+        )
+        chunk = ChunkObject(
+            start_frame,
+            end_frame,
+            path=input_file,
+            framerate=framerate,
+            width=width,
+            height=height,
+        )
+        chunk.chunk_index = len(seq.chunks)
+        # the yielded chunk gets paths, encode results etc., the cache has to stay as detected
+        seq.chunks.append(copy.deepcopy(chunk))
+        return chunk
+
+    merged_scene = (
+        None  # with scene_merge, the scene that following scenes are merged into
+    )
+    while True:
+        scene = await scenes.get()
+        if scene is None:
+            break
+        if scene_merge:
+            if (
+                merged_scene is not None
+                and scene[1] - merged_scene[0] < 2 * max_duration_frames
+            ):
+                merged_scene = (merged_scene[0], scene[1])
+                continue
+            if merged_scene is not None:
+                yield make_chunk(*merged_scene)
+            merged_scene = scene
+            continue
+        # the same number of chunks, only the splits move
+        for (start, end), (baseline_start, _) in zip(
+            split_scene(scene[0], scene[1], max_duration_frames, keyframes),
+            split_scene(scene[0], scene[1], max_duration_frames),
+        ):
+            yield make_chunk(start, end, baseline_start)
+
+    if isinstance(detection_result[0], BaseException):
+        raise detection_result[0]
+    if merged_scene is not None:
+        yield make_chunk(*merged_scene)
+
+    if len(seq.chunks) == 0:
+        print("Scene detection failed, falling back to a single chunk")
+        yield make_chunk(0, Ffmpeg.get_frame_count(PathAlabama(input_file)))
+
+    if cache_file_path is not None and cache_file_path != "":
+        json.dump(detection_result[0], open(cache_file_path + ".untouched", "w"))
+        open(cache_file_path, "w").write(seq.dump_json())
+    print(f"Detected {len(seq)} scenes")
+    if keyframes is not None:
+        _print_wasted_decode(seq.chunks, keyframes, baseline_starts)
+
 
 def scene_detect(
     input_file: str,
@@ -20,8 +621,15 @@ def scene_detect(
     static_length=False,
     scene_merge=False,
     static_length_size=30,
+    detection_workers=1,
+    fast_detection=False,
+    keyframe_index_path: str = None,
 ) -> ChunkSequence:
     """
+    :param keyframe_index_path: index the keyframes of the source to this .npz and split long scenes on them,
+     see `KeyframeIndex`
+    :param fast_detection: detect on downscaled luma only frames decoded by ffmpeg, see `detect_scenes_fast`
+    :param detection_workers: split the detection into segments over this many processes, -1 for one per core
     :param static_length_size:  size of static length scenes in seconds
     :param static_length: instead of detection, create static length scenes
     :param override_bad_wrong_cache_path:
@@ -63,6 +671,7 @@ def scene_detect(
     height: int = Ffmpeg.get_height(PathAlabama(input_file))
 
     static_length_size = int(static_length_size * framerate)
+    keyframes = _load_keyframe_index(input_file, keyframe_index_path)
 
     if scene_list is None:
         if static_length:
@@ -73,12 +682,24 @@ def scene_detect(
                 (i, min(i + static_length_size, total_size))
                 for i in range(0, total_size, static_length_size)
             ]
-        else:
+        elif fast_detection:
+            try:
+                scene_list = detect_scenes_fast(input_file)
+            except Exception as e:
+                print(f"Fast scene detection failed ({e}), using the regular detector")
+
+        if scene_list is None and not static_length and detection_workers != 1:
+            try:
+                scene_list = detect_scenes_segmented(
+                    input_file, framerate, workers=detection_workers
+                )
+            except Exception as e:
+                print(f"Segmented scene detection failed ({e}), running a single pass")
+
+        if scene_list is None:
             scene_list = detect(
                 video_path=input_file,
-                detector=AdaptiveDetector(
-                    window_width=10, adaptive_threshold=2.5, min_content_val=12
-                ),
+                detector=AdaptiveDetector(**detector_options),
                 show_progress=True,
             )
             scene_list = [
@@ -111,46 +732,39 @@ def scene_detect(
     seq.chunks = []
 
     max_duration_frames = int(max_scene_length * framerate)
+    baseline_starts = []
 
     # iterate through each scene detected in the video
     for scene in scene_list:
         start_frame, end_frame = scene
-        duration = end_frame - start_frame
 
-        # if the scene duration is shorter than max_scene_length, add it as a chunk to the sequence
-        if duration <= max_duration_frames or static_length or scene_merge:
+        if static_length or scene_merge:
+            frame_ranges = [(start_frame, end_frame)]
+            baseline_starts.append(start_frame)
+        else:
+            frame_ranges = split_scene(
+                start_frame, end_frame, max_duration_frames, keyframes
+            )
+            baseline_starts += [
+                start
+                for start, _ in split_scene(start_frame, end_frame, max_duration_frames)
+            ]
+
+        for start, end in frame_ranges:
             seq.chunks.append(
                 ChunkObject(
-                    start_frame,
-                    end_frame,
+                    start,
+                    end,
                     path=input_file,
                     framerate=framerate,
                     width=width,
                     height=height,
                 )
             )
-        else:
-            # otherwise, split the scene into multiple chunks that are shorter than max_scene_length
-            num_chunks = int(duration / max_duration_frames) + 1
-            chunk_duration = duration / num_chunks
-            for j in range(num_chunks):
-                start = int(start_frame + j * chunk_duration)
-                end = int(start_frame + (j + 1) * chunk_duration)
-                if j == num_chunks - 1:
-                    end = end_frame  # add any remaining frames to the last chunk
-                seq.chunks.append(
-                    ChunkObject(
-                        start,
-                        end,
-                        path=input_file,
-                        framerate=framerate,
-                        width=width,
-                        height=height,
-                    )
-                )
 
     if len(seq.chunks) == 0:
         print("Scene detection failed, falling back to a single chunk")
+        baseline_starts = [0]
         seq.chunks.append(
             ChunkObject(
                 0,
@@ -283,4 +897,6 @@ def scene_detect(
         open(cache_file_path, "w").write(seq.dump_json())
 
     print(f"Detected {len(seq)} scenes")
+    if keyframes is not None:
+        _print_wasted_decode(seq.chunks, keyframes, baseline_starts)
     return seq
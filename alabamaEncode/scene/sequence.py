@@ -1,6 +1,7 @@
 import copy
 import os
 import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List
 
 from tqdm.asyncio import tqdm
@@ -107,15 +108,30 @@ class ChunkSequence:
         total_chunks = len(self.chunks)
         invalid_chunks: List[ChunkObject or None] = []
 
-        for chunk in tqdm(seq_chunks, desc="Checking files", unit="file"):
-            if not chunk.is_done(kv=kv, length_of_sequence=total_chunks):
-                invalid_chunks.append(chunk)
+        # each check is one pass over one file, most of it waiting on io or ffprobe, so run them side by side
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            futures = {
+                executor.submit(
+                    chunk.is_done, kv=kv, length_of_sequence=total_chunks
+                ): chunk
+                for chunk in seq_chunks
+            }
+            for future in tqdm(
+                as_completed(futures),
+                total=len(futures),
+                desc="Checking files",
+                unit="file",
+            ):
+                if not future.result():
+                    invalid_chunks.append(futures[future])
 
         del_count = 0
 
-        invalid_chunks: List[ChunkObject] = [
-            chunk for chunk in invalid_chunks if chunk is not None
-        ]
+        # checks finish in any order, report them in sequence order
+        invalid_chunks: List[ChunkObject] = sorted(
+            [chunk for chunk in invalid_chunks if chunk is not None],
+            key=lambda chunk: chunk.chunk_index,
+        )
 
         if len(invalid_chunks) > 0:
             for c in invalid_chunks: